@@ -0,0 +1,136 @@
+# answer_cache.py
+"""
+Semantic answer cache สำหรับ /code/answer
+
+คำถามใหม่จะใช้คำตอบเดิมได้ถ้า embedding ของคำถามคล้ายคำถามที่เคยตอบ
+(cosine >= ANSWER_CACHE_THRESHOLD) ภายใต้ scope เดียวกัน คือ provider, model,
+limit, score_threshold และ mode ของการค้น
+
+แต่ละ entry ผูกกับ commit ที่ index_repo.py บันทึกไว้ใน payload ของ source แต่ละจุด
+ก่อนใช้ entry ผู้เรียกจะตรวจว่า point เหล่านั้นยังอยู่และยังเป็น commit เดิม
+ถ้าโค้ดถูก index ใหม่ entry จะหมดอายุเองโดยไม่ต้องล้าง cache
+"""
+import os
+import math
+import time
+import logging
+import operator
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from embeddings import normalize_text
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "256"))          # entry สูงสุดต่อ scope
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))  # วินาที, 0 = ไม่หมดอายุตามเวลา
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+
+Scope = Tuple[str, str, int, float, str]
+
+def _unit(vec: List[float]) -> List[float]:
+    n = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / n for x in vec]
+
+def _dot(a: List[float], b: List[float]) -> float:
+    return sum(map(operator.mul, a, b))
+
+class CachedAnswer:
+    def __init__(self, query: str, unit_vec: List[float], answer: str, sources: List[Dict[str, Any]], commits: Dict[str, str]):
+        self.query = query
+        self.unit_vec = unit_vec
+        self.answer = answer
+        self.sources = sources
+        # point id -> commit ของ source ที่มาจาก code index
+        self.commits = commits
+        self.created_at = time.time()
+        self.hits = 0
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, max_per_scope: int = ANSWER_CACHE_MAX, ttl: int = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.max_per_scope = max_per_scope
+        self.ttl = ttl
+        self._scopes: Dict[Scope, "OrderedDict[str, CachedAnswer]"] = {}
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+
+    def _expired(self, e: CachedAnswer) -> bool:
+        return bool(self.ttl) and time.time() - e.created_at > self.ttl
+
+    async def lookup(
+        self,
+        scope: Scope,
+        query: str,
+        vec: List[float],
+        is_fresh: Callable[[CachedAnswer], Awaitable[bool]],
+    ) -> Optional[CachedAnswer]:
+        """หา entry ที่คล้ายที่สุดใน scope; is_fresh ใช้ตรวจว่า source ยังเป็น commit เดิม"""
+        entries = self._scopes.get(scope)
+        if not entries:
+            self.misses += 1
+            return None
+
+        key = normalize_text(query)
+        best: Optional[CachedAnswer] = entries.get(key)
+        if best is None:
+            unit = _unit(vec)
+            best_score = self.threshold
+            for e in entries.values():
+                score = _dot(unit, e.unit_vec)
+                if score >= best_score:
+                    best, best_score = e, score
+        if best is None:
+            self.misses += 1
+            return None
+
+        fresh = not self._expired(best)
+        if fresh:
+            try:
+                fresh = await is_fresh(best)
+            except Exception as ex:
+                logger.error(f"Answer cache freshness check failed: {ex}")
+                fresh = False
+        if not fresh:
+            entries.pop(normalize_text(best.query), None)
+            self.stale += 1
+            self.misses += 1
+            return None
+
+        entries.move_to_end(normalize_text(best.query))
+        best.hits += 1
+        self.hits += 1
+        return best
+
+    def store(self, scope: Scope, query: str, vec: List[float], answer: str, sources: List[Dict[str, Any]], commits: Dict[str, str]) -> None:
+        entries = self._scopes.setdefault(scope, OrderedDict())
+        key = normalize_text(query)
+        entries[key] = CachedAnswer(query, _unit(vec), answer, sources, commits)
+        entries.move_to_end(key)
+        while len(entries) > self.max_per_scope:
+            entries.popitem(last=False)
+        self.stores += 1
+
+    def purge(self) -> int:
+        n = sum(len(v) for v in self._scopes.values())
+        self._scopes.clear()
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "threshold": self.threshold,
+            "scopes": len(self._scopes),
+            "entries": sum(len(v) for v in self._scopes.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_evictions": self.stale,
+            "stores": self.stores,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+answer_cache = SemanticAnswerCache()
@@ -179,3 +179,12 @@ async def validate_token_for_ws(token: str) -> Optional[dict]:
 async def get_current_active_user(current_user: Annotated[dict, Depends(get_current_user)]):
     # ในอนาคตอาจเพิ่มการเช็คสถานะ 'disabled' ของ user ที่นี่
     return current_user
+
+# รายชื่อผู้ใช้ที่เรียก endpoint ระดับผู้ดูแลได้ (คั่นด้วย comma)
+# ถ้าไม่ได้ตั้งค่า จะไม่มีใครเป็นผู้ดูแล (endpoint ระดับผู้ดูแลตอบ 403 ทุกคำขอ)
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
+async def get_admin_user(current_user: Annotated[dict, Depends(get_current_active_user)]):
+    if current_user["username"] not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="ต้องเป็นผู้ดูแลระบบ")
+    return current_user
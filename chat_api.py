@@ -1,16 +1,27 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query
 from pydantic import BaseModel, Field
-import httpx, os
+from typing import AsyncIterator, Literal
+import asyncio, httpx, logging, os, re
+from http_clients import HttpClients, get_clients
+from embeddings import embed_query
+from vector_store import VectorStoreError, field_match, field_range, make_filter, vector_store
+from rerank import candidate_limit, diversify
+from context_packer import context_packer
+from history_writer import history_writer
+from llm_scheduler import llm_scheduler, request_key, set_request
+from streaming import ThinkFilter, event_stream_response, iter_ollama_stream, iter_openai_stream
 
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = logging.getLogger(__name__)
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
 OLLAMA_GEN = f"{OLLAMA_URL}/api/generate"
-OLLAMA_EMB = f"{OLLAMA_URL}/api/embeddings"
 OPENAI_URL = "https://api.openai.com/v1/chat/completions"
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
 COLLECTION = "demo_rag"
-BASE_URL = os.getenv("BACKEND_BASE_URL", "http://127.0.0.1:8081")
+LOCAL_MODEL = "qwen3:8b"
+# speculative re-augment: ดูคำว่า "ข้อมูลไม่พอ" ฯลฯ ในช่วงต้นของคำตอบรอบแรก (จำนวนตัวอักษรที่มองเห็น)
+SPECULATIVE_WINDOW = int(os.getenv("CHAT_SPECULATIVE_WINDOW", "160"))
+INSUFFICIENT_MARKERS = ("ข้อมูลไม่พอ", "ไม่พบข้อมูล", "ไม่มีข้อมูลพอ", "ไม่พอ")
 
 class Message(BaseModel):
     role: str
@@ -32,6 +43,8 @@ class Controls(BaseModel):
     log_history: bool = True
     # NEW: บังคับค้นเพิ่มก่อนตอบเสมอ
     force_reaugment: bool = False  # บังคับค้น RAG ก่อนตอบเสมอ
+    # ค้นบริบทเพิ่มไปพร้อมกับคำตอบรอบแรก และหยุดรอบแรกทันทีที่ช่วงต้นบอกว่าข้อมูลไม่พอ
+    speculative_reaugment: bool = True
 
 class Packet(BaseModel):
     question: str
@@ -51,33 +64,53 @@ class GenResp(BaseModel):
     used_model: str
     answer: str
     sources: list[dict] = []
+    prompt_tokens: int | None = None  # token (โดยประมาณ) ของ prompt สุดท้ายที่ส่งให้โมเดล
 
-def build_prompt(p: Packet, ctx: str) -> str:
-    recent = "\n".join(f"{m.role}: {m.content}" for m in p.recent_window)
+# แต่ละก้อนที่ augment() ต่อท้าย rag_bundle ขึ้นต้นด้วย "\n\n--- [TAG]"
+_BUNDLE_BLOCK = re.compile(r"(?=\n\n--- \[)")
+
+def render_prompt(question: str, ctx: str, recent: str) -> str:
     return (
         "คุณคือผู้ช่วยทีมพัฒนาซอฟต์แวร์ ตอบเป็นภาษาไทยเท่านั้น และตอบแบบ bullet สั้น กระชับ ไม่เกิน 8 บรรทัด\n"
         "ห้ามใส่ข้อมูลนอกเหนือจากบริบท ถ้าไม่พอให้ตอบว่า \"ข้อมูลไม่พอ\"\n\n"
         f"[บริบทจาก RAG]\n{ctx}\n\n"
         f"[บริบทล่าสุด]\n{recent}\n\n"
-        f"[คำถาม]\n{p.question}"
+        f"[คำถาม]\n{question}"
+    )
+
+def resolve_model(p: Packet) -> str:
+    return LOCAL_MODEL if p.controls.model_selection == "local" else p.controls.model_name
+
+def build_prompt(p: Packet, ctx: str) -> tuple[str, int]:
+    """คืน (prompt, จำนวน token โดยประมาณ) rag_bundle และ recent_window ถูกตัดให้อยู่ในงบของโมเดล"""
+    blocks = [b.strip("\n") for b in _BUNDLE_BLOCK.split(ctx) if b.strip()]
+    recent = [f"{m.role}: {m.content}" for m in p.recent_window]
+    packed = context_packer.pack(
+        context_packer.budget_for(resolve_model(p)),
+        render_prompt(p.question, "", ""),
+        blocks,
+        recent,
     )
+    prompt = render_prompt(p.question, "\n\n".join(packed.context), "\n".join(packed.history))
+    return prompt, context_packer.measure(prompt, packed.truncated)
 
 def seems_insufficient(text: str) -> bool:
     txt = (text or "").strip()
     if len(txt) < 20:
         return True
-    for kw in ("ข้อมูลไม่พอ", "ไม่พบข้อมูล", "ไม่มีข้อมูลพอ", "ไม่พอ"):
+    for kw in INSUFFICIENT_MARKERS:
         if kw in txt:
             return True
     return False
 
 async def call_local_model(client: httpx.AsyncClient, model: str, prompt: str, temperature: float, top_p: float, max_tokens: int) -> str:
-    r = await client.post(OLLAMA_GEN, json={
-        "model": model,
-        "prompt": prompt,
-        "stream": False,
-        "options": {"temperature": temperature, "top_p": top_p, "num_predict": max_tokens}
-    })
+    async with llm_scheduler.slot("ollama"):
+        r = await client.post(OLLAMA_GEN, json={
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "options": {"temperature": temperature, "top_p": top_p, "num_predict": max_tokens}
+        })
     if r.status_code != 200:
         raise HTTPException(500, f"Ollama error: {r.text}")
     return r.json().get("response","").strip()
@@ -86,7 +119,32 @@ async def call_chatgpt(client: httpx.AsyncClient, model: str, prompt: str, tempe
     key = os.getenv("OPENAI_API_KEY")
     if not key:
         raise HTTPException(400, "Missing OPENAI_API_KEY")
-    r = await client.post(OPENAI_URL, json={
+    async with llm_scheduler.slot("openai"):
+        r = await client.post(OPENAI_URL, json={
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "messages": [
+                {"role":"system","content":"ตอบเป็นภาษาไทยเท่านั้น แบบ bullet สั้น กระชับ"},
+                {"role":"user","content": prompt}
+            ]
+        }, headers={"Authorization": f"Bearer {key}"})
+    if r.status_code != 200:
+        raise HTTPException(500, f"OpenAI error: {r.text}")
+    return r.json()["choices"][0]["message"]["content"].strip()
+
+def stream_local_model(client: httpx.AsyncClient, model: str, prompt: str, temperature: float, top_p: float, max_tokens: int) -> AsyncIterator[str]:
+    return llm_scheduler.stream("ollama", iter_ollama_stream(client, OLLAMA_GEN, {
+        "model": model,
+        "prompt": prompt,
+        "options": {"temperature": temperature, "top_p": top_p, "num_predict": max_tokens}
+    }))
+
+def stream_chatgpt(client: httpx.AsyncClient, model: str, prompt: str, temperature: float, max_tokens: int) -> AsyncIterator[str]:
+    key = os.getenv("OPENAI_API_KEY")
+    if not key:
+        raise HTTPException(400, "Missing OPENAI_API_KEY")
+    return llm_scheduler.stream("openai", iter_openai_stream(client, OPENAI_URL, {
         "model": model,
         "temperature": temperature,
         "max_tokens": max_tokens,
@@ -94,158 +152,258 @@ async def call_chatgpt(client: httpx.AsyncClient, model: str, prompt: str, tempe
             {"role":"system","content":"ตอบเป็นภาษาไทยเท่านั้น แบบ bullet สั้น กระชับ"},
             {"role":"user","content": prompt}
         ]
-    }, headers={"Authorization": f"Bearer {key}"})
-    if r.status_code != 200:
-        raise HTTPException(500, f"OpenAI error: {r.text}")
-    return r.json()["choices"][0]["message"]["content"].strip()
+    }, headers={"Authorization": f"Bearer {key}"}))
 
-async def embed_query(client: httpx.AsyncClient, text: str) -> list[float]:
-    r = await client.post(OLLAMA_EMB, json={"model":"bge-m3","prompt": text})
-    if r.status_code != 200:
-        raise HTTPException(500, f"Ollama embeddings error: {r.text}")
-    emb = r.json().get("embedding")
-    if not emb:
-        raise HTTPException(500, "No embedding returned")
-    return emb
-
-async def search_qdrant(
-    client: httpx.AsyncClient, emb: list[float], *,
+async def search_chunks(
+    emb: list[float], *,
     limit: int, score_threshold: float,
     scope: str, room_id: str | None, project_id: str | None,
-    after: int | None, before: int | None
+    after: int | None, before: int | None,
+    with_vector: bool = False
 ):
     must_filters = []
     if scope == "room" and room_id:
-        must_filters.append({"key":"room_id","match":{"value":room_id}})
+        must_filters.append(field_match("room_id", room_id))
     elif project_id:
-        must_filters.append({"key":"project_id","match":{"value":project_id}})
+        must_filters.append(field_match("project_id", project_id))
     # เวลา
     if after is not None or before is not None:
-        rng = {}
-        if after is not None:
-            rng["gte"] = int(after)
-        if before is not None:
-            rng["lte"] = int(before)
-        must_filters.append({"key":"created_at","range": rng})
-
-    search = {
-        "vector": emb,
-        "limit": limit,
-        "with_payload": True,
-        "with_vectors": False,
-        "score_threshold": score_threshold
-    }
-    if must_filters:
-        search["filter"] = {"must": must_filters}
+        must_filters.append(field_range(
+            "created_at",
+            gte=int(after) if after is not None else None,
+            lte=int(before) if before is not None else None,
+        ))
 
-    r = await client.post(f"{QDRANT_URL}/collections/{COLLECTION}/points/search", json=search)
-    if r.status_code != 200:
-        raise HTTPException(500, f"Qdrant search error: {r.text}")
-    return r.json().get("result", [])
+    try:
+        return await vector_store.search(COLLECTION, emb, limit, score_threshold, make_filter(must_filters), with_vector=with_vector)
+    except VectorStoreError as e:
+        raise HTTPException(500, f"Vector search error: {e}")
 
-@router.post("/generate", response_model=GenResp)
-async def generate(p: Packet):
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        sources = []
-        
-        # 1. Force Re-augment: ค้นหาข้อมูลใหม่จากคำถามเสมอถ้าเปิดใช้งาน
-        if p.controls.auto_reaugment and p.controls.force_reaugment and p.controls.max_extra_k > 0:
-            emb = await embed_query(client, p.question)
-            results = await search_qdrant(
-                client, emb,
-                limit=max(3, p.controls.max_extra_k),
-                score_threshold=p.controls.score_threshold,
-                scope=p.controls.room_scope,
-                room_id=p.room_id, project_id=p.project_id,
-                after=p.after, before=p.before
-            )
-            
-            appended_count = 0
-            for pt in results:
-                pl = pt.get("payload") or {}
-                fp = pl.get("file_path") or ""
-                preview = (pl.get("preview") or "").strip()
-                
-                # กันการเพิ่มข้อมูลซ้ำซ้อน
-                if fp and (fp.split("/")[-1] in p.rag_bundle):
+async def search_extra(p: Packet, clients: HttpClients) -> list[dict]:
+    """ค้น RAG ด้วยคำถาม (ยังไม่แตะ p.rag_bundle)"""
+    emb = await embed_query(clients.ollama, p.question)
+    results = await search_chunks(
+        emb,
+        limit=candidate_limit(max(3, p.controls.max_extra_k)),
+        score_threshold=p.controls.score_threshold,
+        scope=p.controls.room_scope,
+        room_id=p.room_id, project_id=p.project_id,
+        after=p.after, before=p.before,
+        with_vector=True
+    )
+    # รวม chunk ที่ติดกันในไฟล์เดียวกัน แล้วเรียงใหม่แบบ MMR ให้ไฟล์อื่นได้ช่องก่อน chunk ที่ซ้ำ
+    return diversify(results, len(results))
+
+def add_extra(p: Packet, results: list[dict], sources: list[dict], tag: str) -> int:
+    """ต่อผลค้นที่ยังไม่มีเข้า p.rag_bundle คืนจำนวนที่เพิ่ม"""
+    appended_count = 0
+    for pt in results:
+        pl = pt.get("payload") or {}
+        fp = pl.get("file_path") or ""
+        fname = fp.split("/")[-1] if fp else ""
+        preview = (pl.get("preview") or "").strip()
+
+        # กันการเพิ่มข้อมูลซ้ำซ้อน
+        if fname and (fname in p.rag_bundle):
+            continue
+
+        p.rag_bundle += f"\n\n--- [{tag}] id={pt.get('id')} room={pl.get('room_id')} file={fp}\n{preview[:1200]}"
+        sources.append({
+            "id": pt.get("id"),
+            "score": round(float(pt.get("score", 0.0)), 3),
+            "room": pl.get("room_id"),
+            "file": fname or None
+        })
+        appended_count += 1
+        if appended_count >= p.controls.max_extra_k:
+            break
+    return appended_count
+
+async def augment(p: Packet, clients: HttpClients, sources: list[dict], tag: str) -> int:
+    """ค้น RAG ด้วยคำถาม แล้วต่อผลลัพธ์ที่ยังไม่มีเข้า p.rag_bundle คืนจำนวนที่เพิ่ม"""
+    return add_extra(p, await search_extra(p, clients), sources, tag)
+
+async def answer_once(p: Packet, clients: HttpClients, prompt: str) -> str:
+    if p.controls.model_selection == "local":
+        return await call_local_model(clients.ollama, LOCAL_MODEL, prompt, p.controls.temperature, p.controls.top_p, p.controls.max_tokens)
+    if p.controls.model_selection == "chatgpt":
+        return await call_chatgpt(clients.openai, p.controls.model_name, prompt, p.controls.temperature, p.controls.max_tokens)
+    raise HTTPException(400, "Unknown model_selection")
+
+def answer_stream(p: Packet, clients: HttpClients, prompt: str) -> AsyncIterator[str]:
+    if p.controls.model_selection == "local":
+        return stream_local_model(clients.ollama, LOCAL_MODEL, prompt, p.controls.temperature, p.controls.top_p, p.controls.max_tokens)
+    if p.controls.model_selection == "chatgpt":
+        return stream_chatgpt(clients.openai, p.controls.model_name, prompt, p.controls.temperature, p.controls.max_tokens)
+    raise HTTPException(400, "Unknown model_selection")
+
+def log_turn(p: Packet, ans: str, sources: list[dict]) -> None:
+    if p.controls.log_history and p.room_id:
+        try:
+            history_writer.log("demo", p.room_id, "user", p.question, username=(p.username or "user"))
+            history_writer.log("demo", p.room_id, "assistant", ans, username="ai", meta={"provider":p.controls.model_selection,"model":p.controls.model_name,"sources":sources})
+        except Exception:
+            pass
+
+class FirstPass:
+    """คำตอบรอบแรก พร้อม auto re-augment
+
+    โหมด speculative (controls.speculative_reaugment) ค้นบริบทเพิ่มใน background ไปพร้อมกับที่โมเดลตอบ
+    ถ้าช่วงต้นของคำตอบ (SPECULATIVE_WINDOW ตัวอักษรหลังตัด <think>) มีคำที่บอกว่าข้อมูลไม่พอ
+    และผลที่ค้นไว้เพิ่มบริบทได้จริง จะหยุด stream รอบแรกทันทีแล้วให้ผู้เรียกเริ่มรอบสองได้เลย
+    กรณีแย่ที่สุดจึงใช้เวลาราวคำตอบเดียวแทนสองคำตอบต่อกัน
+    """
+
+    def __init__(self, p: Packet, clients: HttpClients, sources: list[dict]):
+        self.p = p
+        self.clients = clients
+        self.sources = sources
+        self.enabled = p.controls.auto_reaugment and p.controls.max_extra_k > 0
+        self.extra = asyncio.create_task(search_extra(p, clients)) if self.enabled and p.controls.speculative_reaugment else None
+        self.parts: list[str] = []
+        self.aborted = False     # หยุดรอบแรกกลางทางเพราะมีบริบทเพิ่มแล้ว
+        self.checked = False     # เรียก _add() ไปแล้ว (ผลเดิมจะไม่เพิ่มอะไรอีก)
+        self.added = 0
+
+    async def _add(self) -> int:
+        self.checked = True
+        if self.extra is None:
+            return await augment(self.p, self.clients, self.sources, "AUTO-ADD")
+        return add_extra(self.p, await self.extra, self.sources, "AUTO-ADD")
+
+    async def stream(self, prompt: str) -> AsyncIterator[str]:
+        pieces = answer_stream(self.p, self.clients, prompt)
+        think = ThinkFilter()
+        opening = ""
+        watch = self.extra is not None
+        try:
+            async for piece in pieces:
+                self.parts.append(piece)
+                yield piece
+                if not watch:
                     continue
+                opening += think.feed(piece)
+                if any(m in opening for m in INSUFFICIENT_MARKERS):
+                    watch = False
+                    self.added = await self._add()
+                    if self.added > 0:
+                        logger.info(f"Speculative re-augment: first answer aborted after {len(opening)} chars, {self.added} extra chunks")
+                        self.aborted = True
+                        return
+                elif len(opening) >= SPECULATIVE_WINDOW:
+                    watch = False
+        finally:
+            # ปิด stream ของ upstream ทันที (Ollama หยุด generate เมื่อ connection ถูกปิด)
+            await pieces.aclose()
 
-                p.rag_bundle += f"\n\n--- [PRE-ADD] id={pt.get('id')} room={pl.get('room_id')} file={fp}\n{preview[:1200]}"
-                sources.append({
-                    "id": pt.get("id"),
-                    "score": round(float(pt.get("score", 0.0)), 3),
-                    "room": pl.get("room_id"),
-                    "file": fp.split("/")[-1] if fp else None
-                })
-                appended_count += 1
-                if appended_count >= p.controls.max_extra_k:
-                    break
-
-        # 2. Generate initial answer
-        prompt = build_prompt(p, p.rag_bundle)
-        provider = p.controls.model_selection
-        chosen_model_name = p.controls.model_name
-
-        if provider == "local":
-            ans = await call_local_model(client, "qwen3:8b", prompt, p.controls.temperature, p.controls.top_p, p.controls.max_tokens)
-        elif provider == "chatgpt":
-            ans = await call_chatgpt(client, chosen_model_name, prompt, p.controls.temperature, p.controls.max_tokens)
+    async def answer(self, prompt: str) -> str:
+        if self.extra is None:
+            self.parts = [await answer_once(self.p, self.clients, prompt)]
         else:
-            raise HTTPException(400, "Unknown model_selection")
+            async for _ in self.stream(prompt):
+                pass
+        return self.text()
+
+    def text(self) -> str:
+        return "".join(self.parts).strip()
+
+    async def reaugment(self) -> int:
+        """จำนวนบริบทที่เพิ่มเข้า p.rag_bundle (> 0 = ควรตอบรอบสองด้วย prompt ใหม่)"""
+        if self.aborted:
+            return self.added
+        if not self.enabled or self.checked or not seems_insufficient(self.text()):
+            return 0
+        return await self._add()
+
+    def close(self) -> None:
+        if self.extra is None:
+            return
+        if not self.extra.done():
+            self.extra.cancel()
+        elif not self.extra.cancelled():
+            self.extra.exception()   # ไม่ให้ asyncio เตือนว่า exception ไม่ถูกอ่าน
+
+@router.post("/generate", response_model=GenResp)
+async def generate(p: Packet, clients: HttpClients = Depends(get_clients)):
+    set_request(key=request_key(p.username, p.room_id))   # คิว LLM แยกตามผู้ใช้/ห้อง
+    sources = []
+    
+    # 1. Force Re-augment: ค้นหาข้อมูลใหม่จากคำถามเสมอถ้าเปิดใช้งาน
+    if p.controls.auto_reaugment and p.controls.force_reaugment and p.controls.max_extra_k > 0:
+        await augment(p, clients, sources, "PRE-ADD")
+
+    # 2. Generate initial answer (speculative: ค้นบริบทเพิ่มไปพร้อมกัน)
+    first = FirstPass(p, clients, sources)
+    try:
+        prompt, prompt_tokens = build_prompt(p, p.rag_bundle)
+        ans = await first.answer(prompt)
 
         # 3. Auto Re-augment if answer is insufficient
-        if p.controls.auto_reaugment and seems_insufficient(ans) and p.controls.max_extra_k > 0:
-            emb = await embed_query(client, p.question)
-            results = await search_qdrant(
-                client, emb,
-                limit=max(3, p.controls.max_extra_k),
-                score_threshold=p.controls.score_threshold,
-                scope=p.controls.room_scope, room_id=p.room_id, project_id=p.project_id,
-                after=p.after, before=p.before
-            )
-            
-            appended_count = 0
-            for pt in results:
-                pl = pt.get("payload") or {}
-                fp = (pl.get("file_path") or "")
-                fname = fp.split("/")[-1] if fp else ""
-                prev = (pl.get("preview") or "").strip()
-                if fname and (fname in p.rag_bundle):
-                    continue
-                
-                p.rag_bundle += f"\n\n--- [AUTO-ADD] id={pt.get('id')} room={pl.get('room_id')} file={fp}\n{prev[:1200]}"
-                sources.append({"id": pt.get("id"), "score": round(float(pt.get("score", 0.0)),3), "room": pl.get("room_id"), "file": fname})
-                appended_count += 1
-                if appended_count >= p.controls.max_extra_k:
-                    break
-            
-            if appended_count > 0:
-                prompt2 = build_prompt(p, p.rag_bundle)
-                if provider == "local":
-                    ans = await call_local_model(client, "qwen3:8b", prompt2, p.controls.temperature, p.controls.top_p, p.controls.max_tokens)
-                else:
-                    ans = await call_chatgpt(client, chosen_model_name, prompt2, p.controls.temperature, p.controls.max_tokens)
-
-        # 4. Log history
-        if p.controls.log_history and p.room_id:
-            try:
-                await client.post(
-                    f"{BASE_URL}/rooms/{p.room_id}/messages",
-                    params={"project_id":"demo"},
-                    json={"role":"user","content":p.question,"username": (p.username or "user")}
-                )
-                await client.post(
-                    f"{BASE_URL}/rooms/{p.room_id}/messages",
-                    params={"project_id":"demo"},
-                    json={"role":"assistant","content":ans,"username":"ai","meta":{"provider":provider,"model":chosen_model_name,"sources":sources}}
-                )
-            except Exception:
-                pass
+        if await first.reaugment() > 0:
+            prompt, prompt_tokens = build_prompt(p, p.rag_bundle)
+            ans = await answer_once(p, clients, prompt)
+    finally:
+        first.close()
+
+    # 4. Log history
+    log_turn(p, ans, sources)
+
+    # 5. Return final response
+    return GenResp(
+        provider=p.controls.model_selection,
+        used_model=p.controls.model_name,
+        answer=ans,
+        sources=sources,
+        prompt_tokens=prompt_tokens,
+    )
 
-        # 5. Return final response
-        return GenResp(
-            provider=provider,
-            used_model=chosen_model_name,
-            answer=ans,
-            sources=sources,
-        )
+async def generate_events(p: Packet, clients: HttpClients) -> AsyncIterator[dict]:
+    """ลำดับ event ของ /chat/generate/stream: delta* -> (reset -> delta*)? -> done
+
+    ถ้าคำตอบแรกไม่พอและ auto re-augment หาบริบทเพิ่มได้ จะส่ง event "reset"
+    ให้ client ล้างข้อความที่แสดงไปแล้วก่อนเริ่มคำตอบรอบสอง
+    (โหมด speculative ส่ง reset ได้ตั้งแต่ช่วงต้นของคำตอบแรก ไม่ต้องรอให้จบ)
+    """
+    if p.controls.model_selection not in ("local", "chatgpt"):
+        raise HTTPException(400, "Unknown model_selection")
+    set_request(key=request_key(p.username, p.room_id))
+    sources = []
+    if p.controls.auto_reaugment and p.controls.force_reaugment and p.controls.max_extra_k > 0:
+        await augment(p, clients, sources, "PRE-ADD")
+
+    first = FirstPass(p, clients, sources)
+    try:
+        prompt, prompt_tokens = build_prompt(p, p.rag_bundle)
+        async for piece in first.stream(prompt):
+            yield {"type": "delta", "text": piece}
+        ans = first.text()
+
+        if await first.reaugment() > 0:
+            yield {"type": "reset", "reason": "reaugment", "sources": sources}
+            parts = []
+            prompt, prompt_tokens = build_prompt(p, p.rag_bundle)
+            async for piece in answer_stream(p, clients, prompt):
+                parts.append(piece)
+                yield {"type": "delta", "text": piece}
+            ans = "".join(parts).strip()
+    finally:
+        first.close()
+
+    log_turn(p, ans, sources)
+    yield {
+        "type": "done",
+        "provider": p.controls.model_selection,
+        "used_model": p.controls.model_name,
+        "answer": ans,
+        "sources": sources,
+        "prompt_tokens": prompt_tokens,
+    }
+
+@router.post("/generate/stream")
+async def generate_stream(
+    p: Packet,
+    fmt: Literal["ndjson", "sse"] = Query("ndjson", alias="format"),
+    clients: HttpClients = Depends(get_clients),
+):
+    """เหมือน /chat/generate แต่ส่งคำตอบทีละ token (NDJSON หรือ SSE)"""
+    return event_stream_response(generate_events(p, clients), fmt)
@@ -1,10 +1,21 @@
 # code_api.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends, Query
 from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel, Field
 import asyncio
-from typing import List, Literal, Optional, Dict, Any
+from typing import AsyncIterator, List, Literal, Optional, Dict, Any, Tuple
 import os, httpx, logging, json
+from http_clients import HttpClients, get_clients
+from embeddings import embed_query, normalize_text
+from streaming import ThinkFilter, event_stream_response, iter_ollama_stream, iter_openai_stream
+from answer_cache import ANSWER_CACHE_ENABLED, CachedAnswer, answer_cache
+from lexical_index import code_index, is_symbol_query, rrf_fuse
+from rerank import candidate_limit, diversify
+from context_packer import context_packer
+from vector_store import VectorStoreError, field_text, make_filter, vector_store
+from auth_api import get_admin_user
+from llm_scheduler import llm_scheduler
+from single_flight import COALESCE_KEY, answer_flights
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -14,21 +25,28 @@ logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/code", tags=["code"])
 
 # ---- Config ----
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
 COLLECTION = "code_rag"
 CONVERSATION_COLLECTION = "conversation_rag"
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
-OLLAMA_EMB = f"{OLLAMA_URL}/api/embeddings"
 OLLAMA_GEN = f"{OLLAMA_URL}/api/generate"
 OPENAI_URL = "https://api.openai.com/v1/chat/completions"
 OPENAI_KEY = os.getenv("OPENAI_API_KEY")
 # ทำให้สอดคล้องกับ index_repo.py โดยใช้ Current Working Directory
 REPO_DIR = os.path.abspath(os.getenv("CODE_REPO_DIR", os.getcwd()))
+NO_HITS_ANSWER = "ขออภัยครับ ไม่พบข้อมูลโค้ดที่เกี่ยวข้องเพื่อใช้ในการตอบคำถามนี้"
+
+# hybrid retrieval: จำนวน candidate ต่อรายการก่อน fuse และค่า k ของ reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+
+# vector = vector store อย่างเดียว, lexical = BM25 อย่างเดียว, hybrid = fuse ทั้งสอง (ถ้ามี lexical index)
+SearchMode = Literal["hybrid", "vector", "lexical"]
 
 # ---- Schemas ----
 class CodeSearchReq(BaseModel):
     query: str
     limit: int = 5
+    mode: SearchMode = "hybrid"
 
 class CodeHit(BaseModel):
     id: str
@@ -44,59 +62,86 @@ class CodeAnswerReq(BaseModel):
     score_threshold: float = Field(0.3, ge=0.0, le=1.0)
     provider: Literal["chatgpt","local"] = "chatgpt"
     model: Optional[str] = None
+    mode: SearchMode = "hybrid"
 
 class CodeAnswerResp(BaseModel):
     answer: str
     sources: List[CodeHit]
+    cached: bool = False
+    prompt_tokens: Optional[int] = None   # token (โดยประมาณ) ของ prompt ที่ส่งให้โมเดล; None = ไม่ได้เรียกโมเดล
 
 # ---- Helpers ----
-async def embed_query(client: httpx.AsyncClient, text: str) -> List[float]:
-    logger.info(f"Embedding query: '{text[:50]}...'")
-    r = await client.post(OLLAMA_EMB, json={"model":"bge-m3","prompt": text})
-    if r.status_code != 200:
-        logger.error(f"Ollama embeddings error: {r.text}")
-        raise HTTPException(500, f"Ollama embeddings error: {r.text}")
-    logger.info("Embedding successful.")
-    return r.json()["embedding"]
-
-async def qdrant_search(client: httpx.AsyncClient, collection: str, vec: List[float], limit: int, score_threshold: float):
-    filter_body = {}
+async def vector_search(collection: str, vec: List[float], limit: int, score_threshold: Optional[float] = None, with_vector: bool = False):
+    flt = None
     if collection == COLLECTION: # Only apply .next filter to code_rag
-        filter_body = {
-            "filter": {
-                "must_not": [
-                    {"key": "path", "match": {"text": ".next"}}
-                ]
-            }
-        }
-
-    body = {
-        "vector": vec,
-        "limit": limit,
-        "with_payload": True,
-        "score_threshold": score_threshold,
-        **filter_body
-    }
-    logger.info(f"Searching Qdrant in collection '{collection}' with limit {limit}.")
-    r = await client.post(f"{QDRANT_URL}/collections/{collection}/points/search", json=body)
-    logger.info(f"Qdrant search responded with status: {r.status_code}")
-    r.raise_for_status()
-    result = r.json().get("result", [])
-    logger.info(f"Qdrant returned {len(result)} hits.")
+        flt = make_filter(must_not=[field_text("path", ".next")])
+
+    logger.info(f"Searching vector store ({vector_store.backend}) in collection '{collection}' with limit {limit}.")
+    try:
+        result = await vector_store.search(collection, vec, limit, score_threshold, flt, with_vector=with_vector)
+    except VectorStoreError as e:
+        raise HTTPException(500, str(e))
+    logger.info(f"Vector store returned {len(result)} hits.")
     return result
 
+async def search_hits(
+    clients: HttpClients,
+    query: str,
+    limit: int,
+    mode: str = "hybrid",
+    score_threshold: Optional[float] = None,
+    with_conversations: bool = False,
+    diverse: bool = False,
+) -> List[dict]:
+    """ค้น code_rag (และ conversation_rag ถ้าต้องการ) ตาม mode คืนผลรูปแบบเดียวกับ Qdrant
+
+    hybrid: BM25 กับ vector search ทำพร้อมกันแล้ว fuse ด้วย RRF (score = คะแนน RRF)
+    ถ้า query เป็นชื่อ symbol ล้วนที่มีอยู่ใน lexical index จะตอบจาก BM25 เลยโดยไม่ embed query
+    ถ้ายังไม่มี lexical index (ยังไม่ได้รัน index_repo.py) จะใช้ vector อย่างเดียว
+    diverse: ค้น candidate มากขึ้นแล้วรวม chunk ที่ติดกันและเลือกแบบ MMR (rerank.py) สำหรับสร้าง prompt
+    """
+    lexical = mode != "vector" and code_index.available()
+    want = candidate_limit(limit) if diverse else limit
+    depth = max(want, HYBRID_CANDIDATES)
+    finish = (lambda hits: diversify(hits, limit)) if diverse else (lambda hits: hits[:limit])
+    if mode == "lexical" or (lexical and is_symbol_query(query) and code_index.knows(query)):
+        lex_hits = await asyncio.to_thread(code_index.search, query, want) if lexical else []
+        if mode != "lexical":
+            code_index.embeds_skipped += 1
+        logger.info(f"Lexical index returned {len(lex_hits)} hits (no embedding).")
+        return finish(lex_hits)
+
+    async def vector_lists() -> List[List[dict]]:
+        vec = await embed_query(clients.ollama, query)
+        n = depth if lexical else want
+        searches = [vector_search(COLLECTION, vec, n, score_threshold, with_vector=diverse)]
+        if with_conversations:
+            searches.append(vector_search(CONVERSATION_COLLECTION, vec, n, score_threshold, with_vector=diverse))
+        return list(await asyncio.gather(*searches))
+
+    if not lexical:
+        hits = [h for hits in await vector_lists() for h in hits]
+        hits.sort(key=lambda x: x.get("score", 0.0), reverse=True)
+        return finish(hits[:want])
+
+    vector_results, lex_hits = await asyncio.gather(vector_lists(), asyncio.to_thread(code_index.search, query, depth))
+    logger.info(f"Hybrid search: {len(lex_hits)} lexical + {sum(map(len, vector_results))} vector candidates.")
+    # ผลจาก vector store มาก่อนเพื่อให้ใช้ payload ล่าสุด
+    return finish(rrf_fuse(vector_results + [lex_hits], want, HYBRID_RRF_K))
+
+async def fetch_points(collection: str, ids: List[Any]) -> List[dict]:
+    return await vector_store.retrieve(collection, ids)
+
 def load_prompt_from_file(filename: str) -> str:
-    prompt_path = os.path.join(os.path.dirname(__file__), "prompts", filename)
-    try:
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            return f.read()
-    except FileNotFoundError:
-        logger.error(f"Prompt file not found at {prompt_path}")
-        return "คุณคือผู้ช่วย AI" # Fallback prompt
+    # prompts/ ก่อน แล้วโฟลเดอร์ของโมดูล; cache ไว้และอ่านใหม่เมื่อไฟล์ถูกแก้เท่านั้น
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = [os.path.join(here, "prompts", filename), os.path.join(here, filename)]
+    return context_packer.template(paths, "คุณคือผู้ช่วย AI") # Fallback prompt
 
-def build_prompt(query: str, hits: List[CodeHit]) -> str:
+def build_prompt(query: str, hits: List[CodeHit], model: str) -> Tuple[str, int]:
+    """คืน (prompt, จำนวน token โดยประมาณ) บริบทถูกตัดให้อยู่ในงบ token ของ model"""
     system_prompt = load_prompt_from_file("code_assistant_prompt.md")
-    
+
     context_lines = []
     for i, h in enumerate(hits, start=1):
         payload = h.payload
@@ -106,8 +151,11 @@ def build_prompt(query: str, hits: List[CodeHit]) -> str:
             username = payload.get('username', 'unknown')
             context_lines.append(f"[{i}] conversation by {username}:\ncontent: {payload['content']}")
 
-    full_context = "\n---\n".join(context_lines)
-    return f"{system_prompt}\n\n[บริบทโค้ด]\n{full_context}\n\n[คำถาม]\n{query}"
+    head = f"{system_prompt}\n\n[บริบทโค้ด]\n"
+    tail = f"\n\n[คำถาม]\n{query}"
+    packed = context_packer.pack(context_packer.budget_for(model), head + tail, context_lines)
+    prompt = head + "\n---\n".join(packed.context) + tail
+    return prompt, context_packer.measure(prompt, packed.truncated)
 
 def clean_ai_response(text: str) -> str:
     """Removes <think> and </think> tags from the AI's response."""
@@ -120,17 +168,18 @@ def clean_ai_response(text: str) -> str:
 async def call_chatgpt(client: httpx.AsyncClient, model: str, prompt: str) -> str:
     if not OPENAI_KEY:
         raise HTTPException(400, "OPENAI_API_KEY ไม่ได้ตั้งค่า แต่ provider=chatgpt")
-    r = await client.post(
-        OPENAI_URL,
-        headers={"Authorization": f"Bearer {OPENAI_KEY}"},
-        json={
-            "model": model,
-            "messages": [{"role":"user","content": prompt}],
-            "temperature": 0.2,
-            "top_p": 0.9,
-            "max_tokens": 2048,
-        }
-    )
+    async with llm_scheduler.slot("openai"):
+        r = await client.post(
+            OPENAI_URL,
+            headers={"Authorization": f"Bearer {OPENAI_KEY}"},
+            json={
+                "model": model,
+                "messages": [{"role":"user","content": prompt}],
+                "temperature": 0.2,
+                "top_p": 0.9,
+                "max_tokens": 2048,
+            }
+        )
     if r.status_code != 200:
         raise HTTPException(500, f"OpenAI error: {r.text}")
     data = r.json()
@@ -138,37 +187,62 @@ async def call_chatgpt(client: httpx.AsyncClient, model: str, prompt: str) -> st
     return clean_ai_response(raw_answer)
 
 async def call_local_llm(client: httpx.AsyncClient, model: str, prompt: str) -> str:
-    r = await client.post(
-        OLLAMA_GEN,
-        json={
-            "model": model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {"temperature": 0.2, "top_p": 0.9, "num_predict": 2048}
-        }
-    )
+    async with llm_scheduler.slot("ollama"):
+        r = await client.post(
+            OLLAMA_GEN,
+            json={
+                "model": model,
+                "prompt": prompt,
+                "stream": False,
+                "options": {"temperature": 0.2, "top_p": 0.9, "num_predict": 2048}
+            }
+        )
     if r.status_code != 200:
         raise HTTPException(500, f"Ollama generate error: {r.text}")
     raw_answer = r.json().get("response","")
     return clean_ai_response(raw_answer)
 
+def stream_chatgpt(client: httpx.AsyncClient, model: str, prompt: str) -> AsyncIterator[str]:
+    if not OPENAI_KEY:
+        raise HTTPException(400, "OPENAI_API_KEY ไม่ได้ตั้งค่า แต่ provider=chatgpt")
+    return llm_scheduler.stream("openai", iter_openai_stream(
+        client,
+        OPENAI_URL,
+        {
+            "model": model,
+            "messages": [{"role":"user","content": prompt}],
+            "temperature": 0.2,
+            "top_p": 0.9,
+            "max_tokens": 2048,
+        },
+        headers={"Authorization": f"Bearer {OPENAI_KEY}"},
+    ))
+
+def stream_local_llm(client: httpx.AsyncClient, model: str, prompt: str) -> AsyncIterator[str]:
+    return llm_scheduler.stream("ollama", iter_ollama_stream(
+        client,
+        OLLAMA_GEN,
+        {
+            "model": model,
+            "prompt": prompt,
+            "options": {"temperature": 0.2, "top_p": 0.9, "num_predict": 2048}
+        },
+    ))
+
 # ---- Endpoints ----
 
 @router.post("/search", response_model=CodeSearchResp)
-async def code_search(body: CodeSearchReq):
+async def code_search(body: CodeSearchReq, clients: HttpClients = Depends(get_clients)):
     logger.info(f"--- Handling /code/search request with query: '{body.query}' ---")
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        vec = await embed_query(client, body.query)
-        qdrant_hits = await qdrant_search(client, COLLECTION, vec, body.limit)
+    qdrant_hits = await search_hits(clients, body.query, body.limit, body.mode)
 
     parsed_hits: List[CodeHit] = []
     for hit in qdrant_hits:
         try:
-            payload = hit.get("payload", {})
             parsed_hits.append(CodeHit(
                 id=hit.get("id"),
                 score=hit.get("score"),
-                **payload
+                payload=hit.get("payload", {}),
             ))
         except Exception as e:
             logger.error(f"Error parsing hit: {hit}. Error: {e}")
@@ -176,47 +250,157 @@ async def code_search(body: CodeSearchReq):
     logger.info(f"Successfully parsed {len(parsed_hits)} hits. Returning response.")
     return CodeSearchResp(hits=parsed_hits)
 
+def resolve_model(body: CodeAnswerReq) -> str:
+    if body.model:
+        return body.model
+    return "gpt-4o-mini" if body.provider == "chatgpt" else "qwen3:8b"
+
+# ---- Semantic answer cache ----
+def answer_scope(body: CodeAnswerReq):
+    return (body.provider, resolve_model(body), body.limit, body.score_threshold, body.mode)
+
+def source_commits(hits: List[CodeHit]) -> Dict[str, str]:
+    """point id -> commit ของ hit ที่มาจาก code_rag (hit จากบทสนทนาไม่มี commit)"""
+    return {str(h.id): h.payload.get("commit") for h in hits if "path" in h.payload and h.payload.get("commit")}
+
+async def lookup_cached_answer(clients: HttpClients, body: CodeAnswerReq) -> Optional[CachedAnswer]:
+    if not ANSWER_CACHE_ENABLED:
+        return None
+
+    async def is_fresh(entry: CachedAnswer) -> bool:
+        # entry ยังใช้ได้ก็ต่อเมื่อ source ทุกจุดยังอยู่ใน index ที่ commit เดิม
+        if not entry.commits:
+            return True
+        points = await fetch_points(COLLECTION, list(entry.commits))
+        current = {str(pt.get("id")): (pt.get("payload") or {}).get("commit") for pt in points}
+        return all(current.get(pid) == commit for pid, commit in entry.commits.items())
+
+    vec = await embed_query(clients.ollama, body.query)
+    entry = await answer_cache.lookup(answer_scope(body), body.query, vec, is_fresh)
+    if entry is not None:
+        logger.info(f"Answer cache hit for query '{body.query[:50]}' (cached from '{entry.query[:50]}')")
+    return entry
+
+async def store_cached_answer(clients: HttpClients, body: CodeAnswerReq, answer: str, hits: List[CodeHit]) -> None:
+    if not ANSWER_CACHE_ENABLED or not answer or not hits:
+        return
+    vec = await embed_query(clients.ollama, body.query)
+    answer_cache.store(answer_scope(body), body.query, vec, answer, [h.dict() for h in hits], source_commits(hits))
+
+# ---- Single-flight ----
+def coalesce_key(body: CodeAnswerReq, kind: str) -> Tuple[Any, ...]:
+    """คำขอที่ field ใน COALESCE_KEY ตรงกัน (คำถามเทียบหลัง normalize) ใช้การคำนวณเดียวกัน"""
+    values = {
+        "query": normalize_text(body.query),
+        "provider": body.provider,
+        "model": resolve_model(body),
+        "limit": body.limit,
+        "score_threshold": body.score_threshold,
+        "mode": body.mode,
+    }
+    return (kind,) + tuple(values.get(f) for f in COALESCE_KEY)
+
+async def retrieve_hits(clients: HttpClients, body: CodeAnswerReq) -> List[CodeHit]:
+    # ค้น code_rag และ conversation_rag (vector) รวมกับ lexical index ของโค้ดตาม body.mode
+    # chunk ที่ติดกันถูกรวมและผลถูกเลือกแบบ MMR ก่อนเข้า prompt (rerank.py)
+    top_hits = await search_hits(clients, body.query, body.limit, body.mode, body.score_threshold, with_conversations=True, diverse=True)
+
+    hits: List[CodeHit] = []
+    for hit in top_hits:
+        try:
+            hits.append(CodeHit(id=hit.get("id"), score=hit.get("score"), payload=hit.get("payload", {})))
+        except Exception as e:
+            logger.error(f"Error parsing hit for answer: {hit}. Error: {e}")
+            continue
+
+    logger.info(f"Found {len(hits)} sources to build prompt.")
+    return hits
+
+def code_answer_events(body: CodeAnswerReq, clients: HttpClients) -> AsyncIterator[Dict[str, Any]]:
+    """ลำดับ event ของการตอบแบบ streaming: sources -> delta* -> done
+    (คำขอเดียวกันที่มาพร้อมกัน เช่น /ai ซ้ำในห้อง ใช้ stream เดียวกัน)"""
+    return answer_flights.stream(coalesce_key(body, "stream"), lambda: answer_events(body, clients))
+
+async def answer_events(body: CodeAnswerReq, clients: HttpClients) -> AsyncIterator[Dict[str, Any]]:
+    cached = await lookup_cached_answer(clients, body)
+    if cached is not None:
+        yield {"type": "sources", "sources": cached.sources}
+        yield {"type": "delta", "text": cached.answer}
+        yield {"type": "done", "answer": cached.answer, "sources": cached.sources, "provider": body.provider, "model": resolve_model(body), "cached": True}
+        return
+
+    hits = await retrieve_hits(clients, body)
+    sources = [h.dict() for h in hits]
+    yield {"type": "sources", "sources": sources}
+    if not hits:
+        yield {"type": "delta", "text": NO_HITS_ANSWER}
+        yield {"type": "done", "answer": NO_HITS_ANSWER, "sources": []}
+        return
+
+    model = resolve_model(body)
+    prompt, prompt_tokens = build_prompt(body.query, hits, model)
+    if body.provider == "chatgpt":
+        pieces = stream_chatgpt(clients.openai, model, prompt)
+    else:
+        pieces = stream_local_llm(clients.ollama, model, prompt)
+
+    think = ThinkFilter()
+    parts: List[str] = []
+    async for piece in pieces:
+        out = think.feed(piece)
+        if out:
+            parts.append(out)
+            yield {"type": "delta", "text": out}
+    tail = think.flush()
+    if tail:
+        parts.append(tail)
+        yield {"type": "delta", "text": tail}
+    answer = "".join(parts).strip()
+    await store_cached_answer(clients, body, answer, hits)
+    yield {"type": "done", "answer": answer, "sources": sources, "provider": body.provider, "model": model, "cached": False, "prompt_tokens": prompt_tokens}
+
 @router.post("/answer", response_model=CodeAnswerResp)
-async def code_answer(body: CodeAnswerReq):
+async def code_answer(body: CodeAnswerReq, clients: HttpClients = Depends(get_clients)):
     logger.info(f"--- Handling /code/answer request with query: '{body.query}' ---")
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        # 1. Embed the query
-        vec = await embed_query(client, body.query)
-
-        # 2. Search both collections in parallel
-        code_hits_task = qdrant_search(client, COLLECTION, vec, body.limit, body.score_threshold)
-        conv_hits_task = qdrant_search(client, CONVERSATION_COLLECTION, vec, body.limit, body.score_threshold)
-        
-        results = await asyncio.gather(code_hits_task, conv_hits_task)
-        qdrant_hits = results[0] + results[1]
-
-        # 3. Sort and combine results
-        qdrant_hits.sort(key=lambda x: x.get("score", 0.0), reverse=True)
-        top_hits = qdrant_hits[:body.limit]
-        
-        hits: List[CodeHit] = []
-        for hit in top_hits:
-            try:
-                hits.append(CodeHit(id=hit.get("id"), score=hit.get("score"), payload=hit.get("payload", {})))
-            except Exception as e:
-                logger.error(f"Error parsing hit for answer: {hit}. Error: {e}")
-                continue
-
-        logger.info(f"Found {len(hits)} sources to build prompt.")
-        if not hits:
-            return CodeAnswerResp(answer="ขออภัยครับ ไม่พบข้อมูลโค้ดที่เกี่ยวข้องเพื่อใช้ในการตอบคำถามนี้", sources=[])
-
-        prompt = build_prompt(body.query, hits)
-
-        if body.provider == "chatgpt":
-            model = body.model or "gpt-4o-mini"
-            answer = await call_chatgpt(client, model, prompt)
-        else:
-            model = body.model or "qwen3:8b"
-            answer = await call_local_llm(client, model, prompt)
-
-        logger.info("Returning answer and sources.")
-        return CodeAnswerResp(answer=answer, sources=hits)
+    return await answer_flights.run(coalesce_key(body, "answer"), lambda: answer_once(body, clients))
+
+async def answer_once(body: CodeAnswerReq, clients: HttpClients) -> CodeAnswerResp:
+    cached = await lookup_cached_answer(clients, body)
+    if cached is not None:
+        return CodeAnswerResp(answer=cached.answer, sources=cached.sources, cached=True)
+
+    hits = await retrieve_hits(clients, body)
+    if not hits:
+        return CodeAnswerResp(answer=NO_HITS_ANSWER, sources=[])
+
+    model = resolve_model(body)
+    prompt, prompt_tokens = build_prompt(body.query, hits, model)
+
+    if body.provider == "chatgpt":
+        answer = await call_chatgpt(clients.openai, model, prompt)
+    else:
+        answer = await call_local_llm(clients.ollama, model, prompt)
+
+    await store_cached_answer(clients, body, answer, hits)
+    logger.info("Returning answer and sources.")
+    return CodeAnswerResp(answer=answer, sources=hits, prompt_tokens=prompt_tokens)
+
+@router.post("/answer/stream")
+async def code_answer_stream(
+    body: CodeAnswerReq,
+    fmt: Literal["ndjson", "sse"] = Query("ndjson", alias="format"),
+    clients: HttpClients = Depends(get_clients),
+):
+    """เหมือน /code/answer แต่ส่งคำตอบทีละ token (NDJSON หรือ SSE)"""
+    logger.info(f"--- Handling /code/answer/stream request with query: '{body.query}' ---")
+    return event_stream_response(code_answer_events(body, clients), fmt)
+
+@router.delete("/answer/cache")
+async def purge_answer_cache(admin: dict = Depends(get_admin_user)):
+    """ล้าง semantic answer cache ทั้งหมด (เฉพาะผู้ดูแล)"""
+    purged = answer_cache.purge()
+    logger.info(f"Answer cache purged by '{admin['username']}': {purged} entries")
+    return {"purged": purged}
 
 @router.get("/raw", response_class=PlainTextResponse)
 async def get_raw_code(path: str):
@@ -0,0 +1,243 @@
+# code_chunker.py
+"""
+Structure-aware chunker สำหรับ index_repo.py
+
+แบ่งไฟล์ตามโครงสร้างแทนหน้าต่างตัวอักษรคงที่:
+
+- .py                      ใช้ ast: หนึ่ง chunk ต่อ function/class (class ใหญ่แยกเป็น method)
+- .ts/.tsx/.js/.jsx        heuristic นับวงเล็บปีกกาของ declaration ระดับบนสุด
+- .md                      แบ่งตาม heading
+- อื่นๆ                     หน้าต่างตามบรรทัด ไม่มี overlap
+
+หน่วยเล็กที่อยู่ติดกันจะถูกรวมจนเกือบ max_chars หน่วยที่ใหญ่เกินจะถูกตัดตามบรรทัด
+ทุก chunk มี offset (ตัวอักษร), ช่วงบรรทัด (เริ่มที่ 1) และชื่อ symbol
+
+ฟังก์ชันในไฟล์นี้เป็น pure function ระดับ module เพื่อให้ส่งเข้า ProcessPoolExecutor ได้
+"""
+import os
+import re
+import ast
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+CHUNKER_VERSION = "syntax-1"
+
+# (start_line, end_line, symbol, kind) บรรทัดเริ่มที่ 0, end ไม่รวม
+Unit = Tuple[int, int, Optional[str], str]
+
+JS_EXT = {".ts", ".tsx", ".js", ".jsx"}
+MD_EXT = {".md"}
+
+def read_text_safe(path: str) -> str:
+    try:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            return f.read()
+    except Exception:
+        return ""
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8", "ignore")).hexdigest()
+
+# ---- Units per language ----
+def _py_units(text: str, lines: List[str], max_chars: int) -> Optional[List[Unit]]:
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return None
+
+    def span(node) -> Tuple[int, int]:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+        return start, node.end_lineno
+
+    def size(a: int, b: int) -> int:
+        return sum(len(l) for l in lines[a:b])
+
+    units: List[Unit] = []
+    defs = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+    for node in tree.body:
+        if not isinstance(node, defs):
+            continue
+        a, b = span(node)
+        kind = "class" if isinstance(node, ast.ClassDef) else "function"
+        methods = [n for n in node.body if isinstance(n, defs)] if kind == "class" else []
+        if kind == "class" and methods and size(a, b) > max_chars:
+            # class ใหญ่: ส่วนหัว (docstring, attribute) หนึ่งหน่วย แล้วแยกทีละ method
+            cursor = a
+            for m in methods:
+                ma, mb = span(m)
+                if ma > cursor:
+                    units.append((cursor, ma, node.name, "class"))
+                units.append((ma, mb, f"{node.name}.{m.name}", "method"))
+                cursor = mb
+            if b > cursor:
+                units.append((cursor, b, node.name, "class"))
+        else:
+            units.append((a, b, node.name, kind))
+    return units
+
+_JS_DECL = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:declare\s+)?(?:abstract\s+)?(?:async\s+)?"
+    r"(function\*?|class|interface|type|enum|const|let|var|namespace)\s+([A-Za-z_$][\w$]*)"
+)
+_JS_STRIP = re.compile(r"//.*$|'(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\"|`(?:\\.|[^`\\])*`")
+
+def _js_units(lines: List[str]) -> List[Unit]:
+    units: List[Unit] = []
+    i, n = 0, len(lines)
+    while i < n:
+        m = _JS_DECL.match(lines[i].lstrip()) if not lines[i][:1].isspace() else None
+        if not m:
+            i += 1
+            continue
+        kind = {"function": "function", "function*": "function", "class": "class"}.get(m.group(1), "declaration")
+        start, depth, opened, j = i, 0, False, i
+        # ขยายไปจนวงเล็บปีกกาที่เปิดปิดครบ หรือจบ statement ที่ระดับบนสุด
+        while j < n:
+            code = _JS_STRIP.sub("", lines[j])
+            depth += code.count("{") + code.count("(") + code.count("[")
+            depth -= code.count("}") + code.count(")") + code.count("]")
+            opened = opened or "{" in code
+            j += 1
+            if depth <= 0 and (opened or code.rstrip().endswith(";") or j >= n or not lines[j][:1].isspace()):
+                break
+        units.append((start, j, m.group(2), kind))
+        i = j
+    return units
+
+_MD_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+
+def _md_units(lines: List[str]) -> List[Unit]:
+    units: List[Unit] = []
+    start, title = 0, None
+    in_fence = False
+    for i, line in enumerate(lines):
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+        m = None if in_fence else _MD_HEADING.match(line)
+        if m and i > start:
+            units.append((start, i, title, "section"))
+            start = i
+        if m:
+            start, title = i, m.group(2)
+    if start < len(lines):
+        units.append((start, len(lines), title, "section"))
+    return units
+
+# ---- Packing ----
+def _fill_gaps(units: List[Unit], n_lines: int) -> List[Unit]:
+    """ใส่บรรทัดที่ไม่อยู่ใน unit ใด (import, โค้ดระดับ module) เป็นหน่วย 'module'"""
+    out: List[Unit] = []
+    cursor = 0
+    for a, b, sym, kind in sorted(units):
+        if a < cursor:
+            a = cursor
+        if a > cursor:
+            out.append((cursor, a, None, "module"))
+        if b > a:
+            out.append((a, b, sym, kind))
+        cursor = max(cursor, b)
+    if cursor < n_lines:
+        out.append((cursor, n_lines, None, "module"))
+    return out
+
+def _split_lines(a: int, b: int, lines: List[str], max_chars: int) -> List[Tuple[int, int]]:
+    """ตัดช่วงบรรทัดที่ยาวเกินเป็นหลายช่วงที่ไม่เกิน max_chars (ตัดที่ขอบบรรทัด)"""
+    out: List[Tuple[int, int]] = []
+    start, size = a, 0
+    for i in range(a, b):
+        ln = len(lines[i])
+        if size and size + ln > max_chars:
+            out.append((start, i))
+            start, size = i, 0
+        size += ln
+    if start < b:
+        out.append((start, b))
+    return out
+
+def _pack(units: List[Unit], lines: List[str], max_chars: int) -> List[Tuple[int, int, List[str], str]]:
+    """รวมหน่วยที่ติดกันจนใกล้ max_chars และตัดหน่วยที่ใหญ่เกิน"""
+    packed: List[Tuple[int, int, List[str], str]] = []
+    cur: Optional[List] = None   # [start, end, symbols, kind, size]
+
+    def flush():
+        nonlocal cur
+        if cur is not None:
+            packed.append((cur[0], cur[1], cur[2], cur[3]))
+            cur = None
+
+    for a, b, sym, kind in units:
+        size = sum(len(l) for l in lines[a:b])
+        if not "".join(lines[a:b]).strip():
+            # บรรทัดว่างล้วน: ต่อท้าย chunk ก่อนหน้าถ้ามี
+            if cur is not None and cur[4] + size <= max_chars:
+                cur[1], cur[4] = b, cur[4] + size
+            continue
+        if size > max_chars:
+            flush()
+            for pa, pb in _split_lines(a, b, lines, max_chars):
+                packed.append((pa, pb, [sym] if sym else [], kind))
+            continue
+        if cur is not None and cur[4] + size <= max_chars:
+            cur[1], cur[4] = b, cur[4] + size
+            if sym:
+                cur[2].append(sym)
+            if cur[3] == "module":
+                cur[3] = kind
+            continue
+        flush()
+        cur = [a, b, [sym] if sym else [], kind, size]
+    flush()
+    return packed
+
+# ---- Public API ----
+def chunk_source(path: str, text: str, max_chars: int = 1500) -> List[Dict]:
+    """แบ่งเนื้อหาไฟล์เป็น chunk ตามโครงสร้าง
+
+    คืน list ของ dict: start, end (offset ตัวอักษร), start_line, end_line (เริ่มที่ 1, รวมปลาย),
+    symbols, kind และ text
+    """
+    if not text.strip():
+        return []
+    lines = text.splitlines(keepends=True)
+    ext = os.path.splitext(path)[1].lower()
+
+    units: Optional[List[Unit]] = None
+    if ext == ".py":
+        units = _py_units(text, lines, max_chars)
+    elif ext in JS_EXT:
+        units = _js_units(lines)
+    elif ext in MD_EXT:
+        units = _md_units(lines)
+    if units is None:
+        units = []   # ภาษาอื่นหรือ parse ไม่ได้: ตัดตามบรรทัดอย่างเดียว
+
+    offsets = [0]
+    for l in lines:
+        offsets.append(offsets[-1] + len(l))
+
+    chunks: List[Dict] = []
+    for a, b, symbols, kind in _pack(_fill_gaps(units, len(lines)), lines, max_chars):
+        chunk = text[offsets[a]:offsets[b]]
+        if not chunk.strip():
+            continue
+        chunks.append({
+            "start": offsets[a],
+            "end": offsets[b],
+            "start_line": a + 1,
+            "end_line": b,
+            "symbols": symbols,
+            "kind": kind,
+            "text": chunk,
+        })
+    return chunks
+
+def prepare_file(path: str, prev_hash: Optional[str] = None, max_chars: int = 1500) -> Tuple[str, Optional[List[Dict]]]:
+    """อ่านไฟล์ คำนวณ hash และแบ่ง chunk (รันใน process pool)
+
+    คืน (hash, None) ถ้า hash เท่ากับ prev_hash (ไฟล์ไม่เปลี่ยน ไม่ต้องแบ่ง)
+    """
+    text = read_text_safe(path)
+    h = content_hash(text)
+    if prev_hash is not None and h == prev_hash:
+        return h, None
+    return h, chunk_source(path, text, max_chars)
@@ -1,10 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
-import httpx, time, os
+import time
+from vector_store import VectorStoreError, vector_store
 
 router = APIRouter(prefix="/context", tags=["context"])
 
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
 COLLECTION = "demo_rag"
 
 class BundleReq(BaseModel):
@@ -18,16 +18,11 @@ class BundleResp(BaseModel):
 
 @router.post("/bundle", response_model=BundleResp)
 async def make_bundle(body: BundleReq):
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        # ใช้ POST /points กับ ids เพื่อดึง payload/vectors
-        resp = await client.post(f"{QDRANT_URL}/collections/{COLLECTION}/points", json={
-            "ids": body.ids,
-            "with_payload": True,
-            "with_vectors": False
-        })
-        if resp.status_code != 200:
-            raise HTTPException(500, f"Qdrant retrieve error: {resp.text}")
-        pts = resp.json().get("result", [])
+    # ดึง payload ของ point ตาม ids
+    try:
+        pts = await vector_store.retrieve(COLLECTION, body.ids)
+    except VectorStoreError as e:
+        raise HTTPException(500, f"Vector retrieve error: {e}")
 
     # ประกอบข้อความ bundle
     title = body.title or f"Context Bundle ({time.strftime('%Y-%m-%d %H:%M:%S')})"
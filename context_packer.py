@@ -0,0 +1,197 @@
+# context_packer.py
+"""
+จัด prompt ให้อยู่ในงบ token ของแต่ละโมเดล (ใช้ร่วมกันโดย code_api.build_prompt และ chat_api.build_prompt)
+
+ลำดับความสำคัญ: system prompt + คำถาม (ใส่เต็มเสมอ) > บริบทจากการค้น > ประวัติสนทนา
+- บริบท: ทุกชิ้นได้ส่วนแบ่งเท่ากัน ชิ้นที่สั้นกว่าส่วนแบ่งคืนที่ที่เหลือให้ชิ้นอื่น (water-filling)
+  ชิ้นที่ยาวเกินถูกตัดที่ขอบบรรทัด/ประโยค ลำดับชิ้นคงเดิม
+- ประวัติ: จองที่ไว้ได้ไม่เกิน PROMPT_HISTORY_SHARE ของงบที่เหลือ แล้วใส่จากข้อความล่าสุดย้อนขึ้นไป
+  ที่ที่บริบทใช้ไม่หมดตกเป็นของประวัติ
+
+จำนวน token เป็นค่าประมาณ (ไม่โหลด tokenizer จริง): คำภาษาอังกฤษ/ตัวเลข ~4 ตัวอักษรต่อ token,
+อักษรไทยและอักษรอื่นที่ไม่ใช่ ASCII ~2 ตัวอักษรต่อ token, เครื่องหมายแต่ละตัว 1 token
+ซึ่งประมาณเกินจริงเล็กน้อยสำหรับ qwen3 / gpt-4o-mini จึงปลอดภัยที่จะใช้เป็นเพดาน
+
+template ของ system prompt ถูก cache ไว้ในหน่วยความจำ อ่านไฟล์ใหม่เมื่อ mtime เปลี่ยนเท่านั้น
+"""
+import os
+import re
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+def _parse_budgets(spec: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in spec.split(","):
+        model, sep, n = part.strip().rpartition("=")
+        if sep and model and n.strip().isdigit():
+            out[model.strip()] = int(n)
+    return out
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))   # โมเดลที่ไม่อยู่ใน PROMPT_TOKEN_BUDGETS
+PROMPT_TOKEN_BUDGETS = _parse_budgets(os.getenv("PROMPT_TOKEN_BUDGETS", "qwen3:8b=6000,gpt-4o-mini=24000"))
+PROMPT_HISTORY_SHARE = float(os.getenv("PROMPT_HISTORY_SHARE", "0.25"))
+MIN_PIECE_TOKENS = 24       # ส่วนที่เหลือน้อยกว่านี้ไม่คุ้มจะใส่ครึ่งๆ กลางๆ
+ITEM_OVERHEAD = 4           # ตัวคั่นระหว่างชิ้นบริบทที่ผู้เรียกใส่ (เช่น "\n---\n")
+TRUNCATED_MARK = " …"
+
+_TOKEN_RE = re.compile(r"[A-Za-z0-9_]+|[^\x00-\x7f\s]+|[^\sA-Za-z0-9_]")
+# ขอบที่ตัดได้ เรียงจากดีที่สุด: บรรทัดว่าง, ขึ้นบรรทัด, จบประโยค, ช่องว่าง (ภาษาไทยเว้นวรรคระหว่างประโยค)
+_BOUNDARIES = ("\n\n", "\n", ". ", "? ", "! ", "。", " ")
+
+def estimate_tokens(text: str) -> int:
+    n = 0
+    for m in _TOKEN_RE.finditer(text):
+        s = m.group()
+        if s[0].isascii():
+            n += (len(s) + 3) // 4 if (s[0].isalnum() or s[0] == "_") else 1
+        else:
+            n += (len(s) + 1) // 2
+    return n
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """ตัด text ให้ไม่เกิน max_tokens ที่ขอบบรรทัด/ประโยคถ้ามีในช่วงท้าย 40% ของส่วนที่เก็บ"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # หาความยาวตัวอักษรที่มากที่สุดที่ยังไม่เกินงบ (binary search)
+    # token หนึ่งยาวไม่เกิน ~4 ตัวอักษร (ไม่นับช่องว่าง) จึงไม่ต้องค้นเกิน 8 เท่าของงบ
+    lo, hi = 0, min(len(text), max_tokens * 8)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    cut = lo
+    floor = int(cut * 0.6)
+    for b in _BOUNDARIES:
+        i = text.rfind(b, floor, cut)
+        if i > 0:
+            cut = i + (len(b) if b in (". ", "? ", "! ", "。") else 0)
+            break
+    return text[:cut].rstrip() + TRUNCATED_MARK if cut > 0 else ""
+
+class Packed:
+    def __init__(self, context: List[str], history: List[str], truncated: bool):
+        self.context = context        # ลำดับเดิม, ชิ้นที่ไม่ได้ที่ถูกตัดออก
+        self.history = history        # ลำดับเดิม (เก่า -> ใหม่)
+        self.truncated = truncated    # มีชิ้นที่ถูกตัดหรือทิ้ง
+
+class ContextPacker:
+    def __init__(self, budgets: Dict[str, int] = PROMPT_TOKEN_BUDGETS, default_budget: int = PROMPT_TOKEN_BUDGET,
+                 history_share: float = PROMPT_HISTORY_SHARE):
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.history_share = history_share
+        self._templates: Dict[str, Tuple[float, str]] = {}
+        self.template_loads = 0
+        self.packs = 0
+        self.truncated = 0
+        self.tokens = 0
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    # ---- system prompt templates ----
+    def template(self, paths: Sequence[str], default: str) -> str:
+        """เนื้อหาไฟล์แรกใน paths ที่มีอยู่ (cache ตาม mtime) หรือ default"""
+        for path in paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            cached = self._templates.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError as e:
+                logger.error(f"Cannot read prompt template {path}: {e}")
+                continue
+            self._templates[path] = (mtime, text)
+            self.template_loads += 1
+            return text
+        logger.error(f"Prompt template not found: {', '.join(paths)}")
+        return default
+
+    # ---- packing ----
+    @staticmethod
+    def _fill(items: List[str], budget: int) -> Tuple[List[str], bool]:
+        """water-filling: แบ่ง budget ให้ทุกชิ้นเท่ากัน ชิ้นสั้นคืนส่วนที่เหลือ"""
+        sizes = [estimate_tokens(t) + ITEM_OVERHEAD for t in items]
+        if sum(sizes) <= budget:
+            return list(items), False
+        alloc = [0] * len(items)
+        left = budget
+        pending = sorted(range(len(items)), key=sizes.__getitem__)
+        while pending:
+            share = left // len(pending)
+            i = pending[0]
+            if sizes[i] <= share:
+                alloc[i] = sizes[i]
+                left -= sizes[i]
+                pending.pop(0)
+                continue
+            for j in pending:
+                alloc[j] = share
+            break
+        out = []
+        for text, size, n in zip(items, sizes, alloc):
+            if n >= size:
+                out.append(text)
+            elif n - ITEM_OVERHEAD >= MIN_PIECE_TOKENS:
+                cut = truncate_to_tokens(text, n - ITEM_OVERHEAD)
+                if cut:
+                    out.append(cut)
+        return out, True
+
+    def _recent(self, history: List[str], budget: int) -> Tuple[List[str], bool]:
+        """ใส่จากข้อความล่าสุดย้อนขึ้นไปจนเต็มงบ (ข้อความล่าสุดถูกตัดได้ถ้ายาวเกินงบทั้งหมด)"""
+        out: List[str] = []
+        left = budget
+        for i, text in enumerate(reversed(history)):
+            n = estimate_tokens(text) + 1
+            if n <= left:
+                out.append(text)
+                left -= n
+                continue
+            if i == 0 and left >= MIN_PIECE_TOKENS:
+                out.append(truncate_to_tokens(text, left - 1))
+            return out[::-1], True
+        return out[::-1], False
+
+    def pack(self, budget: int, fixed: str, context: List[str], history: Optional[List[str]] = None) -> Packed:
+        """fixed = ส่วนที่ต้องใส่เต็ม (system prompt, หัวข้อ, คำถาม) ประกอบแบบที่ผู้เรียกจะ render จริงแต่บริบทว่าง"""
+        history = history or []
+        left = max(0, budget - estimate_tokens(fixed))
+        hist_need = sum(estimate_tokens(t) + 1 for t in history)
+        reserve = min(hist_need, int(left * self.history_share))
+        ctx, ctx_cut = self._fill(context, left - reserve)
+        used = sum(estimate_tokens(t) + ITEM_OVERHEAD for t in ctx)
+        hist, hist_cut = self._recent(history, left - used)
+        return Packed(ctx, hist, ctx_cut or hist_cut)
+
+    def measure(self, prompt: str, truncated: bool) -> int:
+        """นับ token ของ prompt ที่ประกอบเสร็จแล้ว (ค่าที่รายงานใน response) และเก็บสถิติ"""
+        n = estimate_tokens(prompt)
+        self.packs += 1
+        self.tokens += n
+        if truncated:
+            self.truncated += 1
+        return n
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "budgets": dict(self.budgets),
+            "default_budget": self.default_budget,
+            "packs": self.packs,
+            "truncated": self.truncated,
+            "avg_prompt_tokens": round(self.tokens / self.packs, 1) if self.packs else 0.0,
+            "template_loads": self.template_loads,
+        }
+
+context_packer = ContextPacker()
@@ -0,0 +1,342 @@
+# conversation_indexer.py
+"""
+Index ข้อความแชทลง conversation_rag แบบเกือบ real-time ภายใน backend
+
+ทุกข้อความที่บันทึกผ่าน history_api.append_records จะถูกใส่คิวถาวร (SQLite ไฟล์เดียว)
+background worker ดึงจากคิวเป็น batch, embed ผ่าน embedding_store แล้ว upsert ลง vector store
+ด้วย point id เดียวกับ index_conversation.py (สองทางจึงไม่สร้าง point ซ้ำกัน)
+
+- คิวอยู่บนดิสก์ restart แล้วข้อความที่ค้างจะถูก index ต่อ
+- backpressure: ถ้า embedding batcher มีงานค้างมาก (query ของผู้ใช้รออยู่) worker จะรอก่อน,
+  batch ที่ช้าเกิน CONV_INDEX_SLOW_MS จะลดจำนวน batch ที่ทำพร้อมกันลงครึ่งหนึ่ง แล้วค่อยๆ เพิ่มคืน
+  และ batch ที่ล้มเหลวจะถูกลองใหม่แบบ exponential backoff
+- batch ที่ล้มเหลวถูกแบ่งครึ่งแล้วลองใหม่ทันที ข้อความที่ดีจึงไม่ต้องรอ backoff ของข้อความที่เสีย
+  worker หยุดรอทั้งหมดเฉพาะเมื่อทั้ง batch ล้มเหลว (เช่น Ollama/vector store ล่ม)
+- ข้อความที่ล้มเหลวครบ CONV_INDEX_MAX_ATTEMPTS ครั้งถูกย้ายไปตาราง dead (dead-letter) ในไฟล์คิวเดียวกัน
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from embed_batcher import get_batcher, EMBED_MODEL
+from http_clients import pools
+from index_conversation import ensure_collection, index_messages, message_point
+from vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+CONV_INDEX_ENABLED = os.getenv("CONV_INDEX_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+CONV_INDEX_QUEUE_PATH = os.path.expanduser(os.getenv("CONV_INDEX_QUEUE_PATH", "~/private-ai/conv_index_queue.db"))
+CONV_INDEX_BATCH = int(os.getenv("CONV_INDEX_BATCH", "32"))
+CONV_INDEX_CONCURRENCY = int(os.getenv("CONV_INDEX_CONCURRENCY", "2"))
+CONV_INDEX_MAX_PENDING = int(os.getenv("CONV_INDEX_MAX_PENDING", "64"))   # embed ที่ค้างใน batcher ก่อน worker จะหลีกทาง
+CONV_INDEX_SLOW_MS = float(os.getenv("CONV_INDEX_SLOW_MS", "5000"))
+CONV_INDEX_MAX_BACKOFF = float(os.getenv("CONV_INDEX_MAX_BACKOFF", "60"))  # วินาที
+CONV_INDEX_MAX_ATTEMPTS = int(os.getenv("CONV_INDEX_MAX_ATTEMPTS", "8"))   # ล้มเหลวครบแล้วย้ายไป dead-letter
+CONV_INDEX_POLL = 1.0   # วินาที: ตรวจคิวซ้ำแม้ไม่มีสัญญาณ (เช่นรายการที่รอ retry)
+
+# ---- Persistent queue ----
+class IndexQueue:
+    """คิวข้อความที่รอ index ในตาราง SQLite (WAL) เรียงตามลำดับที่เข้าคิว"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, project_id TEXT NOT NULL, room_id TEXT NOT NULL, "
+            "rec TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, not_before REAL NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_pending_ready ON pending (not_before, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dead ("
+            "id INTEGER PRIMARY KEY, project_id TEXT NOT NULL, room_id TEXT NOT NULL, rec TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def push(self, project_id: str, room_id: str, recs: List[dict]) -> None:
+        rows = [(project_id, room_id, json.dumps(r, ensure_ascii=False)) for r in recs]
+        with self._lock:
+            self._conn.executemany("INSERT INTO pending (project_id, room_id, rec) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def take(self, n: int, exclude: List[int]) -> List[Tuple[int, str, str, dict, int]]:
+        """(id, project_id, room_id, rec, attempts) ที่ถึงเวลาแล้ว ไม่รวม id ที่กำลังทำอยู่"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, project_id, room_id, rec, attempts FROM pending WHERE not_before <= ? "
+                "ORDER BY id LIMIT ?", (time.time(), n + len(exclude)),
+            ).fetchall()
+        busy = set(exclude)
+        out = []
+        for rid, project_id, room_id, rec, attempts in rows:
+            if rid in busy:
+                continue
+            try:
+                out.append((rid, project_id, room_id, json.loads(rec), attempts))
+            except json.JSONDecodeError:
+                self.ack([rid])
+            if len(out) >= n:
+                break
+        return out
+
+    def ack(self, ids: List[int]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def retry(self, ids: List[int], delay: float) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE pending SET attempts = attempts + 1, not_before = ? WHERE id = ?",
+                [(time.time() + delay, i) for i in ids],
+            )
+            self._conn.commit()
+
+    def bury(self, ids: List[int], error: str) -> None:
+        """ย้ายรายการที่ล้มเหลวครบจำนวนครั้งไปตาราง dead (ไม่ถูกดึงมาทำอีก)"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dead (id, project_id, room_id, rec, attempts, error, failed_at) "
+                "SELECT id, project_id, room_id, rec, attempts + 1, ?, ? FROM pending WHERE id = ?",
+                [(error, time.time(), i) for i in ids],
+            )
+            self._conn.executemany("DELETE FROM pending WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def dead_size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ---- Worker ----
+class ConversationIndexer:
+    def __init__(self, queue_path: str = CONV_INDEX_QUEUE_PATH, enabled: bool = CONV_INDEX_ENABLED):
+        self.enabled = enabled
+        self.queue_path = queue_path
+        self._queue: Optional[IndexQueue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._open_lock = threading.Lock()
+        self._resume_at = 0.0
+        self._inflight: Dict[asyncio.Task, List[int]] = {}
+        self._collection_ready = False
+        self.concurrency = max(1, CONV_INDEX_CONCURRENCY)   # ปรับขึ้นลงตาม latency (ไม่เกินค่าตั้ง)
+        self.backoff = 0.0
+        # stats
+        self.enqueued = 0
+        self.indexed = 0
+        self.skipped = 0
+        self.batches = 0
+        self.failures = 0
+        self.splits = 0
+        self.dead_lettered = 0
+        self.throttled = 0
+        self.last_lag = 0.0
+
+    def _open(self) -> Optional[IndexQueue]:
+        with self._open_lock:
+            if self._queue is None and self.enabled:
+                try:
+                    self._queue = IndexQueue(self.queue_path)
+                except Exception as e:
+                    logger.error(f"Conversation indexing disabled, cannot open queue '{self.queue_path}': {e}")
+                    self.enabled = False
+            return self._queue
+
+    async def start(self) -> None:
+        if not self.enabled or (self._task is not None and not self._task.done()):
+            return
+        if self._open() is None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """หยุดรับ batch ใหม่และรอ batch ที่กำลังทำจบ ข้อความที่เหลือยังอยู่ในคิวบนดิสก์"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        try:
+            await self._task
+        finally:
+            self._task = None
+            if self._queue is not None:
+                self._queue.close()
+                self._queue = None
+
+    def enqueue(self, project_id: str, room_id: str, recs: List[dict]) -> None:
+        """เรียกได้จากทุก thread (append_records รันใน threadpool) ไม่ raise"""
+        queue = self._open()
+        if queue is None or not recs:
+            return
+        try:
+            queue.push(project_id, room_id, [dict(r, _queued_at=time.time()) for r in recs])
+            self.enqueued += len(recs)
+        except Exception as e:
+            logger.error(f"Failed to queue messages for indexing in room '{project_id}:{room_id}': {e}")
+            return
+        loop, wake = self._loop, self._wake
+        if loop is not None and wake is not None:
+            try:
+                loop.call_soon_threadsafe(wake.set)
+            except RuntimeError:
+                pass   # loop ปิดไปแล้ว รอบหน้าจะเจอในคิว
+
+    # ---- internals ----
+    def _busy_ids(self) -> List[int]:
+        return [i for ids in self._inflight.values() for i in ids]
+
+    def _saturated(self) -> bool:
+        """งาน embed อื่น (query ของผู้ใช้) ค้างใน batcher มากเกินไป: ให้งานนั้นไปก่อน"""
+        mine = sum(len(ids) for ids in self._inflight.values())
+        return get_batcher(pools.ollama, EMBED_MODEL).pending - mine > CONV_INDEX_MAX_PENDING
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            wait = self._resume_at - time.monotonic()
+            if wait > 0:
+                await self._sleep(wait)   # backoff หลังล้มเหลว (ถูกปลุกได้เฉพาะตอน stop)
+                continue
+            while len(self._inflight) < self.concurrency and not self._stopping:
+                if self._saturated():
+                    self.throttled += 1
+                    break
+                rows = await asyncio.to_thread(self._queue.take, CONV_INDEX_BATCH, self._busy_ids())
+                if not rows:
+                    break
+                task = asyncio.create_task(self._index(rows))
+                self._inflight[task] = [r[0] for r in rows]
+                task.add_done_callback(lambda t: self._inflight.pop(t, None))
+            await self._sleep(CONV_INDEX_POLL)
+        if self._inflight:
+            await asyncio.gather(*list(self._inflight), return_exceptions=True)
+
+    async def _sleep(self, seconds: float) -> None:
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _attempt(self, rows: List[Tuple[int, str, str, dict, int]]) -> Optional[Exception]:
+        """embed + upsert แล้ว ack; คืน exception ถ้าล้มเหลว (รายการยังอยู่ในคิว)"""
+        items = []
+        for _, project_id, room_id, rec, _ in rows:
+            item = message_point(project_id, room_id, rec)
+            if item:
+                items.append(item)
+        try:
+            if items and not self._collection_ready:
+                await ensure_collection(vector_store)
+                self._collection_ready = True
+            n = await index_messages(pools.ollama, items) if items else 0
+        except Exception as e:
+            return e
+        await asyncio.to_thread(self._queue.ack, [r[0] for r in rows])
+        self.indexed += n
+        self.skipped += len(rows) - len(items)
+        return None
+
+    async def _split(self, rows: List[Tuple[int, str, str, dict, int]], error: Exception) -> Tuple[list, Exception]:
+        """แบ่งครึ่ง batch ที่ล้มเหลวซ้ำๆ เพื่อ ack ส่วนที่ดี คืน (รายการที่ยังล้มเหลว, error ล่าสุด)
+
+        batch ใหม่ที่ล้มเหลวทั้งสองครึ่งน่าจะเป็นปัญหาของ backend ไม่ใช่ข้อความ จึงไม่แบ่งต่อ
+        (ไม่ยิง embed ที่รู้ว่าจะล้มเป็นสิบครั้ง) รอบ retry จึงค่อยแบ่งจนเหลือเฉพาะข้อความที่เสีย"""
+        if len(rows) == 1:
+            return rows, error
+        self.splits += 1
+        mid = len(rows) // 2
+        halves = [(part, await self._attempt(part)) for part in (rows[:mid], rows[mid:])]
+        bad = [(part, e) for part, e in halves if e is not None]
+        if len(bad) == 2 and not any(r[4] for r in rows):
+            return rows, bad[-1][1]
+        failed = []
+        for part, e in bad:
+            rest, error = await self._split(part, e)
+            failed += rest
+        return failed, error
+
+    async def _fail(self, rows: List[Tuple[int, str, str, dict, int]], error: Exception) -> None:
+        retry = [r for r in rows if r[4] + 1 < CONV_INDEX_MAX_ATTEMPTS]
+        dead = [r for r in rows if r[4] + 1 >= CONV_INDEX_MAX_ATTEMPTS]
+        if dead:
+            self.dead_lettered += len(dead)
+            where = ", ".join(f"{r[1]}:{r[2]}#{r[0]}" for r in dead[:10])
+            logger.error(f"Conversation indexing gave up after {CONV_INDEX_MAX_ATTEMPTS} attempts on {len(dead)} messages ({where}): {error}")
+            await asyncio.to_thread(self._queue.bury, [r[0] for r in dead], str(error))
+        if retry:
+            attempts = max(r[4] for r in retry) + 1
+            delay = min(CONV_INDEX_MAX_BACKOFF, 2 ** min(attempts, 10))
+            logger.error(f"Conversation indexing failed for {len(retry)} messages (retry in {delay:.0f}s): {error}")
+            await asyncio.to_thread(self._queue.retry, [r[0] for r in retry], delay)
+
+    async def _index(self, rows: List[Tuple[int, str, str, dict, int]]) -> None:
+        oldest = min(r[3].get("_queued_at", time.time()) for r in rows)
+        t0 = time.perf_counter()
+        error = await self._attempt(rows)
+        if error is not None:
+            self.failures += 1
+            failed, error = await self._split(rows, error)
+            if len(rows) > 1 and len(failed) == len(rows):
+                # ทั้ง batch ล้มเหลว: backend มีปัญหา พักทั้ง worker และลดจำนวน batch ที่ทำพร้อมกัน
+                self.backoff = min(CONV_INDEX_MAX_BACKOFF, max(1.0, self.backoff * 2))
+                self._resume_at = time.monotonic() + self.backoff
+                self.concurrency = max(1, self.concurrency // 2)
+            if failed:
+                await self._fail(failed, error)
+                return
+        elapsed_ms = 1000 * (time.perf_counter() - t0)
+        # AIMD: ช้าเกิน = ลดครึ่ง, ปกติ = เพิ่มทีละหนึ่ง
+        if elapsed_ms > CONV_INDEX_SLOW_MS:
+            self.concurrency = max(1, self.concurrency // 2)
+        else:
+            self.concurrency = min(max(1, CONV_INDEX_CONCURRENCY), self.concurrency + 1)
+        self.backoff = 0.0
+        self.batches += 1
+        self.last_lag = round(time.time() - oldest, 3)
+        if self._wake is not None:
+            self._wake.set()   # ว่างแล้ว ดึง batch ถัดไปได้เลย
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "pending": self._queue.size() if self._queue is not None else 0,
+            "in_flight_batches": len(self._inflight),
+            "concurrency": self.concurrency,
+            "backoff_seconds": self.backoff,
+            "enqueued": self.enqueued,
+            "indexed": self.indexed,
+            "skipped": self.skipped,
+            "batches": self.batches,
+            "failures": self.failures,
+            "splits": self.splits,
+            "dead_lettered": self.dead_lettered,
+            "dead_letter_size": self._queue.dead_size() if self._queue is not None else 0,
+            "throttled": self.throttled,
+            "last_lag_seconds": self.last_lag,
+        }
+
+conversation_indexer = ConversationIndexer()
@@ -0,0 +1,179 @@
+# embed_batcher.py
+"""
+Micro-batching ของ embedding requests ก่อนส่งเข้า Ollama
+
+request ที่เข้ามาภายในช่วงเวลาสั้นๆ (EMBED_BATCH_WAIT_MS) จะถูกรวมเป็นก้อนเดียว
+(ไม่เกิน EMBED_BATCH_MAX ข้อความ) แล้วส่งไปที่ /api/embed แบบหลาย input
+จากนั้นแยก vector คืนให้ผู้เรียกแต่ละราย
+
+ถ้า Ollama เป็นเวอร์ชันเก่าที่ไม่มี /api/embed จะ fallback ไปเรียก /api/embeddings ทีละข้อความ
+"""
+import os
+import time
+import asyncio
+import logging
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
+EMBED_MODEL = os.getenv("EMBED_MODEL", "bge-m3")
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_BATCH_CONCURRENCY = int(os.getenv("EMBED_BATCH_CONCURRENCY", "4"))
+
+class EmbeddingError(RuntimeError):
+    pass
+
+class EmbeddingBatcher:
+    """รวม embedding requests ที่เข้ามาพร้อมๆ กันให้เป็น batch เดียว"""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        model: str = EMBED_MODEL,
+        max_batch: int = EMBED_BATCH_MAX,
+        max_wait_ms: float = EMBED_BATCH_WAIT_MS,
+        max_concurrency: int = EMBED_BATCH_CONCURRENCY,
+        base_url: str = OLLAMA_URL,
+    ):
+        # เก็บ client แบบ weakref เพื่อไม่ให้ batcher ยื้ออายุ client ไว้
+        self._client_ref = weakref.ref(client)
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.base_url = base_url
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sem = asyncio.Semaphore(max(1, max_concurrency))
+        self._tasks: set = set()
+        self._batch_api = True
+        self._running = 0   # ข้อความที่ส่งออกไปแล้วและกำลังรอผล
+        # stats
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.largest_batch = 0
+        self.fallback_calls = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    # ---- public ----
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((text, fut))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """ส่งหลายข้อความพร้อมกัน (เช่นจาก ingest/indexing) ลำดับผลลัพธ์ตรงกับ input"""
+        return list(await asyncio.gather(*(self.embed(t) for t in texts)))
+
+    @property
+    def pending(self) -> int:
+        """ข้อความที่รอส่งหรือกำลังรอผล (ใช้ตัดสินว่า Ollama อิ่มตัวหรือยัง)"""
+        return len(self._pending) + self._running
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "model": self.model,
+            "requests": self.requests,
+            "batches": self.batches,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "pending": len(self._pending),
+            "in_flight": self._running,
+            "fallback_calls": self.fallback_calls,
+            "errors": self.errors,
+            "avg_batch_ms": round(1000 * self.busy_seconds / self.batches, 2) if self.batches else 0.0,
+            "batch_api": self._batch_api,
+        }
+
+    # ---- internals ----
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        # ข้ามรายการที่ผู้เรียกยกเลิกไปแล้ว
+        live = [(t, f) for t, f in batch if not f.done()]
+        if not live:
+            return
+        self._running += len(live)
+        try:
+            async with self._sem:
+                t0 = time.perf_counter()
+                try:
+                    vecs = await self._call([t for t, _ in live])
+                except Exception as e:
+                    self.errors += 1
+                    for _, fut in live:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    return
+                finally:
+                    self.busy_seconds += time.perf_counter() - t0
+        finally:
+            self._running -= len(live)
+        self.batches += 1
+        self.items += len(live)
+        self.largest_batch = max(self.largest_batch, len(live))
+        for (_, fut), vec in zip(live, vecs):
+            if not fut.done():
+                fut.set_result(vec)
+
+    async def _call(self, texts: List[str]) -> List[List[float]]:
+        client = self._client_ref()
+        if client is None or client.is_closed:
+            raise EmbeddingError("HTTP client is closed")
+        if self._batch_api:
+            r = await client.post(f"{self.base_url}/api/embed", json={"model": self.model, "input": texts})
+            if r.status_code == 404 and "model" not in r.text.lower():
+                logger.warning("Ollama /api/embed not available, falling back to /api/embeddings per text")
+                self._batch_api = False
+            elif r.status_code != 200:
+                raise EmbeddingError(f"Ollama embed error: {r.text}")
+            else:
+                embs = r.json().get("embeddings") or []
+                if len(embs) != len(texts):
+                    raise EmbeddingError(f"Ollama returned {len(embs)} embeddings for {len(texts)} inputs")
+                return embs
+        self.fallback_calls += 1
+        return list(await asyncio.gather(*(self._call_single(client, t) for t in texts)))
+
+    async def _call_single(self, client: httpx.AsyncClient, text: str) -> List[float]:
+        r = await client.post(f"{self.base_url}/api/embeddings", json={"model": self.model, "prompt": text})
+        if r.status_code != 200:
+            raise EmbeddingError(f"Ollama embeddings error: {r.text}")
+        emb = r.json().get("embedding")
+        if not emb:
+            raise EmbeddingError("No embedding returned")
+        return emb
+
+# ---- Registry: หนึ่ง batcher ต่อ (client, model) ----
+_batchers: "weakref.WeakKeyDictionary[httpx.AsyncClient, Dict[str, EmbeddingBatcher]]" = weakref.WeakKeyDictionary()
+
+def get_batcher(client: httpx.AsyncClient, model: str = EMBED_MODEL) -> EmbeddingBatcher:
+    per_client = _batchers.setdefault(client, {})
+    b = per_client.get(model)
+    if b is None:
+        b = per_client[model] = EmbeddingBatcher(client, model=model)
+    return b
+
+def batcher_stats() -> List[Dict[str, object]]:
+    return [b.stats() for per_client in list(_batchers.values()) for b in per_client.values()]
@@ -0,0 +1,168 @@
+# embedding_store.py
+"""
+Content-addressed embedding store สำหรับงาน indexing/ingest
+
+key คือ sha256(model + ข้อความของ chunk ตามตัวอักษร) เก็บ vector ใน SQLite (DiskVectorCache)
+ข้อความเดียวกันจึงถูก embed แค่ครั้งเดียว แล้วใช้ vector เดิมกับทุก point และทุก collection
+ที่อ้างถึง (ไฟล์ vendored, config ที่คัดลอกกันมา, license header, ข้อความแชทซ้ำๆ ฯลฯ)
+
+ใช้ร่วมกันโดย index_repo.py, index_conversation.py และ ingest_api.py
+ต่างจาก query cache ใน embeddings.py ตรงที่ไม่ normalize ช่องว่าง (ช่องว่างในโค้ดมีความหมาย)
+
+ตั้ง EMBED_STORE_PATH เป็นค่าว่างเพื่อปิด disk tier (ยัง dedup ภายในการเรียกแต่ละครั้งได้)
+"""
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from embed_batcher import get_batcher, EmbeddingError, EMBED_MODEL
+from embeddings import DiskVectorCache
+
+logger = logging.getLogger(__name__)
+
+EMBED_STORE_PATH = os.getenv("EMBED_STORE_PATH", "~/private-ai/embeddings.db")
+
+Vector = List[float]
+
+def content_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{text}".encode("utf-8", "ignore")).hexdigest()
+
+class EmbeddingStore:
+    def __init__(self, path: str = EMBED_STORE_PATH):
+        self.disk: Optional[DiskVectorCache] = None
+        if path:
+            try:
+                self.disk = DiskVectorCache(path)
+            except Exception as e:
+                logger.error(f"Embedding store disabled, cannot open '{path}': {e}")
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # stats
+        self.requested = 0   # ข้อความที่ขอ embed ทั้งหมด
+        self.hits = 0        # ได้ vector จาก store
+        self.shared = 0      # ซ้ำกับข้อความอื่นในการเรียกเดียวกัน หรือกำลัง embed อยู่
+        self.embedded = 0    # เรียก model จริง
+
+    # ---- sync ----
+    def _count(self, counts: Optional[Dict[str, int]], **kw: int) -> None:
+        with self._lock:
+            for name, n in kw.items():
+                setattr(self, name, getattr(self, name) + n)
+        if counts is not None:
+            for name, n in kw.items():
+                counts[name] = counts.get(name, 0) + n
+
+    def lookup(self, model: str, texts: List[str], counts: Optional[Dict[str, int]] = None) -> Tuple[Dict[str, Vector], List[str]]:
+        """คืน ({key: vector} ที่มีอยู่แล้ว, ข้อความที่ยังไม่มี ไม่ซ้ำกัน เรียงตามลำดับที่พบ)"""
+        found: Dict[str, Vector] = {}
+        missing: Dict[str, str] = {}
+        for t in texts:
+            k = content_key(model, t)
+            if k in found or k in missing:
+                continue
+            vec = self._get(k)
+            if vec is not None:
+                found[k] = vec
+            else:
+                missing[k] = t
+        self._count(counts, requested=len(texts), hits=len(found), shared=len(texts) - len(found) - len(missing))
+        return found, list(missing.values())
+
+    def store(self, model: str, texts: List[str], vecs: List[Vector], counts: Optional[Dict[str, int]] = None) -> None:
+        items = [(content_key(model, t), v) for t, v in zip(texts, vecs) if v]
+        self._count(counts, embedded=len(items))
+        if self.disk is None or not items:
+            return
+        try:
+            self.disk.put_many(items)
+        except Exception as e:
+            logger.error(f"Embedding store write failed: {e}")
+
+    def embed_many_sync(self, texts: List[str], embed_fn: Callable[[str], Optional[Vector]], model: str = EMBED_MODEL,
+                        counts: Optional[Dict[str, int]] = None) -> List[Optional[Vector]]:
+        """สำหรับสคริปต์แบบ sync: embed_fn ถูกเรียกเฉพาะข้อความที่ยังไม่มีใน store"""
+        found, missing = self.lookup(model, texts, counts)
+        vecs = [embed_fn(t) for t in missing]
+        self.store(model, missing, vecs, counts)
+        for t, v in zip(missing, vecs):
+            if v:
+                found[content_key(model, t)] = v
+        return [found.get(content_key(model, t)) for t in texts]
+
+    # ---- async ----
+    async def embed_many(self, client: httpx.AsyncClient, texts: List[str], model: str = EMBED_MODEL,
+                         counts: Optional[Dict[str, int]] = None) -> List[Vector]:
+        """embed หลายข้อความ ลำดับผลลัพธ์ตรงกับ input ข้อความที่ซ้ำกัน (ในการเรียกนี้, ที่เคย embed แล้ว
+        หรือที่อีก worker กำลัง embed อยู่) จะใช้ vector เดียวกัน
+
+        counts (ถ้าให้มา) จะถูกบวก requested/hits/shared/embedded ของการเรียกนี้ ใช้รายงานผลต่อรอบ
+        """
+        found, missing = self.lookup(model, texts, counts)
+
+        # ข้อความที่อีก coroutine กำลัง embed อยู่: รอผลของเขาแทนการยิงซ้ำ
+        waits: Dict[str, asyncio.Future] = {}
+        mine: List[str] = []
+        for t in missing:
+            k = content_key(model, t)
+            fut = self._inflight.get(k)
+            if fut is not None:
+                waits[k] = fut
+            else:
+                mine.append(t)
+        if waits:
+            self._count(counts, shared=len(waits))
+
+        if mine:
+            loop = asyncio.get_running_loop()
+            keys = [content_key(model, t) for t in mine]
+            futs = [loop.create_future() for _ in mine]
+            for k, f in zip(keys, futs):
+                self._inflight[k] = f
+            try:
+                vecs = await get_batcher(client, model).embed_many(mine)
+                if any(not isinstance(v, list) or not v for v in vecs):
+                    raise ValueError("embedding missing or not a list")
+            except BaseException as e:
+                err = e if isinstance(e, Exception) else EmbeddingError("embedding cancelled")
+                for f in futs:
+                    f.set_exception(err)
+                    f.exception()   # ผู้รอรายอื่นจะได้ exception เอง ไม่ต้อง log ว่าไม่มีใครรับ
+                raise
+            finally:
+                for k in keys:
+                    self._inflight.pop(k, None)
+            for f, v in zip(futs, vecs):
+                f.set_result(v)
+            self.store(model, mine, vecs, counts)
+            found.update(zip(keys, vecs))
+
+        for k, fut in waits.items():
+            found[k] = await asyncio.shield(fut)
+        return [found[content_key(model, t)] for t in texts]
+
+    # ---- internals ----
+    def _get(self, key: str) -> Optional[Vector]:
+        if self.disk is None:
+            return None
+        try:
+            return self.disk.get(key)
+        except Exception as e:
+            logger.error(f"Embedding store read failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "path": self.disk.path if self.disk else None,
+            "requested": self.requested,
+            "hits": self.hits,
+            "shared": self.shared,
+            "embedded": self.embedded,
+            "saved": self.hits + self.shared,
+        }
+
+embedding_store = EmbeddingStore(EMBED_STORE_PATH)
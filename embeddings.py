@@ -0,0 +1,178 @@
+# embeddings.py
+"""
+Query embeddings (bge-m3 ผ่าน Ollama) พร้อม cache ที่ใช้ร่วมกันทุก retrieval endpoint
+
+- ชั้นที่ 1: LRU ในหน่วยความจำ (EMBED_CACHE_SIZE รายการ)
+- ชั้นที่ 2: SQLite บนดิสก์ (optional) ตั้ง EMBED_CACHE_PATH เพื่อให้ cache อยู่รอดข้ามการ restart
+
+key ของ cache คือ (model, ข้อความที่ normalize แล้ว)
+cache miss จะถูกส่งผ่าน embed_batcher เพื่อรวมกับ request อื่นที่เข้ามาพร้อมกัน
+"""
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+
+from embed_batcher import get_batcher, EMBED_MODEL
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "")  # ว่าง = ไม่ใช้ disk tier
+
+# ---- Keys ----
+def normalize_text(text: str) -> str:
+    """NFC + ยุบช่องว่างซ้อน + ตัดช่องว่างหัวท้าย"""
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+# ---- Disk tier ----
+class DiskVectorCache:
+    """ตาราง key -> float32 vector ใน SQLite ไฟล์เดียว"""
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        # timeout: ไฟล์นี้อาจถูกเขียนพร้อมกันจากหลาย process (backend + สคริปต์ index)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vec BLOB NOT NULL, created_at INTEGER NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _pack(vec: List[float]) -> bytes:
+        return array.array("f", vec).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        a = array.array("f")
+        a.frombytes(blob)
+        return a.tolist()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            row = self._conn.execute("SELECT vec FROM vectors WHERE key = ?", (key,)).fetchone()
+        return self._unpack(row[0]) if row else None
+
+    def put(self, key: str, vec: List[float]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vectors (key, vec, created_at) VALUES (?, ?, ?)",
+                (key, self._pack(vec), int(time.time())),
+            )
+            self._conn.commit()
+
+    def put_many(self, items: List[Tuple[str, List[float]]]) -> None:
+        now = int(time.time())
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vec, created_at) VALUES (?, ?, ?)",
+                [(key, self._pack(vec), now) for key, vec in items],
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ---- Two-tier cache ----
+class EmbeddingCache:
+    def __init__(self, max_items: int = EMBED_CACHE_SIZE, disk_path: str = ""):
+        self.max_items = max_items
+        self._mem: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.disk: Optional[DiskVectorCache] = None
+        if disk_path:
+            try:
+                self.disk = DiskVectorCache(disk_path)
+            except Exception as e:
+                logger.error(f"Embedding disk cache disabled, cannot open '{disk_path}': {e}")
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, vec: List[float]) -> None:
+        self._mem[key] = vec
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_items:
+            self._mem.popitem(last=False)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        vec = self._mem.get(key)
+        if vec is not None:
+            self._mem.move_to_end(key)
+            self.hits += 1
+            return vec
+        if self.disk is not None:
+            try:
+                vec = self.disk.get(key)
+            except Exception as e:
+                logger.error(f"Embedding disk cache read failed: {e}")
+                vec = None
+            if vec is not None:
+                self._remember(key, vec)
+                self.disk_hits += 1
+                return vec
+        self.misses += 1
+        return None
+
+    def put(self, model: str, text: str, vec: List[float]) -> None:
+        key = cache_key(model, text)
+        self._remember(key, vec)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, vec)
+            except Exception as e:
+                logger.error(f"Embedding disk cache write failed: {e}")
+
+    def clear(self) -> None:
+        self._mem.clear()
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "size": len(self._mem),
+            "max_items": self.max_items,
+            "disk_path": self.disk.path if self.disk else None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
+
+query_cache = EmbeddingCache(EMBED_CACHE_SIZE, EMBED_CACHE_PATH)
+
+# ---- Embedding ----
+async def embed_query(client: httpx.AsyncClient, text: str, model: str = EMBED_MODEL) -> List[float]:
+    """Embed ข้อความค้นหา โดยดูใน cache ก่อน แล้วค่อยเรียก Ollama"""
+    cached = query_cache.get(model, text)
+    if cached is not None:
+        return cached
+    logger.info(f"Embedding query: '{text[:50]}...'")
+    try:
+        emb = await get_batcher(client, model).embed(normalize_text(text))
+    except Exception as e:
+        logger.error(f"Ollama embeddings error: {e}")
+        raise HTTPException(500, f"Ollama embeddings error: {e}")
+    query_cache.put(model, text, emb)
+    return emb
@@ -1,12 +1,18 @@
 from fastapi import APIRouter, HTTPException, Path, Query
 from pydantic import BaseModel, Field
 from typing import List, Optional
-import os, json, time
+import time
 
-router = APIRouter(prefix="/rooms", tags=["history"])
+from history_store import BASE_DIR, HIST_NAME, history_store, room_hist_path
+from conversation_indexer import conversation_indexer
+
+__all__ = [
+    "router", "Msg", "append_records",
+    # เดิมประกาศไว้ในไฟล์นี้ ยัง import ผ่าน history_api ได้สำหรับสคริปต์เก่า
+    "BASE_DIR", "HIST_NAME", "room_hist_path",
+]
 
-BASE_DIR = os.path.expanduser("~/private-ai/projects")
-HIST_NAME = "chat.jsonl"   # เก็บแบบ JSONL ต่อบรรทัด
+router = APIRouter(prefix="/rooms", tags=["history"])
 
 class Msg(BaseModel):
     role: str = Field(..., description="'user' | 'assistant' | 'system'")
@@ -27,12 +33,36 @@ class ReadResp(BaseModel):
     items: List[Msg]
     next_before: Optional[int] = None   # สำหรับหน้า/โหลดย้อนหลัง
 
-def room_hist_path(project_id: str, room_id: str) -> str:
-    room_dir = os.path.join(BASE_DIR, project_id, "rooms", room_id)
-    os.makedirs(room_dir, exist_ok=True)
-    hist_dir = os.path.join(room_dir, "history")
-    os.makedirs(hist_dir, exist_ok=True)
-    return os.path.join(hist_dir, HIST_NAME)
+class CountResp(BaseModel):
+    room_id: str
+    count: int
+
+class RoomInfo(BaseModel):
+    room_id: str
+    count: int
+    last_ts: Optional[int] = None
+
+class RoomsResp(BaseModel):
+    project_id: str
+    rooms: List[RoomInfo]
+
+def to_msgs(rows: List[dict]) -> List[Msg]:
+    items: list[Msg] = []
+    for r in rows:
+        try:
+            items.append(Msg(**r))
+        except Exception:
+            continue
+    return items
+
+def append_records(project_id: str, room_id: str, recs: List[dict]) -> str:
+    """เขียนหลายข้อความของห้องเดียวกันในครั้งเดียว คืน path ของไฟล์ (หรือฐานข้อมูล)
+
+    ข้อความที่เขียนสำเร็จจะถูกส่งเข้าคิวของ conversation_indexer เพื่อให้ค้นหาได้ภายในไม่กี่วินาที
+    """
+    path = history_store.append(project_id, room_id, recs)
+    conversation_indexer.enqueue(project_id, room_id, recs)
+    return path
 
 @router.post("/{room_id}/messages", response_model=WriteResp)
 def append_message(
@@ -42,10 +72,8 @@ def append_message(
 ):
     if msg is None:
         raise HTTPException(400, "missing body")
-    path = room_hist_path(project_id, room_id)
     rec = msg.dict()
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    path = append_records(project_id, room_id, [rec])
     return WriteResp(room_id=room_id, ok=True, path=path, last_ts=rec["ts"])
 
 @router.get("/{room_id}/messages", response_model=ReadResp)
@@ -55,36 +83,31 @@ def read_messages(
     limit: int = Query(30, ge=1, le=200),
     before: Optional[int] = Query(None, description="ดึงรายการก่อน timestamp นี้ (วินาที)"),
 ):
-    path = room_hist_path(project_id, room_id)
-    items: list[Msg] = []
-
-    if not os.path.exists(path):
-        return ReadResp(room_id=room_id, items=[], next_before=None)
-
-    rows = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                rows.append(json.loads(line))
-            except Exception:
-                continue
-
-    # เรียงใหม่→เก่า
-    rows.sort(key=lambda x: x.get("ts", 0), reverse=True)
+    # ใหม่→เก่า, กรอง before, ตัดตาม limit (ใช้ index ของ backend ไม่ต้องอ่านทั้งห้อง)
+    picked, next_before = history_store.read_page(project_id, room_id, limit, before)
+    return ReadResp(room_id=room_id, items=to_msgs(picked), next_before=next_before)
 
-    # กรอง before
-    if before is not None:
-        rows = [r for r in rows if r.get("ts", 0) < before]
-
-    # ตัดตาม limit
-    picked = rows[:limit]
-    next_before = picked[-1]["ts"] if len(picked) == limit else None
+@router.get("/{room_id}/messages/range", response_model=ReadResp)
+def read_messages_range(
+    room_id: str = Path(...),
+    project_id: str = Query("demo"),
+    since: Optional[int] = Query(None, description="ตั้งแต่ timestamp นี้ (รวม)"),
+    until: Optional[int] = Query(None, description="ก่อน timestamp นี้"),
+    limit: int = Query(200, ge=1, le=1000),
+):
+    # เก่า→ใหม่ ภายในช่วงเวลา
+    picked = history_store.read_range(project_id, room_id, since, until, limit)
+    return ReadResp(room_id=room_id, items=to_msgs(picked), next_before=None)
 
-    # แปลงเป็น Msg
-    for r in picked:
-        try:
-            items.append(Msg(**r))
-        except Exception:
-            continue
+@router.get("/{room_id}/messages/count", response_model=CountResp)
+def count_messages(
+    room_id: str = Path(...),
+    project_id: str = Query("demo"),
+    since: Optional[int] = Query(None),
+    until: Optional[int] = Query(None),
+):
+    return CountResp(room_id=room_id, count=history_store.count(project_id, room_id, since, until))
 
-    return ReadResp(room_id=room_id, items=items, next_before=next_before)
+@router.get("", response_model=RoomsResp)
+def list_rooms(project_id: str = Query("demo")):
+    return RoomsResp(project_id=project_id, rooms=[RoomInfo(**r) for r in history_store.list_rooms(project_id)])
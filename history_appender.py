@@ -0,0 +1,275 @@
+# history_appender.py
+"""
+Group-commit appender สำหรับไฟล์ประวัติ chat.jsonl
+
+- การเขียนที่เข้ามาในห้องเดียวกันภายใน HISTORY_GROUP_COMMIT_MS จะถูกรวมเป็น write เดียว
+  (thread แรกเป็น leader เขียนแทนทุกคน ที่เหลือรอผล)
+- เก็บ file handle ของห้องที่ใช้บ่อยไว้ (LRU, สูงสุด HISTORY_MAX_OPEN_FILES)
+- ใช้ flock ทำให้หลาย uvicorn worker เขียนห้องเดียวกันได้โดยบรรทัดไม่ปนกัน
+- ความทนทานเลือกได้ผ่าน HISTORY_DURABILITY:
+    none      เขียนลง OS page cache อย่างเดียว (เร็วสุด)
+    batch     fsync ทุก batch ก่อนตอบกลับ
+    interval  fsync เป็นรอบทุก HISTORY_FSYNC_INTERVAL_MS (default)
+
+ไฟล์ .idx ไม่ถูก fsync เพราะสร้างใหม่จาก chat.jsonl ได้เสมอ
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+from history_index import append_locked, locked, open_index
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ("none", "batch", "interval")
+HISTORY_DURABILITY = os.getenv("HISTORY_DURABILITY", "interval").lower()
+HISTORY_FSYNC_INTERVAL_MS = int(os.getenv("HISTORY_FSYNC_INTERVAL_MS", "1000"))
+HISTORY_GROUP_COMMIT_MS = float(os.getenv("HISTORY_GROUP_COMMIT_MS", "2"))
+HISTORY_MAX_OPEN_FILES = int(os.getenv("HISTORY_MAX_OPEN_FILES", "128"))
+
+class _Ticket:
+    def __init__(self, recs: List[dict]):
+        self.recs = recs
+        self.t0 = time.perf_counter()
+        self.done = False
+        self.error: Optional[BaseException] = None
+
+class _Room:
+    """คิวของห้องเดียว: รายการที่รอเขียน และ flag ว่ามี leader อยู่หรือไม่"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending: List[_Ticket] = []
+        self.leader = False
+
+class _Handles:
+    def __init__(self, path: str):
+        self.path = path
+        self.data_f = open(path, "a+b")
+        self.idx_f = open_index(path)
+        self.in_use = 0
+        self.dirty = False
+
+    def unlinked(self) -> bool:
+        # ห้อง/ไฟล์ถูกลบหรือย้ายไปขณะที่ handle ยังเปิดอยู่
+        try:
+            return os.fstat(self.data_f.fileno()).st_nlink == 0 or os.fstat(self.idx_f.fileno()).st_nlink == 0
+        except OSError:
+            return True
+
+    def close(self, fsync: bool) -> None:
+        try:
+            if fsync and self.dirty:
+                os.fsync(self.data_f.fileno())
+        finally:
+            self.data_f.close()
+            self.idx_f.close()
+
+class HistoryAppender:
+    def __init__(
+        self,
+        durability: str = HISTORY_DURABILITY,
+        group_commit_ms: float = HISTORY_GROUP_COMMIT_MS,
+        fsync_interval_ms: int = HISTORY_FSYNC_INTERVAL_MS,
+        max_open_files: int = HISTORY_MAX_OPEN_FILES,
+    ):
+        if durability not in DURABILITY_MODES:
+            logger.warning(f"Unknown HISTORY_DURABILITY '{durability}', using 'interval'")
+            durability = "interval"
+        self.durability = durability
+        self.group_commit = max(0.0, group_commit_ms) / 1000
+        self.fsync_interval = max(1, fsync_interval_ms) / 1000
+        self.max_open_files = max(1, max_open_files)
+
+        self._rooms: Dict[str, _Room] = {}
+        self._handles: "OrderedDict[str, _Handles]" = OrderedDict()
+        self._lock = threading.Lock()          # guard _rooms และ _handles
+        self._fsync_thread: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+
+        self.batches = 0
+        self.records = 0
+        self.bytes = 0
+        self.fsyncs = 0
+        self.errors = 0
+        self.evictions = 0
+        self._latency_ms: Deque[float] = deque(maxlen=1024)   # enqueue -> commit ต่อ append
+        self._write_ms: Deque[float] = deque(maxlen=1024)     # เวลา write (+fsync) ต่อ batch
+
+    # ---- Handles (LRU) ----
+    def _acquire(self, path: str) -> _Handles:
+        with self._lock:
+            h = self._handles.get(path)
+            if h is not None and h.unlinked():
+                self._handles.pop(path)
+                if not h.in_use:
+                    h.close(fsync=False)
+                h = None
+            if h is None:
+                h = self._handles[path] = _Handles(path)
+            self._handles.move_to_end(path)
+            h.in_use += 1
+            self._evict()
+            return h
+
+    def _release(self, h: _Handles) -> None:
+        with self._lock:
+            h.in_use -= 1
+            if not h.in_use and self._handles.get(h.path) is not h:
+                h.close(fsync=self.durability != "none")    # ถูก evict ระหว่างใช้งาน
+
+    def _evict(self) -> None:
+        if len(self._handles) <= self.max_open_files:
+            return
+        for path in list(self._handles):
+            if len(self._handles) <= self.max_open_files:
+                break
+            h = self._handles[path]
+            if h.in_use:
+                continue
+            self._handles.pop(path)
+            self.evictions += 1
+            try:
+                h.close(fsync=self.durability != "none")
+            except Exception as e:
+                logger.error(f"Failed to close history file '{path}': {e}")
+
+    # ---- Group commit ----
+    def append(self, path: str, recs: List[dict]) -> None:
+        """เขียน records ต่อท้ายไฟล์ของห้อง (block จนกว่า batch ที่รวม records นี้จะ commit)"""
+        if not recs:
+            return
+        if self.durability == "interval":
+            self._ensure_fsync_thread()
+        with self._lock:
+            room = self._rooms.setdefault(path, _Room())
+        ticket = _Ticket(recs)
+        with room.cond:
+            room.pending.append(ticket)
+            if room.leader:
+                while not ticket.done:
+                    room.cond.wait()
+                if ticket.error is not None:
+                    raise ticket.error
+                return
+            room.leader = True
+
+        # เป็น leader: รอรวม batch สั้นๆ แล้วเขียนจนกว่าคิวจะว่าง
+        try:
+            if self.group_commit:
+                time.sleep(self.group_commit)
+            while True:
+                with room.cond:
+                    batch, room.pending = room.pending, []
+                    if not batch:
+                        room.leader = False
+                        break
+                self._commit(path, batch)
+                with room.cond:
+                    room.cond.notify_all()
+        except BaseException:
+            with room.cond:
+                room.leader = False
+                room.cond.notify_all()
+            raise
+        if ticket.error is not None:
+            raise ticket.error
+
+    def _commit(self, path: str, batch: List[_Ticket]) -> None:
+        recs = [r for t in batch for r in t.recs]
+        t0 = time.perf_counter()
+        error: Optional[BaseException] = None
+        try:
+            h = self._acquire(path)
+            try:
+                with locked(path, h.data_f):
+                    n = append_locked(h.data_f, h.idx_f, recs)
+                    if self.durability == "batch":
+                        os.fsync(h.data_f.fileno())
+                        self.fsyncs += 1
+                    else:
+                        h.dirty = True
+            finally:
+                self._release(h)
+            self.batches += 1
+            self.records += len(recs)
+            self.bytes += n
+        except Exception as e:
+            self.errors += 1
+            error = e
+            logger.error(f"Failed to append history to '{path}': {e}")
+        now = time.perf_counter()
+        self._write_ms.append(1000 * (now - t0))
+        for t in batch:
+            self._latency_ms.append(1000 * (now - t.t0))
+            t.error = error
+            t.done = True
+
+    # ---- fsync-interval ----
+    def _ensure_fsync_thread(self) -> None:
+        if self._fsync_thread is not None and self._fsync_thread.is_alive():
+            return
+        with self._lock:
+            if self._fsync_thread is None or not self._fsync_thread.is_alive():
+                self._closed.clear()
+                self._fsync_thread = threading.Thread(target=self._fsync_loop, name="history-fsync", daemon=True)
+                self._fsync_thread.start()
+
+    def _fsync_loop(self) -> None:
+        while not self._closed.wait(self.fsync_interval):
+            self.sync()
+
+    def sync(self) -> None:
+        """fsync ทุกไฟล์ที่มีข้อมูลค้าง"""
+        with self._lock:
+            dirty = [h for h in self._handles.values() if h.dirty]
+            for h in dirty:
+                h.in_use += 1
+        for h in dirty:
+            try:
+                h.dirty = False
+                os.fsync(h.data_f.fileno())
+                self.fsyncs += 1
+            except Exception as e:
+                logger.error(f"fsync failed for '{h.path}': {e}")
+            finally:
+                self._release(h)
+
+    def close(self) -> None:
+        """fsync และปิดทุก handle (เรียกตอน shutdown)"""
+        self._closed.set()
+        with self._lock:
+            handles, self._handles = list(self._handles.values()), OrderedDict()
+        for h in handles:
+            try:
+                h.close(fsync=self.durability != "none")
+            except Exception as e:
+                logger.error(f"Failed to close history file '{h.path}': {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        def pct(samples, q):
+            if not samples:
+                return 0.0
+            s = sorted(samples)
+            return round(s[min(len(s) - 1, int(q * len(s)))], 3)
+
+        lat, wr = list(self._latency_ms), list(self._write_ms)
+        return {
+            "durability": self.durability,
+            "group_commit_ms": round(1000 * self.group_commit, 3),
+            "open_files": len(self._handles),
+            "evictions": self.evictions,
+            "batches": self.batches,
+            "records": self.records,
+            "bytes": self.bytes,
+            "avg_batch_size": round(self.records / self.batches, 2) if self.batches else 0.0,
+            "fsyncs": self.fsyncs,
+            "errors": self.errors,
+            "append_latency_ms": {"p50": pct(lat, 0.5), "p95": pct(lat, 0.95), "p99": pct(lat, 0.99), "max": round(max(lat), 3) if lat else 0.0},
+            "write_ms": {"p50": pct(wr, 0.5), "p95": pct(wr, 0.95), "max": round(max(wr), 3) if wr else 0.0},
+        }
+
+history_appender = HistoryAppender()
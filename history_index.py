@@ -0,0 +1,327 @@
+# history_index.py
+"""
+Sidecar offset index สำหรับไฟล์ประวัติ chat.jsonl
+
+ไฟล์ <chat.jsonl>.idx เก็บ (ts, byte offset) ของทุกบรรทัดตามลำดับในไฟล์
+ทำให้อ่านหน้าประวัติย้อนหลังได้โดยอ่านเฉพาะบรรทัดที่ต้องใช้ (O(limit)) แทนการอ่านทั้งไฟล์
+
+รูปแบบไฟล์ .idx:
+    header  : magic(8) | flags(int64) | covered_end(int64)
+    entries : ts(int64) | offset(int64) | crc32(ts, offset)  ต่อหนึ่งบรรทัด
+
+- covered_end คือ byte offset ใน chat.jsonl ที่ index ครอบคลุมถึง ถ้าไฟล์ยาวกว่านั้น
+  (เช่นมีคนเขียนต่อท้ายโดยไม่ผ่าน index) จะ index ส่วนที่เหลือให้อัตโนมัติ
+- flags บิต FLAG_UNORDERED ถูกตั้งเมื่อมีบรรทัดที่ ts น้อยกว่าบรรทัดก่อนหน้า
+  ในกรณีนั้นจะเรียงจาก index ทั้งก้อน (ยังถูกกว่าการ parse JSON ทั้งไฟล์มาก)
+- ถ้า index หายหรือเสีย จะสร้างใหม่จาก chat.jsonl
+"""
+import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IDX_SUFFIX = ".idx"
+MAGIC = b"PAIHIX01"
+HEADER = struct.Struct("<8sqq")
+ENTRY = struct.Struct("<qqI")
+_TS_OFF = struct.Struct("<qq")
+FLAG_UNORDERED = 1
+
+try:
+    import fcntl
+except ImportError:   # Windows: lock ได้เฉพาะภายใน process
+    fcntl = None
+
+_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+def _lock_for(path: str) -> threading.Lock:
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock = _locks[path] = threading.Lock()
+        return lock
+
+@contextmanager
+def locked(path: str, data_f) -> Iterator[None]:
+    """exclusive lock ของไฟล์ประวัติ ทั้งระหว่าง thread และระหว่าง worker process (flock บน data file)"""
+    with _lock_for(path):
+        if fcntl is not None:
+            fcntl.flock(data_f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(data_f.fileno(), fcntl.LOCK_UN)
+
+def index_path(path: str) -> str:
+    return path + IDX_SUFFIX
+
+class _StaleIndex(Exception):
+    """index ไม่ตรงกับไฟล์จริง ต้องสร้างใหม่"""
+
+def _pack_entry(ts: int, offset: int) -> bytes:
+    return ENTRY.pack(ts, offset, zlib.crc32(_TS_OFF.pack(ts, offset)))
+
+def _unpack_entry(buf, pos: int) -> Tuple[int, int]:
+    ts, offset, crc = ENTRY.unpack_from(buf, pos)
+    if zlib.crc32(_TS_OFF.pack(ts, offset)) != crc:
+        raise _StaleIndex()
+    return ts, offset
+
+def _line_ts(line: bytes) -> Optional[int]:
+    """ts ของบรรทัด หรือ None ถ้าไม่ใช่ JSON object ที่อ่านได้ (บรรทัดแบบนี้ไม่ถูก index)"""
+    try:
+        rec = json.loads(line)
+    except Exception:
+        return None
+    if not isinstance(rec, dict):
+        return None
+    try:
+        return int(rec.get("ts", 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+class _Header:
+    def __init__(self, flags: int = 0, covered_end: int = 0, count: int = 0, last_ts: Optional[int] = None):
+        self.flags = flags
+        self.covered_end = covered_end
+        self.count = count
+        self.last_ts = last_ts
+
+def _write_header(f, hdr: _Header) -> None:
+    f.seek(0)
+    f.write(HEADER.pack(MAGIC, hdr.flags, hdr.covered_end))
+
+def _load_header(idx_f, data_size: int, data_f=None) -> Optional[_Header]:
+    """อ่านและตรวจ header; คืน None ถ้า index เสีย"""
+    idx_f.seek(0, os.SEEK_END)
+    size = idx_f.tell()
+    if size < HEADER.size or (size - HEADER.size) % ENTRY.size:
+        return None
+    idx_f.seek(0)
+    magic, flags, covered_end = HEADER.unpack(idx_f.read(HEADER.size))
+    if magic != MAGIC or covered_end > data_size or covered_end < 0:
+        return None
+    count = (size - HEADER.size) // ENTRY.size
+    last_ts = None
+    if count:
+        idx_f.seek(HEADER.size + (count - 1) * ENTRY.size)
+        try:
+            last_ts, last_off = _unpack_entry(idx_f.read(ENTRY.size), 0)
+        except _StaleIndex:
+            return None
+        if last_off >= covered_end:
+            return None
+        if data_f is not None:
+            # ตรวจว่า entry สุดท้ายชี้ไปที่บรรทัดจริง
+            data_f.seek(last_off)
+            if _line_ts(data_f.readline()) != last_ts:
+                return None
+    return _Header(flags, covered_end, count, last_ts)
+
+def _catch_up(idx_f, data_f, hdr: _Header) -> None:
+    """index บรรทัดที่อยู่หลัง covered_end (เฉพาะบรรทัดที่เขียนเสร็จแล้ว)"""
+    data_f.seek(hdr.covered_end)
+    offset = hdr.covered_end
+    entries = []
+    for line in data_f:
+        if not line.endswith(b"\n"):
+            break   # บรรทัดสุดท้ายยังเขียนไม่เสร็จ
+        ts = _line_ts(line)
+        if ts is not None:
+            if hdr.last_ts is not None and ts < hdr.last_ts:
+                hdr.flags |= FLAG_UNORDERED
+            hdr.last_ts = ts
+            entries.append(_pack_entry(ts, offset))
+        offset += len(line)
+    if offset == hdr.covered_end:
+        return
+    idx_f.seek(0, os.SEEK_END)
+    idx_f.write(b"".join(entries))
+    hdr.count += len(entries)
+    hdr.covered_end = offset
+    _write_header(idx_f, hdr)
+
+def open_index(path: str):
+    """เปิดไฟล์ .idx แบบอ่าน/เขียน (สร้างใหม่ถ้ายังไม่มี)"""
+    fd = os.open(index_path(path), os.O_RDWR | os.O_CREAT, 0o644)
+    return os.fdopen(fd, "r+b")
+
+def sync_index(idx_f, data_f, validate: bool, rebuild: bool = False) -> _Header:
+    """ให้แน่ใจว่า index ครอบคลุมทั้งไฟล์ (ต้องถือ locked() อยู่)
+
+    data_f ต้องเปิดแบบอ่านได้ ("rb" หรือ "a+b")
+    """
+    data_size = os.fstat(data_f.fileno()).st_size
+    hdr = None if rebuild else _load_header(idx_f, data_size, data_f if validate else None)
+    if hdr is None:
+        if os.fstat(idx_f.fileno()).st_size:
+            logger.warning(f"Rebuilding history index for '{data_f.name}'")
+        idx_f.seek(0)
+        idx_f.truncate()
+        hdr = _Header()
+        _write_header(idx_f, hdr)
+    if hdr.covered_end < data_size:
+        _catch_up(idx_f, data_f, hdr)
+    return hdr
+
+# ---- Public API ----
+def append_locked(data_f, idx_f, recs: List[dict]) -> int:
+    """เขียน records ต่อท้าย chat.jsonl และ index ไปพร้อมกัน คืนจำนวน byte ที่เขียน
+
+    ผู้เรียกต้องถือ locked() อยู่ และเปิด data_f แบบ "a+b" ไว้
+    (ไม่ flush ลง disk เอง ผู้เรียกเลือกเองว่าจะ fsync หรือไม่)
+    """
+    hdr = sync_index(idx_f, data_f, validate=False)
+    offset = os.fstat(data_f.fileno()).st_size
+    head = b""
+    if offset > hdr.covered_end:
+        # บรรทัดท้ายไฟล์เขียนค้างไว้ไม่ครบ (เช่น process ตายกลางทาง) ปิดบรรทัดนั้นก่อน
+        head = b"\n"
+        offset += 1
+    lines = [(json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8") for rec in recs]
+    entries = []
+    for rec, line in zip(recs, lines):
+        ts = int(rec.get("ts", 0) or 0)
+        if hdr.last_ts is not None and ts < hdr.last_ts:
+            hdr.flags |= FLAG_UNORDERED
+        hdr.last_ts = ts
+        entries.append(_pack_entry(ts, offset))
+        offset += len(line)
+    data = head + b"".join(lines)
+    data_f.write(data)
+    data_f.flush()
+    idx_f.seek(0, os.SEEK_END)
+    idx_f.write(b"".join(entries))
+    hdr.count += len(entries)
+    hdr.covered_end = offset
+    _write_header(idx_f, hdr)
+    idx_f.flush()
+    return len(data)
+
+def _with_index(path: str, fn):
+    """เรียก fn(data_f, hdr, entry) ภายใต้ lock หลังจาก sync index แล้ว (สร้าง index ใหม่ถ้าเจอ entry เสีย)"""
+    with open(path, "rb") as data_f, open_index(path) as idx_f, locked(path, data_f):
+        hdr = sync_index(idx_f, data_f, validate=True)
+        try:
+            return _call(fn, data_f, idx_f, hdr)
+        except _StaleIndex:
+            # entry เสียหรือชี้ไม่ตรงบรรทัด (เช่นเสียกลางไฟล์ซึ่ง header ตรวจไม่เจอ)
+            hdr = sync_index(idx_f, data_f, validate=True, rebuild=True)
+            return _call(fn, data_f, idx_f, hdr)
+
+def _call(fn, data_f, idx_f, hdr: _Header):
+    idx_f.flush()
+    if hdr.count == 0:
+        return fn(data_f, hdr, None)
+    mm = mmap.mmap(idx_f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return fn(data_f, hdr, lambda i: _unpack_entry(mm, HEADER.size + i * ENTRY.size))
+    finally:
+        mm.close()
+
+def _bisect(entry, count: int, ts: int) -> int:
+    """ตำแหน่งแรกที่ ts ของ entry >= ts (ใช้ได้เมื่อ index เรียงตาม ts)"""
+    lo, hi = 0, count
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if entry(mid)[0] < ts:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+def _between(hdr: _Header, entry, since: Optional[int], until: Optional[int]) -> List[Tuple[int, int]]:
+    """entries ที่ since <= ts < until เรียงเก่า→ใหม่ (ts เท่ากันคงตามลำดับในไฟล์)"""
+    if entry is None:
+        return []
+    if hdr.flags & FLAG_UNORDERED:
+        found = [e for e in map(entry, range(hdr.count))
+                 if (since is None or e[0] >= since) and (until is None or e[0] < until)]
+        return sorted(found, key=lambda e: e[0])
+    lo = 0 if since is None else _bisect(entry, hdr.count, since)
+    hi = hdr.count if until is None else _bisect(entry, hdr.count, until)
+    return [entry(i) for i in range(lo, hi)]
+
+def _read_rows(data_f, picked: List[Tuple[int, int]]) -> List[dict]:
+    rows: List[dict] = []
+    for ts, off in picked:
+        data_f.seek(off)
+        line = data_f.readline()
+        if _line_ts(line) != ts:
+            raise _StaleIndex()
+        rows.append(json.loads(line))
+    return rows
+
+def read_page(path: str, limit: int, before: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+    """คืน (rows ใหม่→เก่า ที่ ts < before, next_before) แบบเดียวกับการเรียงทั้งไฟล์
+
+    ลำดับของ ts ที่เท่ากันคงตามลำดับในไฟล์ (stable sort) และ next_before คือ ts
+    ของแถวสุดท้ายเมื่อได้ครบ limit
+    """
+    if not os.path.exists(path):
+        return [], None
+    return _with_index(path, lambda data_f, hdr, entry: _read_page(data_f, hdr, entry, limit, before))
+
+def read_range(path: str, since: Optional[int] = None, until: Optional[int] = None, limit: Optional[int] = None) -> List[dict]:
+    """rows ที่ since <= ts < until เรียงเก่า→ใหม่ สูงสุด limit แถว"""
+    if not os.path.exists(path):
+        return []
+    def fn(data_f, hdr, entry):
+        picked = _between(hdr, entry, since, until)
+        return _read_rows(data_f, picked[:limit] if limit else picked)
+    return _with_index(path, fn)
+
+def count_range(path: str, since: Optional[int] = None, until: Optional[int] = None) -> int:
+    if not os.path.exists(path):
+        return 0
+    def fn(data_f, hdr, entry):
+        if since is None and until is None:
+            return hdr.count
+        if entry is None:
+            return 0
+        if hdr.flags & FLAG_UNORDERED:
+            return len(_between(hdr, entry, since, until))
+        lo = 0 if since is None else _bisect(entry, hdr.count, since)
+        hi = hdr.count if until is None else _bisect(entry, hdr.count, until)
+        return max(0, hi - lo)
+    return _with_index(path, fn)
+
+def summary(path: str) -> Tuple[int, Optional[int]]:
+    """(จำนวนข้อความ, ts ล่าสุด) ของไฟล์"""
+    if not os.path.exists(path):
+        return 0, None
+    def fn(data_f, hdr, entry):
+        if entry is None:
+            return 0, None
+        if hdr.flags & FLAG_UNORDERED:
+            return hdr.count, max(entry(i)[0] for i in range(hdr.count))
+        return hdr.count, hdr.last_ts
+    return _with_index(path, fn)
+
+def _read_page(data_f, hdr: _Header, entry, limit: int, before: Optional[int]) -> Tuple[List[dict], Optional[int]]:
+    if entry is None:
+        return [], None
+    if hdr.flags & FLAG_UNORDERED:
+        window = _between(hdr, entry, None, before)
+    else:
+        hi = hdr.count if before is None else _bisect(entry, hdr.count, before)
+        lo = max(0, hi - limit)
+        # ดึง ts ที่เท่ากันตรงขอบหน้ามาให้ครบ เพื่อให้ลำดับตรงกับ stable sort
+        if 0 < lo < hi:
+            edge = entry(lo)[0]
+            while lo > 0 and entry(lo - 1)[0] == edge:
+                lo -= 1
+        window = [entry(i) for i in range(lo, hi)]
+
+    picked = sorted(window, key=lambda e: e[0], reverse=True)[:limit]
+    next_before = picked[-1][0] if len(picked) == limit else None
+    return _read_rows(data_f, picked), next_before
@@ -0,0 +1,273 @@
+# history_store.py
+"""
+ที่เก็บประวัติแชทแบบเลือก backend ได้ (HISTORY_BACKEND)
+
+    jsonl   ไฟล์ ~/private-ai/projects/<project>/rooms/<room>/history/chat.jsonl ต่อห้อง (default)
+    sqlite  ฐานข้อมูล SQLite (WAL) ไฟล์เดียวสำหรับทุกห้อง (HISTORY_DB_PATH)
+            มี index (project_id, room_id, ts) จึงอ่านหน้า/ช่วงเวลา/นับจำนวน และดูหลายห้องได้
+            โดยไม่ต้องสแกนไฟล์ ย้ายข้อมูลเดิมด้วย migrate_history.py
+
+ทุก backend คืนข้อความเป็น dict ตาม field ของ history_api.Msg และเรียงแบบเดียวกัน
+(ใหม่→เก่าตาม ts, ts เท่ากันเรียงตามลำดับที่เขียน)
+"""
+import os
+import json
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool
+
+from history_appender import HISTORY_DURABILITY, history_appender
+from history_index import count_range, read_page, read_range, summary
+
+logger = logging.getLogger(__name__)
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", "jsonl").lower()
+HISTORY_DB_PATH = os.path.expanduser(os.getenv("HISTORY_DB_PATH", "~/private-ai/history.db"))
+HISTORY_DB_POOL_SIZE = int(os.getenv("HISTORY_DB_POOL_SIZE", "8"))
+
+BASE_DIR = os.path.expanduser("~/private-ai/projects")
+HIST_NAME = "chat.jsonl"   # เก็บแบบ JSONL ต่อบรรทัด
+
+_known_dirs: set[str] = set()   # โฟลเดอร์ที่สร้างแล้ว ไม่ต้องเรียก makedirs ซ้ำทุกครั้ง
+
+def room_hist_path(project_id: str, room_id: str) -> str:
+    hist_dir = os.path.join(BASE_DIR, project_id, "rooms", room_id, "history")
+    if hist_dir not in _known_dirs:
+        os.makedirs(hist_dir, exist_ok=True)
+        _known_dirs.add(hist_dir)
+    return os.path.join(hist_dir, HIST_NAME)
+
+class HistoryStore(ABC):
+    """interface ของที่เก็บประวัติ (backend ที่ขาด method ใดสร้างไม่ได้)"""
+    backend = "base"
+
+    @abstractmethod
+    def location(self, project_id: str, room_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def append(self, project_id: str, room_id: str, recs: List[dict]) -> str:
+        """เขียนหลายข้อความของห้องเดียวกันในครั้งเดียว คืน location"""
+
+    @abstractmethod
+    def read_page(self, project_id: str, room_id: str, limit: int, before: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """(ข้อความใหม่→เก่าที่ ts < before สูงสุด limit, next_before)"""
+
+    @abstractmethod
+    def read_range(self, project_id: str, room_id: str, since: Optional[int] = None, until: Optional[int] = None, limit: Optional[int] = None) -> List[dict]:
+        """ข้อความที่ since <= ts < until เรียงเก่า→ใหม่"""
+
+    @abstractmethod
+    def count(self, project_id: str, room_id: str, since: Optional[int] = None, until: Optional[int] = None) -> int:
+        ...
+
+    @abstractmethod
+    def list_rooms(self, project_id: str) -> List[Dict[str, Any]]:
+        """[{room_id, count, last_ts}] ของทุกห้องใน project เรียงตาม last_ts ล่าสุดก่อน"""
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend}
+
+# ---- JSONL ----
+class JsonlHistoryStore(HistoryStore):
+    backend = "jsonl"
+
+    def location(self, project_id: str, room_id: str) -> str:
+        return room_hist_path(project_id, room_id)
+
+    def append(self, project_id: str, room_id: str, recs: List[dict]) -> str:
+        path = room_hist_path(project_id, room_id)
+        history_appender.append(path, recs)   # group commit + offset index (chat.jsonl.idx)
+        return path
+
+    def read_page(self, project_id, room_id, limit, before=None):
+        return read_page(room_hist_path(project_id, room_id), limit, before)
+
+    def read_range(self, project_id, room_id, since=None, until=None, limit=None):
+        return read_range(room_hist_path(project_id, room_id), since, until, limit)
+
+    def count(self, project_id, room_id, since=None, until=None):
+        return count_range(room_hist_path(project_id, room_id), since, until)
+
+    def list_rooms(self, project_id):
+        rooms_dir = os.path.join(BASE_DIR, project_id, "rooms")
+        out = []
+        if not os.path.isdir(rooms_dir):
+            return out
+        for room_id in os.listdir(rooms_dir):
+            path = os.path.join(rooms_dir, room_id, "history", HIST_NAME)
+            if not os.path.exists(path):
+                continue
+            n, last_ts = summary(path)
+            out.append({"room_id": room_id, "count": n, "last_ts": last_ts})
+        out.sort(key=lambda r: r["last_ts"] or 0, reverse=True)
+        return out
+
+    def close(self):
+        history_appender.close()
+
+# ---- SQLite (WAL) ----
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id TEXT NOT NULL,
+        room_id TEXT NOT NULL,
+        ts INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        username TEXT,
+        attachments TEXT,
+        meta TEXT
+    )""",
+    # ts DESC, id ASC ตรงกับลำดับที่ read_page ต้องการ จึงอ่านตาม index ได้โดยไม่ต้อง sort
+    "CREATE INDEX IF NOT EXISTS ix_messages_room_ts ON messages (project_id, room_id, ts DESC, id)",
+)
+
+_SYNCHRONOUS = {"none": "OFF", "interval": "NORMAL", "batch": "FULL"}
+
+# statement ถูกสร้างครั้งเดียว sqlite3 จะ cache prepared statement ต่อ connection ให้
+INSERT_MESSAGE = text(
+    "INSERT INTO messages (project_id, room_id, ts, role, content, username, attachments, meta) "
+    "VALUES (:project_id, :room_id, :ts, :role, :content, :username, :attachments, :meta)"
+)
+_PAGE = text(
+    "SELECT ts, role, content, username, attachments, meta FROM messages "
+    "WHERE project_id = :project_id AND room_id = :room_id AND ts < :before "
+    "ORDER BY ts DESC, id ASC LIMIT :limit"
+)
+_RANGE = text(
+    "SELECT ts, role, content, username, attachments, meta FROM messages "
+    "WHERE project_id = :project_id AND room_id = :room_id AND ts >= :since AND ts < :until "
+    "ORDER BY ts ASC, id ASC LIMIT :limit"
+)
+_COUNT = text(
+    "SELECT COUNT(*) FROM messages "
+    "WHERE project_id = :project_id AND room_id = :room_id AND ts >= :since AND ts < :until"
+)
+_ROOMS = text(
+    "SELECT room_id, COUNT(*) AS n, MAX(ts) AS last_ts FROM messages "
+    "WHERE project_id = :project_id GROUP BY room_id ORDER BY last_ts DESC"
+)
+
+_TS_MIN, _TS_MAX = -(2 ** 63), 2 ** 63 - 1
+
+def _row_to_msg(row) -> dict:
+    ts, role, content, username, attachments, meta = row
+    return {
+        "role": role,
+        "content": content,
+        "ts": ts,
+        "username": username,
+        "attachments": json.loads(attachments) if attachments else None,
+        "meta": json.loads(meta) if meta else None,
+    }
+
+def msg_params(project_id: str, room_id: str, rec: dict) -> dict:
+    attachments, meta = rec.get("attachments"), rec.get("meta")
+    return {
+        "project_id": project_id,
+        "room_id": room_id,
+        "ts": int(rec.get("ts", 0) or 0),
+        "role": rec.get("role") or "",
+        "content": rec.get("content") or "",
+        "username": rec.get("username"),
+        "attachments": json.dumps(attachments, ensure_ascii=False) if attachments is not None else None,
+        "meta": json.dumps(meta, ensure_ascii=False) if meta is not None else None,
+    }
+
+class SqliteHistoryStore(HistoryStore):
+    backend = "sqlite"
+
+    def __init__(self, db_path: str = HISTORY_DB_PATH, pool_size: int = HISTORY_DB_POOL_SIZE, durability: str = HISTORY_DURABILITY):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.engine = create_engine(
+            f"sqlite:///{db_path}",
+            poolclass=QueuePool,
+            pool_size=pool_size,
+            max_overflow=pool_size,
+            connect_args={"check_same_thread": False, "timeout": 30},
+        )
+        synchronous = _SYNCHRONOUS.get(durability, "NORMAL")
+
+        @event.listens_for(self.engine, "connect")
+        def _on_connect(dbapi_conn, _):
+            cur = dbapi_conn.cursor()
+            cur.execute("PRAGMA journal_mode=WAL")
+            cur.execute(f"PRAGMA synchronous={synchronous}")
+            cur.execute("PRAGMA busy_timeout=30000")
+            cur.close()
+
+        with self.engine.begin() as conn:
+            for stmt in _SCHEMA:
+                conn.exec_driver_sql(stmt)
+
+    def location(self, project_id, room_id):
+        return self.db_path
+
+    def append(self, project_id, room_id, recs):
+        if recs:
+            with self.engine.begin() as conn:
+                conn.execute(INSERT_MESSAGE, [msg_params(project_id, room_id, r) for r in recs])
+        return self.db_path
+
+    def read_page(self, project_id, room_id, limit, before=None):
+        with self.engine.connect() as conn:
+            rows = conn.execute(_PAGE, {
+                "project_id": project_id, "room_id": room_id,
+                "before": _TS_MAX if before is None else before, "limit": limit,
+            }).fetchall()
+        picked = [_row_to_msg(r) for r in rows]
+        next_before = picked[-1]["ts"] if len(picked) == limit else None
+        return picked, next_before
+
+    def read_range(self, project_id, room_id, since=None, until=None, limit=None):
+        with self.engine.connect() as conn:
+            rows = conn.execute(_RANGE, {
+                "project_id": project_id, "room_id": room_id,
+                "since": _TS_MIN if since is None else since,
+                "until": _TS_MAX if until is None else until,
+                "limit": -1 if not limit else limit,
+            }).fetchall()
+        return [_row_to_msg(r) for r in rows]
+
+    def count(self, project_id, room_id, since=None, until=None):
+        with self.engine.connect() as conn:
+            return conn.execute(_COUNT, {
+                "project_id": project_id, "room_id": room_id,
+                "since": _TS_MIN if since is None else since,
+                "until": _TS_MAX if until is None else until,
+            }).scalar() or 0
+
+    def list_rooms(self, project_id):
+        with self.engine.connect() as conn:
+            rows = conn.execute(_ROOMS, {"project_id": project_id}).fetchall()
+        return [{"room_id": r[0], "count": r[1], "last_ts": r[2]} for r in rows]
+
+    def close(self):
+        self.engine.dispose()
+
+    def stats(self):
+        pool = self.engine.pool
+        return {
+            "backend": self.backend,
+            "db_path": self.db_path,
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
+def build_store(backend: str = HISTORY_BACKEND) -> HistoryStore:
+    if backend == "sqlite":
+        return SqliteHistoryStore()
+    if backend != "jsonl":
+        logger.warning(f"Unknown HISTORY_BACKEND '{backend}', using 'jsonl'")
+    return JsonlHistoryStore()
+
+history_store = build_store()
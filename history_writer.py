@@ -0,0 +1,108 @@
+# history_writer.py
+"""
+บันทึกประวัติแชทแบบ in-process แทนการยิง HTTP กลับเข้า /rooms/{room_id}/messages ของตัวเอง
+
+ผู้เรียก (WebSocket, /chat/generate) แค่ใส่ข้อความลงคิวแล้วไปต่อได้ทันที
+background task จะดึงข้อความจากคิวเป็นก้อน จัดกลุ่มตามห้อง แล้วเขียนลงไฟล์ใน threadpool
+จึงไม่มีการ broadcast ไหนต้องรอ disk
+"""
+import os
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from history_api import Msg, append_records
+
+logger = logging.getLogger(__name__)
+
+HISTORY_QUEUE_MAX = int(os.getenv("HISTORY_QUEUE_MAX", "10000"))
+HISTORY_DRAIN_MAX = int(os.getenv("HISTORY_DRAIN_MAX", "256"))   # จำนวนข้อความสูงสุดต่อรอบการเขียน
+
+class HistoryWriter:
+    def __init__(self, max_queue: int = HISTORY_QUEUE_MAX):
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+
+    async def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """รอให้เขียนข้อความที่ค้างในคิวจนหมดแล้วค่อยหยุด"""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        try:
+            await self._task
+        finally:
+            self._task = None
+
+    def log(
+        self,
+        project_id: str,
+        room_id: str,
+        role: str,
+        content: str,
+        username: Optional[str] = None,
+        meta: Optional[dict] = None,
+    ) -> None:
+        """ใส่ข้อความลงคิวโดยไม่ block (timestamp ถูกกำหนด ณ ตอนเรียก)"""
+        rec = Msg(role=role, content=content, username=username, meta=meta).dict()
+        if self._task is None or self._task.done():
+            # ยังไม่ได้ start (เช่นถูกเรียกนอก lifespan) ให้เริ่ม worker บน loop ปัจจุบัน
+            self._queue = asyncio.Queue(self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        try:
+            self._queue.put_nowait((project_id, room_id, rec))
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(f"History queue full, dropped message for room '{project_id}:{room_id}'")
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            items: List[Tuple[str, str, dict]] = []
+            if item is None:
+                stopping = True
+            else:
+                items.append(item)
+            while len(items) < HISTORY_DRAIN_MAX and not self._queue.empty():
+                nxt = self._queue.get_nowait()
+                if nxt is None:
+                    stopping = True
+                    continue
+                items.append(nxt)
+            if items:
+                await self._write(items)
+
+    async def _write(self, items: List[Tuple[str, str, dict]]) -> None:
+        by_room: Dict[Tuple[str, str], List[dict]] = defaultdict(list)
+        for project_id, room_id, rec in items:
+            by_room[(project_id, room_id)].append(rec)
+        for (project_id, room_id), recs in by_room.items():
+            try:
+                await asyncio.to_thread(append_records, project_id, room_id, recs)
+                self.written += len(recs)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Failed to write history for room '{project_id}:{room_id}': {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+history_writer = HistoryWriter()
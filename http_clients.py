@@ -0,0 +1,216 @@
+# http_clients.py
+"""
+Process-wide pooled httpx clients, one pool per upstream service.
+
+แต่ละ upstream (Ollama, Qdrant และ OpenAI) มี connection pool,
+keep-alive, timeout และตัวเลือก HTTP/2 ของตัวเอง ปรับได้ผ่าน environment:
+
+    HTTP_<NAME>_MAX_CONNECTIONS   จำนวน connection สูงสุดใน pool
+    HTTP_<NAME>_MAX_KEEPALIVE     จำนวน idle connection ที่เก็บไว้ใช้ซ้ำ
+    HTTP_<NAME>_KEEPALIVE_EXPIRY  วินาทีที่ idle connection จะถูกปิด
+    HTTP_<NAME>_TIMEOUT           read/write/pool timeout (วินาที)
+    HTTP_<NAME>_CONNECT_TIMEOUT   connect timeout (วินาที)
+    HTTP_<NAME>_HTTP2             "1" เพื่อเปิด HTTP/2 (ต้องติดตั้ง h2)
+
+โดย <NAME> คือ OLLAMA, QDRANT หรือ OPENAI
+"""
+import os
+import time
+import logging
+import importlib.util
+from typing import Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ---- Defaults per upstream ----
+DEFAULTS: Dict[str, dict] = {
+    "ollama":  {"max_connections": 32, "max_keepalive": 16, "keepalive_expiry": 60.0, "timeout": 120.0, "connect_timeout": 5.0},
+    "qdrant":  {"max_connections": 64, "max_keepalive": 32, "keepalive_expiry": 60.0, "timeout": 60.0,  "connect_timeout": 5.0},
+    "openai":  {"max_connections": 16, "max_keepalive": 8,  "keepalive_expiry": 30.0, "timeout": 120.0, "connect_timeout": 10.0},
+}
+
+def _env(name: str, key: str, default):
+    raw = os.getenv(f"HTTP_{name.upper()}_{key.upper()}")
+    if raw is None or raw == "":
+        return default
+    if isinstance(default, bool):
+        return raw.lower() in ("1", "true", "yes", "on")
+    return type(default)(raw)
+
+class UpstreamConfig:
+    def __init__(self, name: str):
+        d = DEFAULTS.get(name, DEFAULTS["qdrant"])
+        self.name = name
+        self.max_connections: int = _env(name, "max_connections", d["max_connections"])
+        self.max_keepalive: int = _env(name, "max_keepalive", d["max_keepalive"])
+        self.keepalive_expiry: float = _env(name, "keepalive_expiry", d["keepalive_expiry"])
+        self.timeout: float = _env(name, "timeout", d["timeout"])
+        self.connect_timeout: float = _env(name, "connect_timeout", d["connect_timeout"])
+        self.http2: bool = _env(name, "http2", False)
+
+# ---- Pool instrumentation ----
+class _ReleasingStream(httpx.AsyncByteStream):
+    """ห่อ response stream เพื่อให้รู้ว่า request จบจริงเมื่อไหร่ (รวมกรณี streaming)"""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
+
+class _PoolStatsTransport(httpx.AsyncBaseTransport):
+    """Transport ที่นับ request ที่กำลังทำงานอยู่ เพื่อดูว่า pool อิ่มตัวหรือยัง"""
+
+    def __init__(self, inner: httpx.AsyncHTTPTransport, max_connections: int):
+        self._inner = inner
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.saturated = 0          # request ที่เข้ามาตอน pool เต็ม (ต้องรอ connection)
+        self.wait_seconds = 0.0     # เวลารวมจนได้ response headers
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.in_flight >= self.max_connections:
+            self.saturated += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        t0 = time.perf_counter()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except BaseException:
+            self.errors += 1
+            self._release()
+            raise
+        self.wait_seconds += time.perf_counter() - t0
+
+        released = False
+        def on_close():
+            nonlocal released
+            if not released:
+                released = True
+                self._release()
+        response.stream = _ReleasingStream(response.stream, on_close)
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+    def connection_counts(self) -> Dict[str, int]:
+        # httpcore ไม่มี public API สำหรับสถานะ pool จึงอ่านแบบ best-effort
+        pool = getattr(self._inner, "_pool", None)
+        conns = list(getattr(pool, "connections", []) or [])
+        idle = 0
+        for c in conns:
+            try:
+                idle += 1 if c.is_idle() else 0
+            except Exception:
+                continue
+        return {"open_connections": len(conns), "idle_connections": idle}
+
+# ---- Registry ----
+class HttpClients:
+    """Registry ของ httpx.AsyncClient ต่อ upstream ที่อยู่ตลอดอายุของแอป"""
+
+    def __init__(self, names=("ollama", "qdrant", "openai")):
+        self.configs: Dict[str, UpstreamConfig] = {n: UpstreamConfig(n) for n in names}
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, _PoolStatsTransport] = {}
+
+    def _build(self, cfg: UpstreamConfig) -> httpx.AsyncClient:
+        http2 = cfg.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning(f"HTTP/2 requested for '{cfg.name}' but package 'h2' is not installed; using HTTP/1.1")
+            http2 = False
+        limits = httpx.Limits(
+            max_connections=cfg.max_connections,
+            max_keepalive_connections=cfg.max_keepalive,
+            keepalive_expiry=cfg.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(cfg.timeout, connect=cfg.connect_timeout)
+        transport = _PoolStatsTransport(
+            httpx.AsyncHTTPTransport(limits=limits, http2=http2),
+            cfg.max_connections,
+        )
+        self._transports[cfg.name] = transport
+        logger.info(f"HTTP pool '{cfg.name}': max_connections={cfg.max_connections} keepalive={cfg.max_keepalive} timeout={cfg.timeout}s http2={http2}")
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    async def start(self) -> None:
+        for name in self.configs:
+            self.get(name)
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        for name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Error closing HTTP pool '{name}': {e}")
+        self._transports = {}
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            cfg = self.configs.get(name)
+            if cfg is None:
+                cfg = self.configs[name] = UpstreamConfig(name)
+            client = self._clients[name] = self._build(cfg)
+        return client
+
+    @property
+    def ollama(self) -> httpx.AsyncClient:
+        return self.get("ollama")
+
+    @property
+    def qdrant(self) -> httpx.AsyncClient:
+        return self.get("qdrant")
+
+    @property
+    def openai(self) -> httpx.AsyncClient:
+        return self.get("openai")
+
+    def stats(self) -> Dict[str, dict]:
+        out: Dict[str, dict] = {}
+        for name, cfg in self.configs.items():
+            t: Optional[_PoolStatsTransport] = self._transports.get(name)
+            entry = {
+                "max_connections": cfg.max_connections,
+                "max_keepalive": cfg.max_keepalive,
+                "http2": cfg.http2,
+                "started": t is not None,
+            }
+            if t is not None:
+                entry.update({
+                    "in_flight": t.in_flight,
+                    "peak_in_flight": t.peak_in_flight,
+                    "requests": t.requests,
+                    "errors": t.errors,
+                    "saturated_requests": t.saturated,
+                    "avg_response_wait_ms": round(1000 * t.wait_seconds / t.requests, 2) if t.requests else 0.0,
+                    "utilization": round(t.in_flight / cfg.max_connections, 3) if cfg.max_connections else 0.0,
+                    **t.connection_counts(),
+                })
+            out[name] = entry
+        return out
+
+pools = HttpClients()
+
+def get_clients() -> HttpClients:
+    """FastAPI dependency: คืน registry ของ HTTP pools ที่ใช้ร่วมกันทั้ง process"""
+    return pools
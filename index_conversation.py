@@ -2,10 +2,16 @@
 # -*- coding: utf-8 -*-
 
 """
-Index conversation history from chat.jsonl files into Qdrant.
+Index conversation history from chat.jsonl files into the vector store.
 - Collection: conversation_rag
-- Embeddings: Ollama bge-m3 (1024 dims)
-- Vector DB: Qdrant (Cosine)
+- Embeddings: Ollama bge-m3 (1024 dims), deduplicated through embedding_store.py
+- Vector DB: vector_store.py (Qdrant REST or the embedded NumPy/mmap backend, Cosine)
+- Layout: <HISTORY_DIR>/<project>/rooms/<room>/history/chat.jsonl (as written by history_api),
+  the legacy <project>/<room>/chat.jsonl layout is still read
+- Incremental: a byte-offset checkpoint per file (~/private-ai/index) so each run only embeds
+  messages appended since the last run. A truncated or rewritten file is read again from the start.
+- Point IDs are uuid5(project/room, ts, content hash) so re-runs never duplicate points.
+  Use --full to drop the collection and re-index every file.
 """
 
 import os
@@ -14,149 +20,278 @@ import uuid
 import json
 import glob
 import time
-import urllib.request
-import urllib.error
-from typing import Iterator, List, Dict
+import hashlib
+import argparse
+import asyncio
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import httpx
+
+from embedding_store import embedding_store
+from vector_store import VectorStore, open_store, store_location, vector_store
 
 # ====== CONFIG ======
-HISTORY_DIR = os.path.abspath(os.getenv("HISTORY_DIR", "./chat_history"))
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
+HISTORY_DIR = os.path.abspath(os.path.expanduser(os.getenv("HISTORY_DIR", "~/private-ai/projects")))
+EMBED_MODEL = "bge-m3"
 COLLECTION = os.getenv("QDRANT_CONVERSATION_COLLECTION", "conversation_rag")
+VECTOR_SIZE = 1024   # bge-m3
+HIST_NAME = "chat.jsonl"
 
 # batch upsert size
 BATCH = int(os.getenv("INDEX_BATCH", "64"))
+EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", "4"))     # batch ที่ embed/upsert พร้อมกัน
+CHECKPOINT_DIR = os.path.expanduser(os.getenv("INDEX_MANIFEST_DIR", "~/private-ai/index"))
+CHECKPOINT_EVERY = 5.0     # วินาที: บันทึก checkpoint ระหว่างรอบอย่างน้อยทุกเท่านี้
 
-# ====== HTTP helpers ======
-def http_post(url: str, body: dict, timeout: int = 120) -> dict:
-    data = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            return json.loads(r.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        detail = e.read().decode("utf-8", "ignore")
-        raise RuntimeError(f"HTTP {e.code} {url}: {detail[:400]}") from None
-    except Exception as e:
-        raise RuntimeError(f"POST {url} failed: {e}") from None
+# namespace คงที่สำหรับ uuid5 ของ point (ห้ามเปลี่ยน ไม่งั้น id เดิมจะไม่ตรง)
+POINT_NAMESPACE = uuid.UUID("5b0e8a52-61a4-4c1e-9f0b-2f6f3c1d7e94")
+HEAD_BYTES = 256           # ใช้ hash หัวไฟล์ตรวจว่าไฟล์ถูกเขียนใหม่ทั้งไฟล์หรือไม่
 
-def http_put(url: str, body: dict, timeout: int = 300) -> dict:
-    data = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="PUT")
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            return json.loads(r.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        detail = e.read().decode("utf-8", "ignore")
-        raise RuntimeError(f"HTTP {e.code} {url}: {detail[:400]}") from None
-    except Exception as e:
-        raise RuntimeError(f"PUT {url} failed: {e}") from None
+# ====== Messages ======
+def room_of(rel_path: str) -> Optional[Tuple[str, str]]:
+    """(project_id, room_id) จาก path ของ chat.jsonl เทียบกับ HISTORY_DIR"""
+    parts = rel_path.split(os.sep)
+    if len(parts) == 5 and parts[1] == "rooms" and parts[3] == "history":
+        return parts[0], parts[2]
+    if len(parts) == 3:   # layout เดิม <project>/<room>/chat.jsonl
+        return parts[0], parts[1]
+    return None
 
-# ====== Embeddings ======
-def embed(text: str) -> List[float]:
-    """Call Ollama embeddings (bge-m3) -> list[float] of size 1024."""
-    try:
-        resp = http_post(f"{OLLAMA_URL}/api/embeddings", {"model": "bge-m3", "prompt": text})
-        emb = resp.get("embedding")
-        if not isinstance(emb, list):
-            raise ValueError("embedding missing or not a list")
-        return emb
-    except Exception as e:
-        print(f"EMB ERROR: {e}", file=sys.stderr)
+def collect_history_files(root: str) -> List[str]:
+    """Find all chat.jsonl files that belong to a room."""
+    files = glob.glob(os.path.join(root, "**", HIST_NAME), recursive=True)
+    return sorted(p for p in files if room_of(os.path.relpath(p, root)))
+
+def message_text(msg: dict) -> str:
+    return f"{msg.get('username') or 'unknown'}: {(msg.get('content') or '').strip()}"
+
+def point_id(project_id: str, room_id: str, ts: int, text: str) -> str:
+    """id คงที่จากห้อง เวลา และเนื้อหา: index ซ้ำ (หรือจาก worker ใน backend) ได้ point เดิม"""
+    digest = hashlib.sha1(text.encode("utf-8", "ignore")).hexdigest()
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{project_id}/{room_id}:{ts}:{digest}"))
+
+def message_point(project_id: str, room_id: str, msg: dict, file_path: str = "") -> Optional[Tuple[str, str, dict]]:
+    """(point id, ข้อความที่จะ embed, payload) หรือ None ถ้าไม่มีเนื้อหา"""
+    content = msg.get("content")
+    if not isinstance(content, str) or not content.strip():
         return None
+    ts = msg.get("ts")
+    ts = int(ts) if isinstance(ts, (int, float)) else 0
+    text = message_text(msg)
+    payload = {
+        "project_id": project_id,
+        "room_id": room_id,
+        "username": msg.get("username") or "unknown",
+        "role": msg.get("role"),
+        "content": content.strip(),
+        "ts": ts,
+        "created_at": msg.get("created_at", ts),
+        "file_path": file_path,
+    }
+    return point_id(project_id, room_id, ts, text), text, payload
 
-# ====== History scan ======
-def collect_history_files(root: str) -> List[str]:
-    """Find all chat.jsonl files recursively."""
-    return glob.glob(os.path.join(root, "**", "chat.jsonl"), recursive=True)
+def read_new_messages(path: str, offset: int) -> Iterator[Tuple[Optional[dict], int]]:
+    """yield (message หรือ None ถ้าอ่านไม่ได้, offset หลังบรรทัดนั้น) เฉพาะบรรทัดที่จบด้วย newline แล้ว"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        pos = offset
+        for line in f:
+            if not line.endswith(b"\n"):
+                return   # บรรทัดที่กำลังถูกเขียน รอรอบหน้า
+            pos += len(line)
+            try:
+                msg = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                msg = None
+            yield (msg if isinstance(msg, dict) else None), pos
 
-def read_messages(path: str) -> Iterator[Dict]:
-    """Yield each message from a .jsonl file."""
+# ====== Checkpoint ======
+def checkpoint_path() -> str:
+    key = hashlib.sha1(f"{HISTORY_DIR}|{store_location()}|{COLLECTION}".encode()).hexdigest()[:16]
+    return os.path.join(CHECKPOINT_DIR, f"{COLLECTION}-{key}.json")
+
+def load_checkpoint() -> dict:
+    path = checkpoint_path()
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                try:
-                    yield json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-    except Exception:
-        return
-
-# ====== Qdrant upsert ======
-def ensure_collection() -> None:
-    """Create Qdrant collection if it doesn't exist."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data.get("files"), dict):
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"WARN: cannot read checkpoint {path}: {e}", file=sys.stderr)
+    return {"files": {}}
+
+def save_checkpoint(checkpoint: dict) -> None:
+    path = checkpoint_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def head_hash(path: str, n: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read(n)).hexdigest()
+
+def resume_offset(path: str, entry: Optional[dict]) -> int:
+    """offset ที่ต้องอ่านต่อ หรือ 0 ถ้าไฟล์สั้นลง/ถูกเขียนใหม่ตั้งแต่รอบก่อน"""
+    if not entry:
+        return 0
+    offset = int(entry.get("offset", 0))
     try:
-        with urllib.request.urlopen(f"{QDRANT_URL}/collections/{COLLECTION}", timeout=5) as r:
-            if r.status == 200:
+        size = os.path.getsize(path)
+        if size < offset or head_hash(path, int(entry.get("head_len", 0))) != entry.get("head"):
+            print(f"File changed since last run, re-reading: {path}")
+            return 0
+    except OSError:
+        return 0
+    return offset
+
+# ====== Vector store ======
+async def ensure_collection(store: VectorStore) -> bool:
+    """สร้าง collection ถ้ายังไม่มี คืน True ถ้าเพิ่งสร้าง"""
+    created = await store.ensure_collection(COLLECTION, VECTOR_SIZE)
+    if created:
+        print(f"Created {store.backend} collection: {COLLECTION}")
+    return created
+
+async def drop_collection(store: VectorStore) -> None:
+    print(f"Dropping {store.backend} collection: {COLLECTION}")
+    await store.drop_collection(COLLECTION)
+
+async def upsert_points(store: VectorStore, points: List[dict]) -> int:
+    return await store.upsert(COLLECTION, points)
+
+async def index_messages(client: httpx.AsyncClient, items: List[Tuple[str, str, dict]], counts: Optional[Dict[str, int]] = None,
+                         store: Optional[VectorStore] = None) -> int:
+    """embed (ผ่าน client ของ Ollama) + upsert รายการจาก message_point() คืนจำนวน point ที่ upsert"""
+    if not items:
+        return 0
+    vecs = await embedding_store.embed_many(client, [text for _, text, _ in items], EMBED_MODEL, counts)
+    points = [{"id": pid, "vector": vec, "payload": pay} for (pid, _, pay), vec in zip(items, vecs)]
+    return await upsert_points(store or vector_store, points)
+
+# ====== Run ======
+class ConversationIndexRun:
+    """อ่านเฉพาะส่วนที่ต่อท้ายของแต่ละไฟล์ แล้ว embed/upsert เป็น batch พร้อมกันไม่เกิน EMBED_WORKERS"""
+
+    def __init__(self, client: httpx.AsyncClient, store: VectorStore, checkpoint: dict):
+        self.client = client
+        self.store = store
+        self.checkpoint = checkpoint
+        self.sem = asyncio.Semaphore(max(1, EMBED_WORKERS))
+        self.counts: Dict[str, int] = {}
+        self.read = 0
+        self.indexed = 0
+        self.failed: List[str] = []
+        self.last_save = time.monotonic()
+
+    async def run(self, files: List[str]) -> None:
+        file_q: asyncio.Queue = asyncio.Queue()
+        for path in files:
+            file_q.put_nowait(path)
+
+        async def worker() -> None:
+            while not file_q.empty():
+                await self.index_file(file_q.get_nowait())
+
+        await asyncio.gather(*(worker() for _ in range(max(1, EMBED_WORKERS))))
+
+    async def process(self, batch: List[Tuple[str, str, dict]]) -> int:
+        async with self.sem:
+            return await index_messages(self.client, batch, self.counts, self.store)
+
+    def advance(self, path: str, rel: str, offset: int) -> None:
+        head_len = min(offset, HEAD_BYTES)
+        self.checkpoint["files"][rel] = {"offset": offset, "head_len": head_len, "head": head_hash(path, head_len)}
+        now = time.monotonic()
+        if now - self.last_save >= CHECKPOINT_EVERY:
+            save_checkpoint(self.checkpoint)
+            self.last_save = now
+
+    async def flush(self, path: str, rel: str, window: List[Tuple[list, int]]) -> bool:
+        """ส่งหลาย batch ของไฟล์เดียวกันพร้อมกัน แล้วเลื่อน checkpoint ถึง batch สุดท้ายที่สำเร็จต่อเนื่อง"""
+        results = await asyncio.gather(*(self.process(b) for b, _ in window), return_exceptions=True)
+        for (_, end), res in zip(window, results):
+            if isinstance(res, BaseException):
+                print(f"ERROR indexing {rel}: {res}", file=sys.stderr)
+                return False
+            self.indexed += res
+            self.advance(path, rel, end)
+        print(f"Indexed {self.indexed} messages...")
+        return True
+
+    async def index_file(self, path: str) -> None:
+        rel = os.path.relpath(path, HISTORY_DIR)
+        project_id, room_id = room_of(rel)
+        offset = resume_offset(path, self.checkpoint["files"].get(rel))
+        try:
+            if offset == os.path.getsize(path):
                 return
-    except Exception:
-        pass
-    
-    body = {
-        "vectors": {"size": 1024, "distance": "Cosine"},
-        "on_disk_payload": True,
-    }
-    http_put(f"{QDRANT_URL}/collections/{COLLECTION}", body)
-    print(f"Created Qdrant collection: {COLLECTION}")
-
-def upsert_batch(ids: List[str], vecs: List[List[float]], pays: List[dict]) -> None:
-    points = [{"id": i, "vector": v, "payload": p} for i, v, p in zip(ids, vecs, pays) if v is not None]
-    if not points:
-        return
-    
-    resp = http_put(f"{QDRANT_URL}/collections/{COLLECTION}/points?wait=true", {"points": points})
-    if resp.get("status") != "ok":
-        print("UPSERT failed:", resp)
+        except OSError:
+            return
 
-# ====== MAIN ======
-def main():
-    ensure_collection()
+        window: List[Tuple[list, int]] = []
+        batch: List[Tuple[str, str, dict]] = []
+        end = offset
+        try:
+            for msg, end in read_new_messages(path, offset):
+                self.read += 1
+                item = message_point(project_id, room_id, msg, rel) if msg else None
+                if item:
+                    batch.append(item)
+                if len(batch) >= BATCH:
+                    window.append((batch, end))
+                    batch = []
+                    if len(window) >= EMBED_WORKERS:
+                        if not await self.flush(path, rel, window):
+                            self.failed.append(rel)
+                            return
+                        window = []
+        except OSError as e:
+            print(f"ERROR reading {path}: {e}", file=sys.stderr)
+            self.failed.append(rel)
+            return
+        if batch or end > offset:
+            window.append((batch, end))
+        if window and not await self.flush(path, rel, window):
+            self.failed.append(rel)
 
+# ====== MAIN ======
+async def main(full: bool = False):
+    start_time = time.time()
     history_files = collect_history_files(HISTORY_DIR)
     print(f"Found {len(history_files)} history files in {HISTORY_DIR}")
 
-    batch_ids, batch_vecs, batch_pays = [], [], []
-    total_indexed = 0
-
-    for fpath in history_files:
-        rel_path = os.path.relpath(fpath, HISTORY_DIR)
-        project_id, room_id, _ = rel_path.split(os.sep)
-
-        for msg in read_messages(fpath):
-            content = msg.get("content", "").strip()
-            username = msg.get("username", "unknown")
-            if not content:
-                continue
-
-            text_to_embed = f"{username}: {content}"
-            vec = embed(text_to_embed)
-            if vec is None:
-                continue
-
-            payload = {
-                "project_id": project_id,
-                "room_id": room_id,
-                "username": username,
-                "content": content,
-                "created_at": msg.get("created_at", int(time.time())),
-                "file_path": rel_path,
-            }
-
-            batch_ids.append(str(uuid.uuid4()))
-            batch_vecs.append(vec)
-            batch_pays.append(payload)
-
-            if len(batch_ids) >= BATCH:
-                upsert_batch(batch_ids, batch_vecs, batch_pays)
-                total_indexed += len(batch_ids)
-                print(f"Indexed {total_indexed} messages...")
-                batch_ids, batch_vecs, batch_pays = [], [], []
-
-    if batch_ids:
-        upsert_batch(batch_ids, batch_vecs, batch_pays)
-        total_indexed += len(batch_ids)
-
-    print(f"Finished indexing. Total messages indexed: {total_indexed}")
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        store = open_store(client)
+        if full:
+            await drop_collection(store)
+        created = await ensure_collection(store)
+
+        checkpoint = {"files": {}} if (full or created) else load_checkpoint()
+        # ไฟล์ที่ถูกลบไปแล้วไม่ต้องจำ offset
+        known = {os.path.relpath(p, HISTORY_DIR) for p in history_files}
+        checkpoint["files"] = {rel: e for rel, e in checkpoint["files"].items() if rel in known}
+
+        run = ConversationIndexRun(client, store, checkpoint)
+        await run.run(history_files)
+
+        checkpoint.update({"history_dir": HISTORY_DIR, "collection": COLLECTION, "updated_at": int(time.time())})
+        save_checkpoint(checkpoint)
+
+    saved = run.counts.get("hits", 0) + run.counts.get("shared", 0)
+    print(f"Finished indexing. New lines read: {run.read}, messages indexed: {run.indexed}")
+    print(f"Embeddings: {run.counts.get('embedded', 0)} computed, {saved} reused by dedup")
+    if run.failed:
+        print(f"Files with errors (will resume next run): {len(run.failed)}")
+    print(f"Checkpoint: {checkpoint_path()}")
+    print(f"Total time: {time.time() - start_time:.2f} seconds")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    ap = argparse.ArgumentParser(description="Index chat history into the vector store")
+    ap.add_argument("--full", action="store_true", help="drop the collection and re-index every file from the start")
+    args = ap.parse_args()
+    asyncio.run(main(full=args.full))
@@ -2,11 +2,20 @@
 # -*- coding: utf-8 -*-
 
 """
-Index the repository into Qdrant (collection=code_rag) using bge-m3 embeddings via Ollama.
+Index the repository into the vector store (collection=code_rag) using bge-m3 embeddings via Ollama.
 
-- Embeddings: Ollama bge-m3 (1024 dims)
-- Vector DB: Qdrant (Cosine)
-- Payload fields: path, start, end, commit, preview
+- Embeddings: Ollama bge-m3 (1024 dims), deduplicated through embedding_store.py
+  (identical chunk text is embedded once across files, runs and collections)
+- Vector DB: vector_store.py (Qdrant REST or the embedded NumPy/mmap backend, Cosine)
+- Chunking: code_chunker.py (ast for .py, brace/heading heuristics for JS/TS and Markdown),
+  run in a process pool
+- Payload fields: path, start, end, start_line, end_line, symbols, kind, commit, preview
+- Lexical index: BM25 over identifier-split tokens (lexical_index.py), written next to the
+  manifest as a memory-mapped .lex file for hybrid search in code_api.py
+- Incremental: a manifest of file hashes and point IDs (~/private-ai/index) lets re-runs
+  embed only new/changed files and delete points of changed/removed files.
+  Point IDs are uuid5(path, offset, content hash) so re-runs are idempotent.
+  Use --full to drop the collection and re-index everything.
 """
 
 import os
@@ -16,22 +25,44 @@ import uuid
 import json
 import time
 import hashlib
+import argparse
 import httpx
 import asyncio
-from typing import Iterator, Tuple, List
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+from code_chunker import CHUNKER_VERSION, content_hash, prepare_file
+from embedding_store import embedding_store
+from lexical_index import LexicalSource, index_path
+from vector_store import VectorStore, open_store, store_location
 
 # ====== CONFIG ======
 REPO = os.path.abspath(os.getenv("CODE_REPO_DIR", os.getcwd()))
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
 COLLECTION = os.getenv("QDRANT_COLLECTION", "code_rag")
+VECTOR_SIZE = 1024   # bge-m3
 
 # batch upsert size
 BATCH = int(os.getenv("INDEX_BATCH", "128"))
 
-# chunking
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1200"))
-CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# pipeline: walker -> chunker -> embedder pool -> upserter ต่อกันด้วยคิวที่จำกัดขนาด
+EMBED_BATCH = int(os.getenv("INDEX_EMBED_BATCH", "32"))          # chunk ต่อการเรียก embed หนึ่งครั้ง
+EMBED_WORKERS = int(os.getenv("INDEX_EMBED_WORKERS", "4"))       # จำนวน embed batch ที่ทำพร้อมกัน
+CHUNK_PROCS = int(os.getenv("INDEX_CHUNK_PROCS", str(os.cpu_count() or 2)))   # process ที่อ่าน/แบ่งไฟล์
+CHUNK_WORKERS = int(os.getenv("INDEX_CHUNK_WORKERS", str(CHUNK_PROCS * 2)))   # ไฟล์ที่ส่งเข้า pool พร้อมกัน
+UPSERT_WORKERS = int(os.getenv("INDEX_UPSERT_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("INDEX_QUEUE_SIZE", "512"))           # chunk/point สูงสุดที่ค้างในแต่ละคิว
+
+EMBED_MODEL = "bge-m3"
+
+# manifest ของการ index ครั้งก่อน (ต่อ repo + collection)
+MANIFEST_DIR = os.path.expanduser(os.getenv("INDEX_MANIFEST_DIR", "~/private-ai/index"))
+
+# namespace คงที่สำหรับ uuid5 ของ point id
+POINT_NAMESPACE = uuid.UUID("6f1c8d1e-3b7a-5c2e-9a41-7d0e2f5b8c13")
+
+# chunking: ขนาดสูงสุดของ chunk (ตัวอักษร) ไม่มี overlap เพราะตัดตามขอบ function/class/section
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1500"))
 
 # files to include/exclude
 INCLUDE_EXT = {".py", ".ts", ".tsx", ".js", ".jsx", ".md", ".txt", ".json", ".toml", ".yaml", ".yml"}
@@ -41,55 +72,69 @@ EXCLUDE_DIR = {
 }
 
 # ====== Embeddings ======
-async def embed(client: httpx.AsyncClient, text: str) -> List[float]:
-    """Call Ollama embeddings (bge-m3) -> list[float] of size 1024."""
-    try:
-        resp = await client.post(
-            f"{OLLAMA_URL}/api/embeddings",
-            json={"model": "bge-m3", "prompt": text},
-            timeout=120.0
-        )
-        resp.raise_for_status()
-        emb = resp.json().get("embedding")
-        if not isinstance(emb, list):
-            raise ValueError("embedding missing or not a list")
-        return emb
-    except Exception as e:
-        print(f"EMBED ERROR: {e}", file=sys.stderr)
-        # ถ้า embed พัง ให้ข้ามชิ้นนี้ไปโดยคืน None เพื่อไม่ upsert
-        return None  # type: ignore
+async def embed_texts(client: httpx.AsyncClient, texts: List[str], counts: Optional[Dict[str, int]] = None) -> List[List[float]]:
+    """Call Ollama embeddings (bge-m3) for a batch of texts -> list of 1024-dim vectors.
+
+    Texts already in the content-addressed embedding store (same text + model, from any
+    file, run or collection) are not embedded again. Misses from concurrent workers are
+    coalesced by the shared batcher into /api/embed calls.
+    """
+    vecs = await embedding_store.embed_many(client, texts, EMBED_MODEL, counts)
+    if len(vecs) != len(texts) or not all(isinstance(v, list) for v in vecs):
+        raise ValueError("embedding missing or not a list")
+    return vecs
 
 # ====== Repo scan / chunking ======
-def collect_files(root: str) -> List[str]:
-    out = []
+def iter_files(root: str) -> Iterator[str]:
     for dirpath, dirnames, filenames in os.walk(root):
         # prune excluded directories
         dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIR]
         for fn in filenames:
             ext = os.path.splitext(fn)[1].lower()
             if ext in INCLUDE_EXT:
-                out.append(os.path.join(dirpath, fn))
-    return out
+                yield os.path.join(dirpath, fn)
+
+def collect_files(root: str) -> List[str]:
+    return list(iter_files(root))
+
+def point_id(rel: str, start: int, text: str) -> str:
+    """id คงที่จาก path, offset และเนื้อหา: index ซ้ำได้ผลเหมือนเดิม ไม่เกิด point ซ้ำ"""
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{rel}:{start}:{content_hash(text)}"))
+
+# ====== Manifest ======
+def manifest_path(repo_root: str) -> str:
+    key = hashlib.sha1(f"{repo_root}|{store_location()}|{COLLECTION}".encode()).hexdigest()[:16]
+    return os.path.join(MANIFEST_DIR, f"{COLLECTION}-{key}.json")
+
+def lexical_paths(repo_root: str) -> tuple:
+    """(ไฟล์ .lex ที่ code_api อ่าน, SQLite ของ term counts ต่อไฟล์)"""
+    lex = index_path(repo_root, store_location(), COLLECTION)
+    return lex, os.path.splitext(lex)[0] + ".terms.db"
+
+def chunk_config() -> dict:
+    # ถ้าค่าเหล่านี้เปลี่ยน chunk เดิมใช้ไม่ได้ ต้อง index ทุกไฟล์ใหม่
+    return {"chunker": CHUNKER_VERSION, "chunk_size": CHUNK_SIZE, "model": EMBED_MODEL}
 
-def read_text_safe(path: str) -> str:
+def load_manifest(repo_root: str) -> dict:
+    path = manifest_path(repo_root)
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
-    except Exception:
-        return ""
-
-def chunk_file(path: str) -> Iterator[Tuple[int, int, str]]:
-    text = read_text_safe(path)
-    if not text:
-        return
-    n = len(text)
-    i = 0
-    while i < n:
-        j = min(i + CHUNK_SIZE, n)
-        yield (i, j, text[i:j])
-        if j >= n:
-            break
-        i = j - CHUNK_OVERLAP  # overlap
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data.get("files"), dict):
+            return data
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"WARN: cannot read manifest {path}: {e}", file=sys.stderr)
+    return {"files": {}}
+
+def save_manifest(repo_root: str, manifest: dict) -> None:
+    path = manifest_path(repo_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
 
 def get_commit_hash(repo_root: str) -> str:
     head = ""
@@ -119,116 +164,327 @@ def get_commit_hash(repo_root: str) -> str:
             continue
     return h.hexdigest()
 
-# ====== Qdrant upsert ======
-async def ensure_collection(client: httpx.AsyncClient) -> None:
-    # try GET collection to check existence
-    try:
-        r = await client.get(f"{QDRANT_URL}/collections/{COLLECTION}", timeout=5)
-        if r.status_code == 200:
-            return # Collection exists
-    except Exception:
-        pass
+# ====== Vector store ======
+async def ensure_collection(store: VectorStore) -> bool:
+    """สร้าง collection ถ้ายังไม่มี คืน True ถ้าเพิ่งสร้าง"""
+    created = await store.ensure_collection(COLLECTION, VECTOR_SIZE)
+    if created:
+        print(f"Created {store.backend} collection: {COLLECTION}")
+    return created
 
-    # create if not exists
-    print(f"Creating Qdrant collection: {COLLECTION}")
-    body = {
-        "vectors": {"size": 1024, "distance": "Cosine"},
-        "on_disk_payload": True,
-    }
-    try:
-        r = await client.put(f"{QDRANT_URL}/collections/{COLLECTION}", json=body, timeout=30)
-        r.raise_for_status()
-    except httpx.HTTPStatusError as e:
-        # ignore "already exists"
-        if "already exists" not in str(e):
-            raise
-
-async def upsert_batch(client: httpx.AsyncClient, ids: List[str], vecs: List[List[float]], pays: List[dict]) -> int:
-    points = []
-    for i, v, p in zip(ids, vecs, pays):
-        if v is None:
-            # ข้ามจุดที่ embed ล้มเหลว
-            continue
-        points.append({"id": i, "vector": v, "payload": p})
-    
-    if not points:
-        return 0
+async def drop_collection(store: VectorStore) -> None:
+    print(f"Dropping {store.backend} collection: {COLLECTION}")
+    await store.drop_collection(COLLECTION)
 
-    body = {"points": points, "wait": True}
-    resp = await client.put(f"{QDRANT_URL}/collections/{COLLECTION}/points?wait=true", json=body, timeout=300)
-    resp.raise_for_status()
-    
-    result = resp.json().get("result", {})
-    if result.get("status") == "completed":
-        return len(points)
-    return 0
+async def delete_points(store: VectorStore, ids: List[str]) -> int:
+    return await store.delete(COLLECTION, ids)
 
-# ====== MAIN ======
-async def process_chunk(client: httpx.AsyncClient, text: str, rel: str, start: int, end: int, commit: str):
-    vec = await embed(client, text)
-    if vec:
-        pid = str(uuid.uuid4())
-        snippet = (text or "")[:220]
-        pay = {
-            "path": rel,
-            "start": start,
-            "end": end,
-            "commit": commit,
-            "preview": snippet,
+async def upsert_batch(store: VectorStore, points: List[dict]) -> int:
+    return await store.upsert(COLLECTION, points)
+
+# ====== Pipeline ======
+class StageStats:
+    """นับจำนวนงานและเวลาที่ stage ทำงานจริง เพื่อรายงาน throughput ตอนจบ"""
+
+    def __init__(self, name: str, unit: str = "chunks"):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self.first: Optional[float] = None
+        self.last: Optional[float] = None
+
+    def record(self, n: int, t0: float) -> None:
+        now = time.perf_counter()
+        self.items += n
+        self.busy += now - t0
+        self.first = t0 if self.first is None else min(self.first, t0)
+        self.last = now
+
+    def report(self) -> str:
+        wall = (self.last - self.first) if self.first is not None else 0.0
+        rate = self.items / wall if wall > 0 else 0.0
+        return f"  {self.name:<9} {self.items:>8} {self.unit:<6} {rate:>9.1f} {self.unit}/s  (busy {self.busy:.2f}s)"
+
+class FileState:
+    def __init__(self, sha1: str, old_ids: List[str]):
+        self.sha1 = sha1
+        self.old_ids = old_ids
+        self.ids: List[str] = []
+        self.failed = False
+
+class IndexRun:
+    """หนึ่งรอบการ index: walker -> chunker -> embedder -> upserter ต่อกันด้วยคิวที่จำกัดขนาด
+
+    หน่วยความจำคงที่ไม่ขึ้นกับขนาด repo (มีแค่ chunk ที่ค้างในคิว) และ embed กับ upsert ทำงานซ้อนกัน
+    """
+
+    def __init__(self, client: httpx.AsyncClient, store: VectorStore, repo: str, commit: str, old_files: Dict[str, dict], same_config: bool, lexical: LexicalSource):
+        self.client = client
+        self.store = store
+        self.repo = repo
+        self.commit = commit
+        self.old_files = old_files
+        self.same_config = same_config
+        self.lexical = lexical
+        self.lexical_known = lexical.paths()    # ไฟล์ที่มี term counts อยู่แล้ว
+        self.unchanged: Dict[str, dict] = {}     # rel -> manifest entry เดิม
+        self.changed: Dict[str, FileState] = {}
+        self.seen: set = set()
+        self.reused = 0
+        self.upserted = 0
+        self.dedup: Dict[str, int] = {}          # requested/hits/shared/embedded ของ embedding store
+        self.stats = {
+            "walk": StageStats("walk", "files"),
+            "chunk": StageStats("chunk"),
+            "embed": StageStats("embed"),
+            "upsert": StageStats("upsert"),
         }
-        return pid, vec, pay
-    return None, None, None
+        # spawn แทน fork เพราะตอนนี้ process มี thread ของ walker อยู่แล้ว
+        self.pool = ProcessPoolExecutor(max(1, CHUNK_PROCS), mp_context=multiprocessing.get_context("spawn"))
+        self.file_q: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self.chunk_q: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+        self.point_q: asyncio.Queue = asyncio.Queue(QUEUE_SIZE)
+
+    async def run(self) -> None:
+        try:
+            await self._run()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+
+    async def _run(self) -> None:
+        walker = asyncio.create_task(self.walk())
+        chunkers = [asyncio.create_task(self.chunk_worker()) for _ in range(max(1, CHUNK_WORKERS))]
+        embedders = [asyncio.create_task(self.embed_worker()) for _ in range(max(1, EMBED_WORKERS))]
+        upserters = [asyncio.create_task(self.upsert_worker()) for _ in range(max(1, UPSERT_WORKERS))]
+
+        # ปิดแต่ละ stage ตามลำดับด้วย sentinel (None) เมื่อ stage ก่อนหน้าทำงานเสร็จ
+        await walker
+        for _ in chunkers:
+            await self.file_q.put(None)
+        await asyncio.gather(*chunkers)
+        for _ in embedders:
+            await self.chunk_q.put(None)
+        await asyncio.gather(*embedders)
+        for _ in upserters:
+            await self.point_q.put(None)
+        await asyncio.gather(*upserters)
+
+    async def walk(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        def produce():
+            for path in iter_files(self.repo):
+                t0 = time.perf_counter()
+                # block thread นี้ถ้าคิวเต็ม (backpressure ไปถึง os.walk)
+                asyncio.run_coroutine_threadsafe(self.file_q.put(path), loop).result()
+                self.stats["walk"].record(1, t0)
+
+        await asyncio.to_thread(produce)
+
+    async def chunk_worker(self) -> None:
+        while True:
+            path = await self.file_q.get()
+            if path is None:
+                return
+            try:
+                await self.chunk_file(path)
+            except Exception as e:
+                print(f"CHUNK ERROR {path}: {e}", file=sys.stderr)
+                state = self.changed.get(os.path.relpath(path, self.repo))
+                if state is not None:
+                    state.failed = True
 
-async def main():
+    async def chunk_file(self, path: str) -> None:
+        t0 = time.perf_counter()
+        rel = os.path.relpath(path, self.repo)
+        self.seen.add(rel)
+        prev = self.old_files.get(rel)
+        prev_hash = prev.get("sha1") if (self.same_config and prev and rel in self.lexical_known) else None
+        # อ่าน, hash และแบ่ง chunk ใน process pool (ไฟล์ที่ hash ไม่เปลี่ยนจะไม่ถูกแบ่ง)
+        h, chunks = await asyncio.get_running_loop().run_in_executor(self.pool, prepare_file, path, prev_hash, CHUNK_SIZE)
+        if chunks is None:
+            self.unchanged[rel] = prev
+            self.stats["chunk"].record(0, t0)
+            return
+
+        old_ids = (prev or {}).get("ids", [])
+        state = self.changed[rel] = FileState(h, old_ids)
+        known = set(old_ids) if self.same_config else set()
+        lexical_docs = []
+        n = 0
+        for ck in chunks:
+            text = ck["text"]
+            pid = point_id(rel, ck["start"], text)
+            state.ids.append(pid)
+            pay = {
+                "path": rel,
+                "start": ck["start"],
+                "end": ck["end"],
+                "start_line": ck["start_line"],
+                "end_line": ck["end_line"],
+                "symbols": ck["symbols"],
+                "kind": ck["kind"],
+                "commit": self.commit,
+                "preview": text[:220],
+            }
+            lexical_docs.append((pid, pay, text))
+            if pid in known:
+                # chunk เดิมทุกอย่าง (id มาจาก path/offset/เนื้อหา) มีอยู่ใน vector store แล้ว
+                self.reused += 1
+                continue
+            n += 1
+            await self.chunk_q.put((pid, text, pay))
+        await asyncio.to_thread(self.lexical.put_file, rel, lexical_docs)
+        self.stats["chunk"].record(n, t0)
+
+    async def embed_worker(self) -> None:
+        done = False
+        while not done:
+            item = await self.chunk_q.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < EMBED_BATCH and not self.chunk_q.empty():
+                nxt = self.chunk_q.get_nowait()
+                if nxt is None:
+                    done = True
+                    break
+                batch.append(nxt)
+            t0 = time.perf_counter()
+            try:
+                vecs = await embed_texts(self.client, [text for _, text, _ in batch], self.dedup)
+            except Exception as e:
+                print(f"EMBED ERROR: {e}", file=sys.stderr)
+                # ไฟล์เหล่านี้จะถูก index ใหม่รอบหน้า
+                for _, _, pay in batch:
+                    self.changed[pay["path"]].failed = True
+                continue
+            self.stats["embed"].record(len(batch), t0)
+            for (pid, _, pay), vec in zip(batch, vecs):
+                await self.point_q.put({"id": pid, "vector": vec, "payload": pay})
+
+    async def upsert_worker(self) -> None:
+        done = False
+        while not done:
+            item = await self.point_q.get()
+            if item is None:
+                return
+            points = [item]
+            # รอเติม batch สั้นๆ เพื่อไม่ให้ upsert ทีละไม่กี่จุด
+            while len(points) < BATCH:
+                try:
+                    nxt = await asyncio.wait_for(self.point_q.get(), timeout=0.2)
+                except asyncio.TimeoutError:
+                    break
+                if nxt is None:
+                    done = True
+                    break
+                points.append(nxt)
+            t0 = time.perf_counter()
+            try:
+                n = await upsert_batch(self.store, points)
+                self.upserted += n
+                self.stats["upsert"].record(n, t0)
+                print(f"Upserted {n} points. Total: {self.upserted}")
+            except Exception as e:
+                print(f"ERROR during upsert: {e}", file=sys.stderr)
+                for p in points:
+                    self.changed[p["payload"]["path"]].failed = True
+
+# ====== MAIN ======
+async def main(full: bool = False):
     start_time = time.time()
     
-    async with httpx.AsyncClient() as client:
-        await ensure_collection(client)
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        store = open_store(client)
+        if full:
+            await drop_collection(store)
+        created = await ensure_collection(store)
 
         repo = REPO
         commit = get_commit_hash(repo)
-        files = collect_files(repo)
         print(f"Repo: {repo}")
         print(f"Commit: {commit}")
-        print(f"Files to process: {len(files)}")
-
-        batch_ids, batch_vecs, batch_pays = [], [], []
-        total_upserted = 0
-        tasks = []
-
-        for fpath in files:
-            rel = os.path.relpath(fpath, repo)
-            for start, end, text in chunk_file(fpath):
-                tasks.append(process_chunk(client, text, rel, start, end, commit))
-
-        print(f"Total chunks to process: {len(tasks)}")
-
-        for i in range(0, len(tasks), BATCH):
-            batch_tasks = tasks[i:i+BATCH]
-            results = await asyncio.gather(*batch_tasks)
-            
-            current_batch_ids = []
-            current_batch_vecs = []
-            current_batch_pays = []
-
-            for pid, vec, pay in results:
-                if pid:
-                    current_batch_ids.append(pid)
-                    current_batch_vecs.append(vec)
-                    current_batch_pays.append(pay)
-            
-            if current_batch_ids:
-                try:
-                    upserted_count = await upsert_batch(client, current_batch_ids, current_batch_vecs, current_batch_pays)
-                    total_upserted += upserted_count
-                    print(f"Upserted batch {i//BATCH + 1}, {upserted_count} points. Total: {total_upserted}")
-                except Exception as e:
-                    print(f"ERROR during upsert for batch {i//BATCH + 1}: {e}", file=sys.stderr)
+        print(f"Mode: {'full' if full else 'incremental'}")
+
+        old = {"files": {}} if (full or created) else load_manifest(repo)
+        old_files: Dict[str, dict] = old["files"]
+        lex_path, terms_path = lexical_paths(repo)
+        lexical = LexicalSource(terms_path)
+        if full or created:
+            lexical.clear()
+        run = IndexRun(client, store, repo, commit, old_files, old.get("config") == chunk_config(), lexical)
+        await run.run()
+
+        changed = run.changed
+        manifest_files = dict(run.unchanged)
+        removed = [rel for rel in old_files if rel not in run.seen]
+        print(f"Files: {len(run.seen)} (unchanged {len(run.unchanged)}, new/changed {len(changed)}, removed {len(removed)})")
+        print(f"Unchanged chunks reused: {run.reused}")
+
+        # ลบ point เก่าที่ไม่มีแล้ว (ไฟล์ถูกแก้หรือถูกลบ) รวมที่ลบไม่สำเร็จจากรอบก่อน
+        stale: List[str] = list(old.get("pending_delete", []))
+        for rel, st in changed.items():
+            if st.failed:
+                # เก็บ hash เดิมไว้เพื่อให้รอบหน้าลองใหม่ และจำ id ทั้งเก่าและใหม่ไว้ลบภายหลัง
+                prev = old_files.get(rel)
+                if prev or st.ids:
+                    ids = list(dict.fromkeys((prev or {}).get("ids", []) + st.ids))
+                    manifest_files[rel] = {"sha1": (prev or {}).get("sha1", ""), "ids": ids}
+                continue
+            new_ids = set(st.ids)
+            stale.extend(pid for pid in st.old_ids if pid not in new_ids)
+            manifest_files[rel] = {"sha1": st.sha1, "ids": st.ids}
+        for rel in removed:
+            stale.extend(old_files[rel].get("ids", []))
+
+        total_deleted = 0
+        pending_delete: List[str] = []
+        if stale:
+            try:
+                total_deleted = await delete_points(store, stale)
+            except Exception as e:
+                print(f"ERROR deleting stale points: {e}", file=sys.stderr)
+                pending_delete = stale   # ลองใหม่รอบหน้า
+
+        # lexical index: ลบ term ของไฟล์ที่หายไปแล้วเขียน .lex ใหม่ (code_api โหลดใหม่เอง)
+        lexical.remove_files([rel for rel in lexical.paths() if rel not in run.seen])
+        lex_docs = lex_terms = None
+        if changed or removed or not os.path.exists(lex_path):
+            lex_docs, lex_terms = lexical.write_index(lex_path, {"commit": commit, "repo": repo, "collection": COLLECTION})
+        lexical.close()
+
+        save_manifest(repo, {
+            "repo": repo,
+            "collection": COLLECTION,
+            "commit": commit,
+            "config": chunk_config(),
+            "updated_at": int(time.time()),
+            "files": manifest_files,
+            "pending_delete": pending_delete,
+        })
 
     end_time = time.time()
+    failed = sum(1 for st in changed.values() if st.failed)
     print(f"\nIndexing finished.")
-    print(f"Total indexed chunks: {total_upserted}")
+    print(f"Total indexed chunks: {run.upserted}")
+    print(f"Stale points deleted: {total_deleted}")
+    saved = run.dedup.get("hits", 0) + run.dedup.get("shared", 0)
+    print(f"Embeddings: {run.dedup.get('embedded', 0)} computed, {saved} reused by dedup "
+          f"({run.dedup.get('hits', 0)} from store, {run.dedup.get('shared', 0)} duplicate chunks)")
+    if failed:
+        print(f"Files with errors (will retry next run): {failed}")
+    print(f"Manifest: {manifest_path(repo)}")
+    if lex_docs is not None:
+        print(f"Lexical index: {lex_path} ({lex_docs} chunks, {lex_terms} terms)")
     print(f"Total time: {end_time - start_time:.2f} seconds")
+    print("Stage throughput:")
+    for st in run.stats.values():
+        print(st.report())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    ap = argparse.ArgumentParser(description="Index a repository into the vector store")
+    ap.add_argument("--full", action="store_true", help="drop the collection and re-index every file")
+    args = ap.parse_args()
+    asyncio.run(main(full=args.full))
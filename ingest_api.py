@@ -1,106 +1,194 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from pydantic import BaseModel
-import os, time, httpx
+from typing import List, Optional
+import os, shutil, asyncio, tarfile, zipfile
+from ingest_jobs import ingest_jobs
 
 router = APIRouter(prefix="/ingest", tags=["ingest"])
 
 # Phase 1: ใช้โลคอลเท่านั้น
 BASE_DIR = os.path.expanduser("~/private-ai/projects")
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
-COLLECTION = "demo_rag"
 
 ALLOWED_EXT = {".md",".txt",".csv",".py"}
+ARCHIVE_EXT = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")
+
+INGEST_BULK_MAX_FILES = int(os.getenv("INGEST_BULK_MAX_FILES", "20000"))
+INGEST_BULK_MAX_BYTES = int(os.getenv("INGEST_BULK_MAX_BYTES", str(1024 * 1024 * 1024)))   # รวมหลังแตกไฟล์
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024   # อ่าน upload ทีละก้อน ไม่ถือทั้งไฟล์ไว้ในหน่วยความจำ
 
 class IngestResp(BaseModel):
+    job_id: str
     room_id: str
     file_path: str
-    chunks: int
+    status: str
+
+class BulkIngestResp(BaseModel):
+    job_id: str
+    room_id: str
+    files: int                   # ไฟล์ที่รับเข้า job (ยังไม่หักไฟล์ที่ hash ซ้ำ)
+    rejected: List[str] = []     # ไฟล์ที่นามสกุลไม่รองรับหรือ path ไม่ปลอดภัย
+    status: str
+
+class IngestJobStatus(BaseModel):
+    job_id: str
+    project_id: str
+    room_id: str
+    status: str                  # queued | running | done | failed
+    error: Optional[str] = None
+    files: int
+    files_done: int
+    files_skipped: int = 0       # เนื้อหาเคย ingest เข้าห้องนี้แล้ว
+    files_failed: int = 0
+    chunks: int                  # chunk ที่ได้จากการแบ่งไฟล์จนถึงตอนนี้
+    embedded: int
     upserted: int
+    failed: int
+    dedup_saved: int = 0         # chunk ที่ใช้ vector เดิมจาก embedding store หรือซ้ำกันใน job
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
 
 def ensure_room_dirs(project_id: str, room_id: str) -> str:
     room_dir = os.path.join(BASE_DIR, project_id, "rooms", room_id, "files")
     os.makedirs(room_dir, exist_ok=True)
     return room_dir
 
-def chunk_text(s: str, n: int = 1000, overlap: int = 100):
-    i = 0
-    L = len(s)
-    while i < L:
-        yield s[i:i+n]
-        i += max(1, n-overlap)
+def manifest_path(project_id: str, room_id: str) -> str:
+    return os.path.join(BASE_DIR, project_id, "rooms", room_id, "ingested.json")
+
+def safe_member_path(name: str) -> Optional[str]:
+    """path ภายใน archive ที่ปลอดภัย (ไม่ใช่ absolute, ไม่มี ..) หรือ None"""
+    rel = os.path.normpath(name.replace("\\", "/")).lstrip("/")
+    if not rel or rel == "." or rel.startswith("..") or os.path.isabs(rel):
+        return None
+    return rel
+
+class _Extractor:
+    """แตก archive ทีละ member ลงโฟลเดอร์ห้อง (รันใน threadpool) เก็บเฉพาะนามสกุลที่รองรับ"""
+
+    def __init__(self, room_dir: str):
+        self.room_dir = room_dir
+        self.saved: List[str] = []
+        self.rejected: List[str] = []
+        self.total = 0
+
+    def _write(self, name: str, src, size: int) -> None:
+        rel = safe_member_path(name)
+        if rel is None or os.path.splitext(rel)[1].lower() not in ALLOWED_EXT:
+            self.rejected.append(name)
+            return
+        if len(self.saved) >= INGEST_BULK_MAX_FILES or self.total + size > INGEST_BULK_MAX_BYTES:
+            raise ValueError("archive exceeds INGEST_BULK_MAX_FILES/INGEST_BULK_MAX_BYTES")
+        dest = os.path.join(self.room_dir, rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest + ".part", "wb") as out:
+            shutil.copyfileobj(src, out, UPLOAD_CHUNK_BYTES)
+        os.replace(dest + ".part", dest)
+        self.total += size
+        self.saved.append(dest)
+
+    def extract(self, fileobj, filename: str) -> None:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as zf:
+                for info in zf.infolist():
+                    if info.is_dir():
+                        continue
+                    with zf.open(info) as src:
+                        self._write(info.filename, src, info.file_size)
+        else:
+            # "r|*" อ่าน tar แบบ stream ตามลำดับ ไม่ต้อง seek
+            with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+                for member in tf:
+                    if not member.isfile():
+                        continue
+                    src = tf.extractfile(member)
+                    if src is not None:
+                        self._write(member.name, src, member.size)
 
-@router.post("/upload", response_model=IngestResp)
+async def save_upload(file: UploadFile, save_path: str) -> int:
+    """เขียน upload ลงดิสก์ทีละก้อนผ่าน threadpool (ไม่ block event loop) คืนจำนวน byte"""
+    tmp = save_path + ".part"
+    size = 0
+    f = await asyncio.to_thread(open, tmp, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            await asyncio.to_thread(f.write, chunk)
+            size += len(chunk)
+    except BaseException:
+        await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.remove, tmp)
+        raise
+    await asyncio.to_thread(f.close)
+    await asyncio.to_thread(os.replace, tmp, save_path)
+    return size
+
+@router.post("/upload", response_model=IngestResp, status_code=202)
 async def upload(
     project_id: str = Form("demo"),
     room_id: str = Form("general"),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
 ):
-    _, ext = os.path.splitext(file.filename or "")
+    name = os.path.basename(file.filename or "")
+    _, ext = os.path.splitext(name)
     ext = ext.lower()
     if ext not in ALLOWED_EXT:
         raise HTTPException(400, f"Unsupported file type: {ext}")
 
-    # 1) บันทึกไฟล์ลงโฟลเดอร์ห้อง
+    # 1) บันทึกไฟล์ลงโฟลเดอร์ห้องแบบ stream
     room_dir = ensure_room_dirs(project_id, room_id)
-    save_path = os.path.join(room_dir, file.filename)
-    data = await file.read()
+    save_path = os.path.join(room_dir, name)
     try:
-        text = data.decode("utf-8", errors="ignore")
-    except Exception as e:
-        raise HTTPException(400, f"Cannot decode text: {e}")
-    with open(save_path, "wb") as f:
-        f.write(data)
-
-    # 2) ทำ embedding + upsert เป็น batch
-    created_at = int(time.time())
-    upserted = 0
-    idx = 0
-    batch = []
-    max_batch = 16
-
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        for ck in chunk_text(text, n=1000, overlap=100):
-            snippet = ck.strip()
-            if not snippet:
-                idx += 1
-                continue
-
-            emb_resp = await client.post(f"{OLLAMA_URL}/api/embeddings", json={"model":"bge-m3","prompt": snippet[:4000]})
-            if emb_resp.status_code != 200:
-                raise HTTPException(500, f"Ollama embeddings error: {emb_resp.text}")
-            emb = emb_resp.json().get("embedding")
-            if not emb:
-                idx += 1
-                continue
-
-            pid = int(f"{created_at}{idx:03d}")
-            batch.append({
-                "id": pid,
-                "vector": emb,
-                "payload": {
-                    "project_id": project_id,
-                    "room_id": room_id,
-                    "source_type": "file",
-                    "file_path": save_path,
-                    "created_at": created_at,
-                    "chunk_index": idx,
-                    "preview": snippet[:220]
-                }
-            })
-
-            if len(batch) >= max_batch:
-                r = await client.put(f"{QDRANT_URL}/collections/{COLLECTION}/points", json={"points": batch, "wait": True})
-                if r.status_code != 200:
-                    raise HTTPException(500, f"Qdrant upsert error: {r.text}")
-                upserted += len(batch)
-                batch = []
-            idx += 1
-
-        if batch:
-            r = await client.put(f"{QDRANT_URL}/collections/{COLLECTION}/points", json={"points": batch, "wait": True})
-            if r.status_code != 200:
-                raise HTTPException(500, f"Qdrant upsert error: {r.text}")
-            upserted += len(batch)
-
-    return IngestResp(room_id=room_id, file_path=save_path, chunks=idx, upserted=upserted)
+        await save_upload(file, save_path)
+    except OSError as e:
+        raise HTTPException(500, f"Cannot save file: {e}")
+
+    # 2) chunk/embed/upsert ใน background job แล้วตอบกลับทันที
+    job = ingest_jobs.submit(project_id, room_id, [save_path], manifest_path(project_id, room_id))
+    return IngestResp(job_id=job.id, room_id=room_id, file_path=save_path, status=job.status)
+
+@router.post("/bulk", response_model=BulkIngestResp, status_code=202)
+async def bulk_upload(
+    project_id: str = Form("demo"),
+    room_id: str = Form("general"),
+    files: List[UploadFile] = File(...),
+):
+    """หลายไฟล์และ/หรือ archive (.zip, .tar, .tar.gz, ...) เป็น job เดียว
+    ไฟล์ที่มีเนื้อหาเหมือนไฟล์ที่เคย ingest เข้าห้องนี้แล้วจะถูกข้าม"""
+    room_dir = ensure_room_dirs(project_id, room_id)
+    ex = _Extractor(room_dir)
+    for file in files:
+        name = os.path.basename(file.filename or "")
+        lower = name.lower()
+        try:
+            if lower.endswith(ARCHIVE_EXT):
+                await asyncio.to_thread(ex.extract, file.file, lower)
+            elif os.path.splitext(lower)[1] in ALLOWED_EXT:
+                save_path = os.path.join(room_dir, name)
+                await save_upload(file, save_path)
+                ex.saved.append(save_path)
+            else:
+                ex.rejected.append(name)
+        except (zipfile.BadZipFile, tarfile.TarError) as e:
+            raise HTTPException(400, f"Cannot read archive {name}: {e}")
+        except ValueError as e:
+            raise HTTPException(413, f"{name}: {e}")
+        except OSError as e:
+            raise HTTPException(500, f"Cannot save file {name}: {e}")
+    if not ex.saved:
+        raise HTTPException(400, "No supported files in upload")
+
+    # ไฟล์เดียวกันอาจถูกส่งซ้ำใน request เดียว: ใส่ job แค่ครั้งเดียว
+    saved = list(dict.fromkeys(ex.saved))
+    job = ingest_jobs.submit(project_id, room_id, saved, manifest_path(project_id, room_id), skip_known=True)
+    return BulkIngestResp(job_id=job.id, room_id=room_id, files=len(saved), rejected=ex.rejected, status=job.status)
+
+@router.get("/jobs/{job_id}", response_model=IngestJobStatus)
+async def job_status(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(404, f"Ingest job not found: {job_id}")
+    return IngestJobStatus(**job.to_dict())
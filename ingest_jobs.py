@@ -0,0 +1,342 @@
+# ingest_jobs.py
+"""
+Background ingestion jobs สำหรับ /ingest/*
+
+endpoint แค่บันทึกไฟล์ลงดิสก์แล้วสร้าง job คืน job_id ทันที งาน chunk/embed/upsert
+ทำใน background task:
+
+- อ่านและแบ่ง chunk หลายไฟล์พร้อมกันใน threadpool (INGEST_CHUNK_WORKERS)
+- chunk จากทุกไฟล์ของ job ถูกรวมเป็น batch เดียวกัน (INGEST_EMBED_BATCH) แล้ว embed ผ่าน
+  embedding_store พร้อมกันไม่เกิน INGEST_CONCURRENCY batch ต่อ job
+- job ที่ทำพร้อมกันทั้ง process ไม่เกิน INGEST_MAX_JOBS ที่เหลือรอในสถานะ queued
+- point id = uuid5(project/room, ชื่อไฟล์, ลำดับ chunk, hash ของเนื้อหา) ไม่ชนกันระหว่างไฟล์/upload
+  และอัปโหลดไฟล์เดิมซ้ำจะเขียนทับ point เดิม
+- ไฟล์ที่ ingest สำเร็จถูกบันทึก hash ไว้ใน manifest ของห้อง job แบบ bulk จะข้ามไฟล์ที่มี hash
+  อยู่แล้ว (และไฟล์ที่ซ้ำกันใน job เดียวกัน)
+
+สถานะ job เก็บในหน่วยความจำ (INGEST_JOBS_KEEP job ล่าสุดที่จบแล้ว) หายเมื่อ restart
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from embedding_store import embedding_store
+from http_clients import pools
+from vector_store import vector_store
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "demo_rag"
+VECTOR_SIZE = 1024   # bge-m3
+
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "16"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))     # batch ที่ embed/upsert พร้อมกันต่อ job
+INGEST_CHUNK_WORKERS = int(os.getenv("INGEST_CHUNK_WORKERS", "4"))  # ไฟล์ที่อ่าน/แบ่ง chunk พร้อมกันต่อ job
+INGEST_MAX_JOBS = int(os.getenv("INGEST_MAX_JOBS", "2"))           # job ที่ทำงานพร้อมกันทั้ง process
+INGEST_JOBS_KEEP = int(os.getenv("INGEST_JOBS_KEEP", "500"))       # job ที่จบแล้วที่ยังดูสถานะได้
+
+CHUNK_CHARS = 1000
+CHUNK_OVERLAP = 100
+EMBED_CHARS = 4000
+
+# namespace คงที่สำหรับ uuid5 ของ point (ห้ามเปลี่ยน ไม่งั้น id เดิมจะไม่ตรง)
+POINT_NAMESPACE = uuid.UUID("0c5f3f0e-8d0a-4b8e-a7d2-6e1b9c4f2a31")
+
+def chunk_text(s: str, n: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> Iterator[str]:
+    i = 0
+    L = len(s)
+    while i < L:
+        yield s[i:i+n]
+        i += max(1, n-overlap)
+
+def prepare_file(path: str) -> Tuple[str, List[Tuple[int, str]]]:
+    """อ่านไฟล์ คืน (sha1 ของเนื้อหา, [(chunk_index, snippet)]) รันใน threadpool"""
+    with open(path, "rb") as f:
+        data = f.read()
+    chunks = []
+    for ci, ck in enumerate(chunk_text(data.decode("utf-8", errors="ignore"))):
+        snippet = ck.strip()
+        if snippet:
+            chunks.append((ci, snippet))
+    return hashlib.sha1(data).hexdigest(), chunks
+
+# ---- Manifest ของห้อง: hash ของไฟล์ที่ ingest สำเร็จแล้ว ----
+def load_manifest(path: str) -> Dict[str, dict]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        files = data.get("files")
+        return files if isinstance(files, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.error(f"Cannot read ingest manifest {path}: {e}")
+        return {}
+
+def save_manifest(path: str, files: Dict[str, dict]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+def merge_manifest(path: str, ingested: Dict[str, dict]) -> None:
+    """อ่านใหม่แล้วรวม (job อื่นของห้องเดียวกันอาจบันทึกไปแล้ว)"""
+    files = load_manifest(path)
+    files.update(ingested)
+    save_manifest(path, files)
+
+def point_id(project_id: str, room_id: str, file_path: str, chunk_index: int, snippet: str) -> str:
+    digest = hashlib.sha1(snippet.encode("utf-8", "ignore")).hexdigest()
+    return str(uuid.uuid5(POINT_NAMESPACE, f"{project_id}/{room_id}:{file_path}:{chunk_index}:{digest}"))
+
+# chunk ที่รอ embed: (file_path, chunk_index, snippet)
+Chunk = Tuple[str, int, str]
+
+class _FileState:
+    def __init__(self, sha1: str, left: int):
+        self.sha1 = sha1
+        self.chunks = left
+        self.left = left        # chunk ที่ยังไม่ได้ผล embed/upsert
+        self.failed = False
+
+class IngestJob:
+    def __init__(self, project_id: str, room_id: str, files: List[str], manifest_path: str, skip_known: bool = False):
+        self.id = uuid.uuid4().hex
+        self.project_id = project_id
+        self.room_id = room_id
+        self.files = files
+        self.manifest_path = manifest_path
+        self.skip_known = skip_known
+        self.status = "queued"      # queued | running | done | failed
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.files_done = 0
+        self.files_skipped = 0     # เนื้อหาเคย ingest เข้าห้องนี้แล้ว
+        self.files_failed = 0
+        self.chunks = 0
+        self.embedded = 0
+        self.upserted = 0
+        self.failed = 0
+        self.counts: Dict[str, int] = {}   # requested/hits/shared/embedded ของ embedding store
+        self.ingested: Dict[str, dict] = {}  # sha1 -> ไฟล์ที่ ingest สำเร็จใน job นี้
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "project_id": self.project_id,
+            "room_id": self.room_id,
+            "status": self.status,
+            "error": self.error,
+            "files": len(self.files),
+            "files_done": self.files_done,
+            "files_skipped": self.files_skipped,
+            "files_failed": self.files_failed,
+            "chunks": self.chunks,
+            "embedded": self.embedded,
+            "upserted": self.upserted,
+            "failed": self.failed,
+            "dedup_saved": self.counts.get("hits", 0) + self.counts.get("shared", 0),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class IngestJobs:
+    def __init__(self, max_jobs: int = INGEST_MAX_JOBS, keep: int = INGEST_JOBS_KEEP):
+        self.keep = keep
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._max_jobs = max(1, max_jobs)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._collection_ready = False
+
+    # ---- public ----
+    def submit(self, project_id: str, room_id: str, files: List[str], manifest_path: str, skip_known: bool = False) -> IngestJob:
+        job = IngestJob(project_id, room_id, files, manifest_path, skip_known)
+        self._jobs[job.id] = job
+        self._trim()
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    async def stop(self) -> None:
+        """ยกเลิก job ที่ยังไม่จบ (ใช้ตอน shutdown)"""
+        tasks = [j.task for j in self._jobs.values() if j.task is not None and not j.task.done()]
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        by_status: Dict[str, int] = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+        for j in self._jobs.values():
+            by_status[j.status] = by_status.get(j.status, 0) + 1
+        return by_status
+
+    # ---- internals ----
+    def _trim(self) -> None:
+        finished = [k for k, j in self._jobs.items() if j.status in ("done", "failed")]
+        for k in finished[:max(0, len(finished) - self.keep)]:
+            self._jobs.pop(k, None)
+
+    def _room_lock(self, manifest_path: str) -> asyncio.Lock:
+        lock = self._locks.get(manifest_path)
+        if lock is None:
+            lock = self._locks[manifest_path] = asyncio.Lock()
+        return lock
+
+    async def _run(self, job: IngestJob) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_jobs)
+        try:
+            async with self._slots:
+                job.status = "running"
+                job.started_at = time.time()
+                if not self._collection_ready:
+                    await vector_store.ensure_collection(COLLECTION, VECTOR_SIZE)
+                    self._collection_ready = True
+                await self._ingest(job)
+            job.status = "failed" if job.failed and not job.upserted else "done"
+        except asyncio.CancelledError:
+            job.status, job.error = "failed", "cancelled"
+            raise
+        except Exception as e:
+            logger.error(f"Ingest job {job.id} failed: {e}")
+            job.status, job.error = "failed", str(e)
+        finally:
+            if job.ingested:
+                try:
+                    async with self._room_lock(job.manifest_path):
+                        await asyncio.to_thread(merge_manifest, job.manifest_path, job.ingested)
+                except Exception as e:
+                    logger.error(f"Ingest job {job.id}: cannot save manifest: {e}")
+            job.finished_at = time.time()
+            self._trim()
+
+    async def _ingest(self, job: IngestJob) -> None:
+        known: Dict[str, dict] = {}
+        if job.skip_known:
+            known = await asyncio.to_thread(load_manifest, job.manifest_path)
+        states: Dict[str, _FileState] = {}
+        file_q: asyncio.Queue = asyncio.Queue()
+        for path in job.files:
+            file_q.put_nowait(path)
+        chunk_q: asyncio.Queue = asyncio.Queue(INGEST_EMBED_BATCH * max(1, INGEST_CONCURRENCY) * 2)
+
+        async def reader() -> None:
+            while not file_q.empty():
+                path = file_q.get_nowait()
+                try:
+                    sha1, chunks = await asyncio.to_thread(prepare_file, path)
+                except OSError as e:
+                    logger.error(f"Ingest job {job.id}: cannot read {path}: {e}")
+                    job.files_failed += 1
+                    job.files_done += 1
+                    continue
+                if job.skip_known and (sha1 in known or any(st.sha1 == sha1 for st in states.values())):
+                    job.files_skipped += 1
+                    job.files_done += 1
+                    continue
+                st = states[path] = _FileState(sha1, len(chunks))
+                if not chunks:
+                    self._file_done(job, path, st)
+                    continue
+                for ci, snippet in chunks:
+                    job.chunks += 1
+                    await chunk_q.put((path, ci, snippet))
+
+        async def close_when_read(readers: List[asyncio.Task]) -> None:
+            await asyncio.gather(*readers)
+            await chunk_q.put(None)
+
+        sem = asyncio.Semaphore(max(1, INGEST_CONCURRENCY))
+        tasks: set = set()
+
+        async def submit(batch: List[Chunk]) -> None:
+            await sem.acquire()   # bounded: reader จะหยุดรอเมื่อคิว chunk เต็ม
+            t = asyncio.create_task(self._process(job, batch, states))
+            tasks.add(t)
+            t.add_done_callback(lambda t: (tasks.discard(t), sem.release()))
+
+        readers = [asyncio.create_task(reader()) for _ in range(max(1, INGEST_CHUNK_WORKERS))]
+        closer = asyncio.create_task(close_when_read(readers))
+        try:
+            batch: List[Chunk] = []
+            while True:
+                item = await chunk_q.get()
+                if item is None:
+                    break
+                batch.append(item)
+                if len(batch) >= INGEST_EMBED_BATCH:
+                    await submit(batch)
+                    batch = []
+            if batch:
+                await submit(batch)
+            await closer   # ส่ง exception ของ reader (ถ้ามี) ออกมา
+            if tasks:
+                await asyncio.gather(*list(tasks))
+        finally:
+            for t in readers + [closer] + list(tasks):
+                t.cancel()
+
+    def _file_done(self, job: IngestJob, path: str, st: _FileState) -> None:
+        job.files_done += 1
+        if st.failed:
+            job.files_failed += 1
+        else:
+            job.ingested[st.sha1] = {"path": path, "chunks": st.chunks, "ingested_at": int(time.time())}
+
+    def _settle(self, job: IngestJob, batch: List[Chunk], states: Dict[str, _FileState], ok: bool) -> None:
+        for path, _, _ in batch:
+            st = states[path]
+            st.failed = st.failed or not ok
+            st.left -= 1
+            if st.left == 0:
+                self._file_done(job, path, st)
+
+    async def _process(self, job: IngestJob, batch: List[Chunk], states: Dict[str, _FileState]) -> None:
+        try:
+            embs = await embedding_store.embed_many(pools.ollama, [s[:EMBED_CHARS] for _, _, s in batch], counts=job.counts)
+        except Exception as e:
+            logger.error(f"Ingest job {job.id}: embedding error: {e}")
+            job.failed += len(batch)
+            self._settle(job, batch, states, False)
+            return
+        job.embedded += len(batch)
+        created_at = int(job.created_at)
+        points = [{
+            "id": point_id(job.project_id, job.room_id, path, ci, snippet),
+            "vector": emb,
+            "payload": {
+                "project_id": job.project_id,
+                "room_id": job.room_id,
+                "source_type": "file",
+                "file_path": path,
+                "created_at": created_at,
+                "chunk_index": ci,
+                "preview": snippet[:220],
+            },
+        } for (path, ci, snippet), emb in zip(batch, embs)]
+        try:
+            await vector_store.upsert(COLLECTION, points)
+        except Exception as e:
+            logger.error(f"Ingest job {job.id}: {e}")
+            job.failed += len(batch)
+            self._settle(job, batch, states, False)
+            return
+        job.upserted += len(points)
+        self._settle(job, batch, states, True)
+
+ingest_jobs = IngestJobs()
@@ -0,0 +1,331 @@
+# lexical_index.py
+"""
+Lexical (BM25) index ของ code_rag ที่ทำงานใน process ไม่ต้องเรียก Qdrant/Ollama
+
+- tokenize: แยก identifier ตาม snake_case/camelCase เก็บทั้งคำเต็ม (ตัวเล็ก) และส่วนย่อย
+  เช่น `validateTokenForWs` -> validatetokenforws, validate, token, for, ws
+- LexicalSource: ตาราง SQLite (path -> chunk, payload, term counts) ที่ index_repo.py อัปเดต
+  เฉพาะไฟล์ที่เปลี่ยน แล้วเขียน index ใหม่ทั้งไฟล์ตอนจบรอบ
+- LexicalIndex: อ่านไฟล์ .lex แบบ mmap (posting list, ความยาวเอกสาร, payload) โหลดเข้า
+  หน่วยความจำแค่ lexicon และโหลดใหม่เองเมื่อไฟล์ถูกเขียนทับ
+- rrf_fuse: รวมผลหลายรายการด้วย reciprocal rank fusion
+
+รูปแบบไฟล์ .lex: MAGIC, ความยาว header (uint64), header JSON แล้วตามด้วย section
+lexicon (JSON term -> [df, ตำแหน่ง posting]), postings (uint32 คู่ doc/tf),
+doclen (uint32), docoff (uint64) และ docs (payload JSON ต่อกัน)
+"""
+import os
+import re
+import json
+import math
+import mmap
+import time
+import array
+import heapq
+import struct
+import sqlite3
+import hashlib
+import logging
+import operator
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from vector_store import store_location
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+LEXICAL_DIR = os.path.expanduser(os.getenv("INDEX_MANIFEST_DIR", "~/private-ai/index"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+MAGIC = b"LEXIDX1\n"
+FORMAT_VERSION = 1
+
+# ---- Tokenizer ----
+_WORD = re.compile(r"\w+", re.UNICODE)
+_PART = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+|[^\W\d_A-Za-z]+")
+
+def tokenize(text: str) -> List[str]:
+    out: List[str] = []
+    for word in _WORD.findall(text or ""):
+        low = word.lower()
+        out.append(low)
+        parts = _PART.findall(word)
+        if len(parts) > 1:
+            out.extend(p.lower() for p in parts if len(p) > 1)
+    return out
+
+_SYMBOL = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:(?:\.|::)[A-Za-z_][A-Za-z0-9_]*)*(?:\(\))?")
+
+def is_symbol_query(query: str) -> bool:
+    """query เป็นชื่อ symbol ล้วนๆ (เช่น `validate_token_for_ws`, Foo.bar, getUser())
+    คำธรรมดาคำเดียวอย่าง "token" ไม่นับ เพราะอาจเป็นคำถามเชิงความหมาย"""
+    q = (query or "").strip()
+    quoted = len(q) > 2 and q[0] == q[-1] == "`"
+    q = q.strip("`").strip()
+    if not q or not _SYMBOL.fullmatch(q):
+        return False
+    return quoted or any(c in q for c in "_.:(") or any(c.isupper() for c in q[1:])
+
+def index_path(repo_root: str, location: str, collection: str) -> str:
+    """ไฟล์ .lex ของ (repo, vector store, collection) ใช้ key เดียวกับ manifest ของ index_repo.py"""
+    key = hashlib.sha1(f"{repo_root}|{location}|{collection}".encode()).hexdigest()[:16]
+    return os.path.join(LEXICAL_DIR, f"{collection}-{key}.lex")
+
+# ---- Writer side (index_repo.py) ----
+class LexicalSource:
+    """เก็บ term counts ของทุก chunk แยกตามไฟล์ เพื่อให้รอบ incremental สร้าง index ใหม่
+    ได้โดยไม่ต้องอ่านไฟล์ที่ไม่เปลี่ยนซ้ำ"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            " pid TEXT PRIMARY KEY, path TEXT NOT NULL, payload TEXT NOT NULL,"
+            " terms TEXT NOT NULL, len INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_path ON docs(path)")
+        self._conn.commit()
+
+    def paths(self) -> set:
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT DISTINCT path FROM docs")}
+
+    def put_file(self, rel: str, docs: List[Tuple[str, dict, str]]) -> None:
+        """แทนที่ chunk ทั้งหมดของไฟล์ docs = [(point_id, payload, text)]"""
+        rows = []
+        for pid, payload, text in docs:
+            terms = Counter(tokenize(text))
+            rows.append((pid, rel, json.dumps(payload, ensure_ascii=False), json.dumps(terms, ensure_ascii=False), sum(terms.values())))
+        with self._lock:
+            self._conn.execute("DELETE FROM docs WHERE path = ?", (rel,))
+            self._conn.executemany("INSERT OR REPLACE INTO docs (pid, path, payload, terms, len) VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def remove_files(self, rels: Iterable[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM docs WHERE path = ?", [(r,) for r in rels])
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def write_index(self, out_path: str, meta: Optional[dict] = None) -> Tuple[int, int]:
+        """เขียนไฟล์ .lex ใหม่ทั้งไฟล์ (tmp แล้ว os.replace) คืน (จำนวนเอกสาร, จำนวน term)"""
+        postings: Dict[str, array.array] = {}
+        doclen = array.array("I")
+        docoff = array.array("Q", [0])
+        docs = bytearray()
+        with self._lock:
+            rows = self._conn.execute("SELECT pid, payload, terms, len FROM docs ORDER BY path, rowid")
+            for idx, (pid, payload, terms, n) in enumerate(rows):
+                for term, tf in json.loads(terms).items():
+                    p = postings.get(term)
+                    if p is None:
+                        p = postings[term] = array.array("I")
+                    p.append(idx)
+                    p.append(min(tf, 0xFFFFFFFF))
+                doclen.append(n)
+                docs += json.dumps({"id": pid, "payload": json.loads(payload)}, ensure_ascii=False).encode("utf-8")
+                docoff.append(len(docs))
+
+        lexicon: Dict[str, List[int]] = {}
+        flat = array.array("I")
+        for term in sorted(postings):
+            p = postings[term]
+            lexicon[term] = [len(p) // 2, len(flat) // 2]
+            flat.extend(p)
+        n_docs = len(doclen)
+        sections = [
+            ("lexicon", json.dumps(lexicon, ensure_ascii=False).encode("utf-8")),
+            ("postings", flat.tobytes()),
+            ("doclen", doclen.tobytes()),
+            ("docoff", docoff.tobytes()),
+            ("docs", bytes(docs)),
+        ]
+        header = {
+            "version": FORMAT_VERSION,
+            "docs": n_docs,
+            "terms": len(lexicon),
+            "avgdl": (sum(doclen) / n_docs) if n_docs else 0.0,
+            "built_at": int(time.time()),
+            **(meta or {}),
+        }
+
+        # คำนวณ offset ของแต่ละ section (จัดให้ลงตัว 8 byte)
+        def align(n: int) -> int:
+            return (n + 7) & ~7
+
+        layout, pos = {}, 0
+        for name, blob in sections:
+            layout[name] = [pos, len(blob)]
+            pos = align(pos + len(blob))
+        header["sections"] = layout
+        head = json.dumps(header).encode("utf-8")
+        base = align(len(MAGIC) + 8 + len(head))
+
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp = out_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(head)))
+            f.write(head)
+            f.write(b"\0" * (base - f.tell()))
+            for name, blob in sections:
+                f.write(b"\0" * (base + layout[name][0] - f.tell()))
+                f.write(blob)
+        os.replace(tmp, out_path)
+        return n_docs, len(lexicon)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+# ---- Reader side (code_api.py) ----
+class _Segment:
+    """ไฟล์ .lex หนึ่งไฟล์ที่ mmap ไว้ (ไม่ปิดเอง ปล่อยให้ GC ปิดเมื่อไม่มีใครถืออยู่)"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"not a lexical index: {path}")
+        (hlen,) = struct.unpack_from("<Q", self.mm, len(MAGIC))
+        start = len(MAGIC) + 8
+        self.header = json.loads(self.mm[start:start + hlen])
+        base = (start + hlen + 7) & ~7
+        view = memoryview(self.mm)
+
+        def section(name: str) -> memoryview:
+            off, n = self.header["sections"][name]
+            return view[base + off: base + off + n]
+
+        self.lexicon: Dict[str, List[int]] = json.loads(bytes(section("lexicon")))
+        self.postings = section("postings").cast("I")
+        self.doclen = section("doclen").cast("I")
+        self.docoff = section("docoff").cast("Q")
+        self.docs = section("docs")
+        self.n_docs = self.header["docs"]
+        self.avgdl = self.header["avgdl"] or 1.0
+
+    def doc(self, idx: int) -> dict:
+        return json.loads(bytes(self.docs[self.docoff[idx]:self.docoff[idx + 1]]))
+
+class LexicalIndex:
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._seg: Optional[_Segment] = None
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.searches = 0
+        self.embeds_skipped = 0   # ผู้เรียกนับ query ที่ตอบจาก index นี้อย่างเดียว
+        self.errors = 0
+
+    def _segment(self) -> Optional[_Segment]:
+        """segment ปัจจุบัน โหลดใหม่ถ้าไฟล์ถูกเขียนทับตั้งแต่ครั้งก่อน"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._seg = None
+            return None
+        seg = self._seg
+        if seg is not None and seg.key == (st.st_ino, st.st_mtime_ns, st.st_size):
+            return seg
+        with self._lock:
+            if self._seg is seg:
+                try:
+                    self._seg = _Segment(self.path)
+                    self.loads += 1
+                    logger.info(f"Lexical index loaded: {self.path} ({self._seg.n_docs} docs, {len(self._seg.lexicon)} terms)")
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"Cannot load lexical index {self.path}: {e}")
+            return self._seg
+
+    def available(self) -> bool:
+        seg = self._segment()
+        return seg is not None and seg.n_docs > 0
+
+    def knows(self, query: str) -> bool:
+        """ทุก identifier ใน query (คำเต็ม ไม่ใช่ส่วนย่อย) มีอยู่ใน index"""
+        seg = self._segment()
+        words = [w.lower() for w in _WORD.findall(query or "")]
+        return seg is not None and bool(words) and all(w in seg.lexicon for w in words)
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        """BM25 top-k คืนรูปแบบเดียวกับผลของ Qdrant: [{"id", "score", "payload"}]"""
+        seg = self._segment()
+        if seg is None or limit <= 0:
+            return []
+        self.searches += 1
+        n, avgdl, k1, b = seg.n_docs, seg.avgdl, self.k1, self.b
+        post, doclen = seg.postings, seg.doclen
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            ent = seg.lexicon.get(term)
+            if ent is None:
+                continue
+            df, start = ent
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for i in range(2 * start, 2 * (start + df), 2):
+                d, tf = post[i], post[i + 1]
+                norm = k1 * (1.0 - b + b * doclen[d] / avgdl)
+                scores[d] = scores.get(d, 0.0) + idf * tf * (k1 + 1.0) / (tf + norm)
+        top = heapq.nlargest(limit, scores.items(), key=operator.itemgetter(1))
+        hits = []
+        for d, score in top:
+            doc = seg.doc(d)
+            hits.append({"id": doc["id"], "score": score, "payload": doc["payload"]})
+        return hits
+
+    def stats(self) -> Dict[str, object]:
+        seg = self._seg
+        return {
+            "path": self.path,
+            "docs": seg.n_docs if seg else 0,
+            "terms": len(seg.lexicon) if seg else 0,
+            "built_at": seg.header.get("built_at") if seg else None,
+            "commit": seg.header.get("commit") if seg else None,
+            "loads": self.loads,
+            "searches": self.searches,
+            "embeds_skipped": self.embeds_skipped,
+            "errors": self.errors,
+        }
+
+# ---- Fusion ----
+def rrf_fuse(result_lists: List[List[dict]], limit: int, k: int = 60) -> List[dict]:
+    """Reciprocal rank fusion: score = sum(1 / (k + rank)) ของทุกรายการที่มี point นั้น
+    payload (และ vector ถ้ามี) ใช้จากรายการแรกที่พบ (ผู้เรียกควรส่งผลจาก Qdrant มาก่อนเพราะสดกว่า)"""
+    fused: Dict[str, dict] = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits, start=1):
+            pid = str(hit.get("id"))
+            entry = fused.get(pid)
+            if entry is None:
+                entry = fused[pid] = {"id": hit.get("id"), "score": 0.0, "payload": hit.get("payload", {})}
+                if "vector" in hit:
+                    entry["vector"] = hit["vector"]
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=operator.itemgetter("score"), reverse=True)[:limit]
+
+# ---- Singleton ของ code_rag (ค่าเดียวกับที่ index_repo.py ใช้) ----
+code_index = LexicalIndex(
+    os.getenv("LEXICAL_INDEX_PATH")
+    or index_path(
+        os.path.abspath(os.getenv("CODE_REPO_DIR", os.getcwd())),
+        store_location(),
+        os.getenv("QDRANT_COLLECTION", "code_rag"),
+    )
+)
@@ -0,0 +1,218 @@
+# llm_scheduler.py
+"""
+ตัวจัดคิวการเรียก LLM (Ollama / OpenAI) ของทั้ง process
+
+- จำกัดจำนวน generation ที่ทำพร้อมกันต่อ provider (LLM_CONCURRENCY_OLLAMA, LLM_CONCURRENCY_OPENAI)
+- คิวแยกตามลำดับความสำคัญ: interactive (WebSocket /ai) > api (HTTP) > batch
+  (HTTP ขอลดเป็น batch ได้ด้วย header "X-LLM-Priority: batch" ขอเพิ่มเป็น interactive ไม่ได้)
+- ภายในลำดับเดียวกันสลับกันทีละคำขอระหว่างผู้ใช้/ห้อง (round-robin) สคริปต์ของคนเดียวจึงไม่กินคิวทั้งหมด
+- admission control: รอในคิวนานเกิน LLM_MAX_QUEUE_WAIT หรือคิวรวมเต็ม -> 503,
+  ผู้ใช้/ห้องเดียวมีคำขอรอเกิน LLM_MAX_QUEUED_PER_KEY -> 429 (ทั้งสองแบบมี Retry-After)
+
+ลำดับความสำคัญและ key ของผู้ใช้อยู่ใน contextvar ที่ตั้งตอนรับคำขอ (middleware ใน main.py,
+WebSocket handler, หรือ endpoint ที่รู้ตัวผู้ใช้) ฟังก์ชันที่เรียก LLM แค่ครอบด้วย slot() / stream()
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+LLM_CONCURRENCY = {
+    "ollama": int(os.getenv("LLM_CONCURRENCY_OLLAMA", "2")),
+    "openai": int(os.getenv("LLM_CONCURRENCY_OPENAI", "8")),
+}
+LLM_MAX_QUEUE_WAIT = float(os.getenv("LLM_MAX_QUEUE_WAIT", "30"))        # วินาที
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))                     # คำขอที่รอได้รวมต่อ provider
+LLM_MAX_QUEUED_PER_KEY = int(os.getenv("LLM_MAX_QUEUED_PER_KEY", "4"))    # คำขอที่รอได้ต่อผู้ใช้/ห้อง
+
+PRIORITIES = ("interactive", "api", "batch")
+INTERACTIVE, API, BATCH = range(3)
+
+# (priority, fairness key) ของคำขอปัจจุบัน
+_request: ContextVar[Tuple[int, str]] = ContextVar("llm_request", default=(API, "anonymous"))
+
+def set_request(priority: Optional[int] = None, key: Optional[str] = None) -> None:
+    """ตั้งลำดับความสำคัญ/key ของคำขอปัจจุบัน (ค่าที่เป็น None คงค่าเดิม)"""
+    cur_priority, cur_key = _request.get()
+    _request.set((cur_priority if priority is None else priority, cur_key if not key else key))
+
+def request_key(user: Optional[str], room: Optional[str]) -> Optional[str]:
+    if not user and not room:
+        return None
+    return f"{user or '-'}@{room or '-'}"
+
+class _Waiter:
+    __slots__ = ("fut", "key", "priority", "t0")
+
+    def __init__(self, fut: asyncio.Future, key: str, priority: int):
+        self.fut = fut
+        self.key = key
+        self.priority = priority
+        self.t0 = time.monotonic()
+
+class _Lane:
+    """สถานะของ provider หนึ่งตัว"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.running = 0
+        # ต่อ priority: key -> คิวของ key นั้น (ลำดับของ dict = ลำดับ round-robin)
+        self.queues: List["OrderedDict[str, Deque[_Waiter]]"] = [OrderedDict() for _ in PRIORITIES]
+        self.queued = 0
+        self.peak_queued = 0
+        self.admitted = [0] * len(PRIORITIES)
+        self.wait_seconds = [0.0] * len(PRIORITIES)
+        self.max_wait = [0.0] * len(PRIORITIES)
+        self.rejected = {"queue_full": 0, "per_key": 0, "wait_timeout": 0}
+
+    def queued_for(self, key: str) -> int:
+        return sum(len(q.get(key, ())) for q in self.queues)
+
+    def push(self, w: _Waiter) -> None:
+        self.queues[w.priority].setdefault(w.key, deque()).append(w)
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+
+    def remove(self, w: _Waiter) -> bool:
+        q = self.queues[w.priority]
+        dq = q.get(w.key)
+        if dq is None or w not in dq:
+            return False
+        dq.remove(w)
+        if not dq:
+            del q[w.key]
+        self.queued -= 1
+        return True
+
+    def pop(self) -> Optional[_Waiter]:
+        for q in self.queues:
+            if not q:
+                continue
+            key, dq = next(iter(q.items()))
+            w = dq.popleft()
+            if dq:
+                q.move_to_end(key)   # key นี้ไปต่อท้าย ให้ key อื่นได้ก่อน
+            else:
+                del q[key]
+            self.queued -= 1
+            return w
+        return None
+
+    def admit(self, priority: int, waited: float) -> None:
+        self.admitted[priority] += 1
+        self.wait_seconds[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def stats(self) -> Dict[str, object]:
+        classes = {}
+        for i, name in enumerate(PRIORITIES):
+            n = self.admitted[i]
+            classes[name] = {
+                "queued": sum(len(dq) for dq in self.queues[i].values()),
+                "admitted": n,
+                "avg_wait_ms": round(1000 * self.wait_seconds[i] / n, 1) if n else 0.0,
+                "max_wait_ms": round(1000 * self.max_wait[i], 1),
+            }
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "rejected": dict(self.rejected),
+            "classes": classes,
+        }
+
+class LLMScheduler:
+    def __init__(self, limits: Dict[str, int] = LLM_CONCURRENCY, max_wait: float = LLM_MAX_QUEUE_WAIT,
+                 max_queue: int = LLM_MAX_QUEUE, max_per_key: int = LLM_MAX_QUEUED_PER_KEY):
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.max_per_key = max_per_key
+        self._lanes = {name: _Lane(name, n) for name, n in limits.items()}
+
+    def _lane(self, provider: str) -> _Lane:
+        lane = self._lanes.get(provider)
+        if lane is None:
+            lane = self._lanes[provider] = _Lane(provider, LLM_CONCURRENCY.get(provider, 4))
+        return lane
+
+    def _reject(self, lane: _Lane, reason: str, status: int, detail: str) -> HTTPException:
+        lane.rejected[reason] += 1
+        logger.warning(f"LLM scheduler ({lane.name}) rejected request: {detail}")
+        return HTTPException(status, detail, headers={"Retry-After": str(max(1, int(self.max_wait // 2)))})
+
+    async def acquire(self, provider: str) -> None:
+        lane = self._lane(provider)
+        priority, key = _request.get()
+        if lane.running < lane.limit and lane.queued == 0:
+            lane.running += 1
+            lane.admit(priority, 0.0)
+            return
+        if lane.queued >= self.max_queue:
+            raise self._reject(lane, "queue_full", 503, f"{provider} is busy ({lane.queued} requests queued), try again later")
+        if lane.queued_for(key) >= self.max_per_key:
+            raise self._reject(lane, "per_key", 429, f"Too many queued {provider} requests for {key}")
+
+        w = _Waiter(asyncio.get_running_loop().create_future(), key, priority)
+        lane.push(w)
+        try:
+            await asyncio.wait_for(w.fut, self.max_wait)
+        except asyncio.TimeoutError:
+            if not lane.remove(w) and w.fut.done() and not w.fut.cancelled():
+                self.release(provider)
+            raise self._reject(lane, "wait_timeout", 503, f"{provider} queue wait exceeded {self.max_wait:g}s, try again later")
+        except asyncio.CancelledError:
+            if w.fut.done() and not w.fut.cancelled():
+                self.release(provider)    # ได้ slot มาพอดีตอนถูกยกเลิก: คืนให้คนถัดไป
+            else:
+                lane.remove(w)
+            raise
+        # slot ถูกโอนมาจาก release() (running ไม่ได้ลดลง)
+        lane.admit(priority, time.monotonic() - w.t0)
+
+    def release(self, provider: str) -> None:
+        lane = self._lane(provider)
+        while True:
+            w = lane.pop()
+            if w is None:
+                lane.running -= 1
+                return
+            if not w.fut.done():
+                w.fut.set_result(None)
+                return
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        await self.acquire(provider)
+        try:
+            yield
+        finally:
+            self.release(provider)
+
+    async def stream(self, provider: str, pieces: AsyncIterator[str]) -> AsyncIterator[str]:
+        """ถือ slot ตลอดการ stream (เริ่มรอคิวเมื่อเริ่มอ่านชิ้นแรก)"""
+        try:
+            async with self.slot(provider):
+                async for piece in pieces:
+                    yield piece
+        finally:
+            await pieces.aclose()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "max_queue_wait_s": self.max_wait,
+            "max_queue": self.max_queue,
+            "max_queued_per_key": self.max_per_key,
+            "providers": {name: lane.stats() for name, lane in self._lanes.items()},
+        }
+
+llm_scheduler = LLMScheduler()
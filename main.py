@@ -1,32 +1,56 @@
 import os # dotenv ถูกโหลดแล้วใน database.py
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query, Depends
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect, Query, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from typing import Annotated
+from contextlib import asynccontextmanager
 from websocket_manager import ConnectionManager
-from code_api import CodeAnswerReq # เพิ่มการ import
-import httpx # เพิ่มการ import
+from code_api import CodeAnswerReq, code_answer_events
+from http_clients import HttpClients, get_clients, pools
+from embeddings import query_cache
+from embedding_store import embedding_store
+from embed_batcher import batcher_stats
+from history_writer import history_writer
+from history_appender import history_appender
+from history_store import history_store
+from conversation_indexer import conversation_indexer
+from ingest_jobs import ingest_jobs
+from answer_cache import answer_cache
+from single_flight import answer_flights
+from lexical_index import code_index
+from vector_store import vector_store
+from context_packer import context_packer
+from llm_scheduler import API, BATCH, INTERACTIVE, llm_scheduler, set_request
 import logging
+import time
+import uuid
 from auth_api import validate_token_for_ws # เปลี่ยนมาใช้ฟังก์ชันใหม่
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Private AI Backend", version="0.1.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # เปิด HTTP pools ครั้งเดียวตลอดอายุของแอป แล้วปิดตอน shutdown
+    await pools.start()
+    await history_writer.start()
+    await conversation_indexer.start()
+    try:
+        yield
+    finally:
+        await history_writer.stop()
+        await conversation_indexer.stop()   # ข้อความที่ยังไม่ได้ index ค้างอยู่ในคิวบนดิสก์
+        await ingest_jobs.stop()
+        history_store.close()
+        await pools.aclose()
 
-manager = ConnectionManager()
+app = FastAPI(title="Private AI Backend", version="0.1.0", lifespan=lifespan)
 
-# --- Dependency Injection for HTTP Client ---
-async def get_http_client() -> httpx.AsyncClient:
-    """
-    Dependency to create and yield a single httpx.AsyncClient instance per request.
-    This is more efficient than creating a new client for every call.
-    """
-    async with httpx.AsyncClient() as client:
-        yield client
+manager = ConnectionManager()
 
-BASE_URL = os.getenv("BACKEND_BASE_URL", "http://127.0.0.1:8081")
+# รวม token ที่ stream มาแล้วส่ง chat_delta ไม่ถี่กว่าช่วงนี้ (มิลลิวินาที)
+WS_DELTA_INTERVAL_MS = float(os.getenv("WS_DELTA_INTERVAL_MS", "50"))
 
 # --- CORS for frontend dev ---
 app.add_middleware(
@@ -41,6 +65,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+
+@app.middleware("http")
+async def llm_priority(request: Request, call_next):
+    # คำขอ HTTP ได้ priority "api" ขอลดเป็น "batch" ได้ด้วย X-LLM-Priority (เพิ่มไม่ได้)
+    # คิวแยกตาม client; endpoint ที่รู้ตัวผู้ใช้/ห้อง (เช่น /chat/generate) ตั้ง key ละเอียดกว่านี้เอง
+    priority = BATCH if request.headers.get("x-llm-priority", "").strip().lower() == "batch" else API
+    set_request(priority, request.client.host if request.client else None)
+    return await call_next(request)
+
 from history_api import router as history_router
 app.include_router(history_router)
 
@@ -60,12 +93,51 @@ app.include_router(rag_router)
 def health():
     return JSONResponse({"status":"ok","service":"private-ai-backend"})
 
+@app.get("/metrics")
+def metrics():
+    return JSONResponse({
+        "http_pools": pools.stats(),
+        "embedding_cache": query_cache.stats(),
+        "embedding_batchers": batcher_stats(),
+        "embedding_store": embedding_store.stats(),
+        "history_writer": history_writer.stats(),
+        "history_appender": history_appender.stats(),
+        "history_store": history_store.stats(),
+        "conversation_indexer": conversation_indexer.stats(),
+        "ingest_jobs": ingest_jobs.stats(),
+        "answer_cache": answer_cache.stats(),
+        "answer_coalescing": answer_flights.stats(),
+        "lexical_index": code_index.stats(),
+        "vector_store": vector_store.stats(),
+        "search_cache": vector_store.cache.stats(),
+        "context_packer": context_packer.stats(),
+        "llm_scheduler": llm_scheduler.stats(),
+    })
+
 from code_api import router as code_router
 app.include_router(code_router)
 
 from auth_api import router as auth_router
 app.include_router(auth_router)
 
+async def stream_ai_answer(full_room_id: str, stream_id: str, ai_req: CodeAnswerReq, clients: HttpClients) -> dict:
+    """Stream คำตอบของ /code/answer เป็น chat_delta ให้ทั้งห้อง แล้วคืนผลลัพธ์สุดท้าย"""
+    interval = WS_DELTA_INTERVAL_MS / 1000.0
+    buf = ""
+    last_sent = time.monotonic()
+    result: dict = {}
+    async for ev in code_answer_events(ai_req, clients):
+        if ev["type"] == "delta":
+            buf += ev["text"]
+            if time.monotonic() - last_sent >= interval:
+                await manager.broadcast_delta(full_room_id, stream_id, "AI", buf)
+                buf, last_sent = "", time.monotonic()
+        elif ev["type"] == "done":
+            result = {"answer": ev["answer"], "sources": ev["sources"], "cached": ev.get("cached", False)}
+    if buf:
+        await manager.broadcast_delta(full_room_id, stream_id, "AI", buf)
+    return result
+
 @app.websocket("/ws/{project_id}/{room_id}/{username}")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -73,7 +145,7 @@ async def websocket_endpoint(
     room_id: str,
     username: str, # รับ username จาก path โดยตรง
     token: str | None = Query(None), # เปลี่ยนเป็น Optional
-    client: httpx.AsyncClient = Depends(get_http_client)
+    clients: HttpClients = Depends(get_clients)
 ):
     if not token:
         logger.warning(f"WebSocket connection for user '{username}' rejected. Reason: Missing token")
@@ -90,6 +162,8 @@ async def websocket_endpoint(
     # ใช้ project_id และ room_id ประกอบกันเป็น key ของห้อง
     full_room_id = f"{project_id}:{room_id}"
     await manager.connect(websocket, full_room_id)
+    # /ai จากห้องแชทมาก่อนคำขอ HTTP ในคิว LLM, คิวแยกตามผู้ใช้ในห้อง
+    set_request(INTERACTIVE, f"{username}@{full_room_id}")
     
     # ประกาศให้ทุกคนในห้องรู้ว่ามีคนเข้ามาใหม่
     await manager.broadcast(full_room_id, {"type": "system", "username": username, "message": "joined the room"})
@@ -108,44 +182,38 @@ async def websocket_endpoint(
             if message_text.startswith("/ai "):
                 # แสดงคำถามของผู้ใช้ในห้องแชทก่อน
                 await manager.broadcast(full_room_id, {"type": "chat", "username": username, "message": message_text})
-                # บันทึกคำถามของผู้ใช้ลงในประวัติ
+                # บันทึกคำถามของผู้ใช้ลงในประวัติ (เข้าคิว ไม่รอ disk)
                 try:
-                    # ส่ง rag_controls ไปกับ log ด้วย
-                    await client.post(
-                        f"{BASE_URL}/rooms/{room_id}/messages",
-                        params={"project_id": project_id},
-                        json={"role": "user", "content": message_text, "username": username}
-                    )
+                    history_writer.log(project_id, room_id, "user", message_text, username=username)
                 except Exception as log_e:
                     logger.error(f"Failed to log user /ai command for room '{full_room_id}': {log_e}")
 
                 
+                stream_id = uuid.uuid4().hex
                 try:
                     query = message_text[len("/ai "):]
-                    # เรียกใช้ /code/answer ภายใน
+                    # เรียก /code/answer ภายใน process แบบ streaming
                     ai_req = CodeAnswerReq(
                         query=query, 
                         provider="local", # ใช้โมเดล local เป็นค่าเริ่มต้น
                         limit=limit,
                         # score_threshold ยังไม่ได้ถูกใช้ใน CodeAnswerReq แต่เราส่งไปเผื่ออนาคต
                     )
-                    response = await client.post(f"{BASE_URL}/code/answer", json=ai_req.dict(), timeout=120.0)
-                    response.raise_for_status()
-                    ai_response = response.json()
+                    ai_response = await stream_ai_answer(full_room_id, stream_id, ai_req, clients)
                     
-                    answer_message = ai_response.get('answer', 'ขออภัยครับ ไม่สามารถสร้างคำตอบได้')
-                    await manager.broadcast(full_room_id, {"type": "chat", "username": "AI", "message": answer_message})
+                    answer_message = ai_response.get('answer') or 'ขออภัยครับ ไม่สามารถสร้างคำตอบได้'
+                    await manager.broadcast(full_room_id, {"type": "chat", "username": "AI", "message": answer_message, "stream_id": stream_id})
                     
                     try:
-                        await client.post(f"{BASE_URL}/rooms/{room_id}/messages", params={"project_id": project_id}, json={"role":"assistant", "content": answer_message, "username": "AI", "meta": ai_response})
+                        history_writer.log(project_id, room_id, "assistant", answer_message, username="AI", meta=ai_response)
                     except Exception as log_e:
                         logger.error(f"Failed to log AI response: {log_e}")
                 except Exception as e:
                     error_message = f"ขออภัยครับ เกิดข้อผิดพลาด: {e}"
-                    await manager.broadcast(full_room_id, {"type": "chat", "username": "AI", "message": error_message})
+                    await manager.broadcast(full_room_id, {"type": "chat", "username": "AI", "message": error_message, "stream_id": stream_id})
                     try:
-                        # การบันทึกประวัติจะใช้ timestamp จาก object ที่ส่งไปโดยอัตโนมัติ
-                        await client.post(f"{BASE_URL}/rooms/{room_id}/messages", params={"project_id": project_id}, json={"role":"assistant", "content": error_message, "username": "AI", "meta": {"error": str(e)}})
+                        # timestamp ถูกกำหนดตอนเข้าคิว
+                        history_writer.log(project_id, room_id, "assistant", error_message, username="AI", meta={"error": str(e)})
                     except Exception as log_e:
                         logger.error(f"Failed to log error message: {log_e}")
             else:
@@ -153,11 +221,7 @@ async def websocket_endpoint(
                 await manager.broadcast(full_room_id, {"type": "chat", "username": username, "message": message_text})
                 # บันทึกข้อความของผู้ใช้ลงในประวัติ
                 try:
-                    await client.post(
-                        f"{BASE_URL}/rooms/{room_id}/messages",
-                        params={"project_id": project_id},
-                        json={"role": "user", "content": message_text, "username": username}
-                    )
+                    history_writer.log(project_id, room_id, "user", message_text, username=username)
                 except Exception as log_e:
                     logger.error(f"Failed to log user message for room '{full_room_id}': {log_e}")
 
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Bulk-import chat.jsonl history files into the SQLite history backend.
+
+- Source: ~/private-ai/projects/<project>/rooms/<room>/history/chat.jsonl
+- Target: HISTORY_DB_PATH (default ~/private-ai/history.db)
+- ห้องที่มีข้อมูลในฐานข้อมูลแล้วจะถูกข้าม (ใช้ --replace เพื่อลบแล้ว import ใหม่)
+- ลำดับของข้อความในไฟล์ถูกเก็บไว้ (ts เท่ากันเรียงตามลำดับเดิม)
+
+หลัง import แล้วตั้ง HISTORY_BACKEND=sqlite แล้ว restart backend
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from typing import Iterator, List
+
+from sqlalchemy import text
+
+from history_store import BASE_DIR, HIST_NAME, HISTORY_DB_PATH, SqliteHistoryStore, INSERT_MESSAGE, msg_params
+
+def find_rooms(base_dir: str, project: str = None) -> Iterator[tuple]:
+    """yield (project_id, room_id, path) ของทุกไฟล์ chat.jsonl"""
+    pattern = os.path.join(base_dir, project or "*", "rooms", "*", "history", HIST_NAME)
+    for path in sorted(glob.glob(pattern)):
+        room_dir = os.path.dirname(os.path.dirname(path))
+        project_id = os.path.basename(os.path.dirname(os.path.dirname(room_dir)))
+        yield project_id, os.path.basename(room_dir), path
+
+def read_records(path: str) -> Iterator[dict]:
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(rec, dict) and rec.get("role") is not None and rec.get("content") is not None:
+                yield rec
+
+def migrate(store: SqliteHistoryStore, base_dir: str, project: str = None, replace: bool = False, batch: int = 5000) -> None:
+    t0 = time.time()
+    rooms = imported = skipped = 0
+    for project_id, room_id, path in find_rooms(base_dir, project):
+        key = {"project_id": project_id, "room_id": room_id}
+        with store.engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM messages WHERE project_id = :project_id AND room_id = :room_id LIMIT 1"), key).first()
+            if exists and not replace:
+                print(f"[SKIP] {project_id}/{room_id} already in database")
+                skipped += 1
+                continue
+            if exists:
+                conn.execute(text("DELETE FROM messages WHERE project_id = :project_id AND room_id = :room_id"), key)
+
+            n = 0
+            buf: List[dict] = []
+            for rec in read_records(path):
+                buf.append(msg_params(project_id, room_id, rec))
+                if len(buf) >= batch:
+                    conn.execute(INSERT_MESSAGE, buf)
+                    n += len(buf)
+                    buf = []
+            if buf:
+                conn.execute(INSERT_MESSAGE, buf)
+                n += len(buf)
+        rooms += 1
+        imported += n
+        print(f"[OK] {project_id}/{room_id}: {n} messages")
+
+    dt = time.time() - t0
+    rate = imported / dt if dt > 0 else 0
+    print(f"Done. rooms={rooms} skipped={skipped} messages={imported} in {dt:.1f}s ({rate:.0f} msg/s) -> {store.db_path}")
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Import chat.jsonl history into SQLite")
+    ap.add_argument("--base-dir", default=BASE_DIR, help="root of project folders (default: %(default)s)")
+    ap.add_argument("--db", default=HISTORY_DB_PATH, help="SQLite database path (default: %(default)s)")
+    ap.add_argument("--project", default=None, help="import only this project")
+    ap.add_argument("--replace", action="store_true", help="delete and re-import rooms that already exist in the database")
+    ap.add_argument("--batch", type=int, default=5000, help="rows per executemany (default: %(default)s)")
+    args = ap.parse_args()
+
+    if not os.path.isdir(args.base_dir):
+        print(f"Base dir not found: {args.base_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    # bulk import ไม่ต้อง fsync ทุก transaction
+    store = SqliteHistoryStore(db_path=os.path.expanduser(args.db), pool_size=1, durability="none")
+    try:
+        migrate(store, args.base_dir, args.project, args.replace, args.batch)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    main()
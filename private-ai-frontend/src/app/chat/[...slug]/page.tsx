@@ -9,6 +9,7 @@ type Message = {
   username: string;
   message: string;
   ts: number; // Unix timestamp in seconds
+  stream_id?: string; // มีเมื่อเป็นคำตอบ AI ที่ stream มาทีละส่วน
 };
 
 export default function ChatRoomPage() {
@@ -59,7 +60,29 @@ export default function ChatRoomPage() {
     ws.onmessage = (event) => {
       try {
         const messageData = JSON.parse(event.data);
-        setMessages((prevMessages) => [...prevMessages, messageData]);
+        if (messageData.type === "chat_delta") {
+          // ต่อ token ใหม่เข้ากับข้อความ AI ที่กำลัง stream อยู่ (stream_id เดียวกัน)
+          setMessages((prevMessages) => {
+            const idx = prevMessages.findIndex((m) => m.stream_id === messageData.stream_id);
+            if (idx === -1) {
+              return [...prevMessages, { type: "chat", username: messageData.username, message: messageData.delta, ts: messageData.ts, stream_id: messageData.stream_id }];
+            }
+            const next = [...prevMessages];
+            next[idx] = { ...next[idx], message: next[idx].message + messageData.delta };
+            return next;
+          });
+          return;
+        }
+        setMessages((prevMessages) => {
+          // ข้อความสุดท้ายของ stream แทนที่ข้อความที่ประกอบจาก delta
+          const idx = messageData.stream_id ? prevMessages.findIndex((m) => m.stream_id === messageData.stream_id) : -1;
+          if (idx === -1) {
+            return [...prevMessages, messageData];
+          }
+          const next = [...prevMessages];
+          next[idx] = messageData;
+          return next;
+        });
       } catch (error) {
         console.error("Failed to parse message data:", error);
       }
@@ -1,13 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field
-import httpx
-import os
+from http_clients import HttpClients, get_clients
+from embeddings import embed_query
+from vector_store import VectorStoreError, field_match, field_range, make_filter, vector_store
 
 router = APIRouter(prefix="/rag", tags=["rag"])
 
-# ปรับ URL ให้ตรงกับที่เราตั้งไว้
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11435")
-QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
 COLLECTION = "demo_rag"
 
 class SearchReq(BaseModel):
@@ -36,57 +34,41 @@ class SearchResp(BaseModel):
     hits: list[Hit]
 
 @router.post("/search", response_model=SearchResp)
-async def rag_search(body: SearchReq):
+async def rag_search(body: SearchReq, clients: HttpClients = Depends(get_clients)):
     # 1) สร้าง embedding ของ query
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        emb_resp = await client.post(f"{OLLAMA_URL}/api/embeddings", json={"model":"bge-m3","prompt": body.query})
-        if emb_resp.status_code != 200:
-            raise HTTPException(500, f"Ollama embeddings error: {emb_resp.text}")
-        emb = emb_resp.json().get("embedding")
-        if not emb:
-            raise HTTPException(500, "No embedding returned")
+    emb = await embed_query(clients.ollama, body.query)
 
-        # 2) สร้าง filter ตามตัวกรองที่ส่งมา
-        must_filters = []
-        if body.project_id:
-            must_filters.append({"key":"project_id","match":{"value": body.project_id}})
-        if body.room_id:
-            must_filters.append({"key":"room_id","match":{"value": body.room_id}})
+    # 2) สร้าง filter ตามตัวกรองที่ส่งมา
+    must_filters = []
+    if body.project_id:
+        must_filters.append(field_match("project_id", body.project_id))
+    if body.room_id:
+        must_filters.append(field_match("room_id", body.room_id))
 
-        # range created_at
-        if body.after is not None or body.before is not None:
-            rng = {}
-            if body.after is not None:
-                rng["gte"] = int(body.after)
-            if body.before is not None:
-                rng["lte"] = int(body.before)
-            must_filters.append({"key":"created_at","range": rng})
+    # range created_at
+    if body.after is not None or body.before is not None:
+        must_filters.append(field_range(
+            "created_at",
+            gte=int(body.after) if body.after is not None else None,
+            lte=int(body.before) if body.before is not None else None,
+        ))
 
-        search = {
-            "vector": emb,
-            "limit": body.limit,
-            "with_payload": True,
-            "with_vectors": False,
-            "score_threshold": body.score_threshold
-        }
-        if must_filters:
-            search["filter"] = {"must": must_filters}
+    try:
+        results = await vector_store.search(COLLECTION, emb, body.limit, body.score_threshold, make_filter(must_filters))
+    except VectorStoreError as e:
+        raise HTTPException(500, f"Vector search error: {e}")
 
-        qdr = await client.post(f"{QDRANT_URL}/collections/{COLLECTION}/points/search", json=search)
-        if qdr.status_code != 200:
-            raise HTTPException(500, f"Qdrant search error: {qdr.text}")
-
-        out: list[Hit] = []
-        for pt in qdr.json().get("result", []):
-            pl = pt.get("payload") or {}
-            out.append(Hit(
-                id=pt.get("id"),
-                score=float(pt.get("score", 0.0)),
-                project_id=pl.get("project_id"),
-                room_id=pl.get("room_id"),
-                file=(pl.get("file_path") or "").split("/")[-1] or None,
-                file_path=pl.get("file_path"),
-                preview=(pl.get("preview") or "")[:200],
-                created_at=pl.get("created_at")
-            ))
-        return SearchResp(hits=out)
+    out: list[Hit] = []
+    for pt in results:
+        pl = pt.get("payload") or {}
+        out.append(Hit(
+            id=pt.get("id"),
+            score=float(pt.get("score", 0.0)),
+            project_id=pl.get("project_id"),
+            room_id=pl.get("room_id"),
+            file=(pl.get("file_path") or "").split("/")[-1] or None,
+            file_path=pl.get("file_path"),
+            preview=(pl.get("preview") or "")[:200],
+            created_at=pl.get("created_at")
+        ))
+    return SearchResp(hits=out)
@@ -0,0 +1,127 @@
+# rerank.py
+"""
+Post-retrieval: รวม chunk ที่อยู่ติดกันในไฟล์เดียวกัน แล้วเลือกผลแบบ MMR ให้หลากหลาย
+
+ผู้เรียกค้น candidate มากกว่า limit (RERANK_CANDIDATES เท่า) พร้อม vector แล้วส่งเข้า diversify()
+เพื่อไม่ให้ chunk ข้างเคียงที่เกือบเหมือนกันจากไฟล์เดียวกันกินที่ใน prompt หลายช่อง
+
+- merge_adjacent: chunk ของโค้ด (payload "path", ช่วง "start"/"end" เป็นตัวอักษร) ที่ช่วงติดกันหรือซ้อนกัน
+  และ chunk ของเอกสาร (payload "file_path", "chunk_index" ต่อเนื่องกัน) รวมเป็น hit เดียว
+  ใช้ id/score ของ chunk ที่คะแนนสูงสุด ช่วงขยายครอบทั้งกลุ่ม preview ต่อกันตามลำดับในไฟล์
+  และ "merged_ids" เก็บ id ของทุก chunk ในกลุ่ม
+- mmr: เลือกทีละตัวที่ lambda * relevance - (1 - lambda) * (cosine สูงสุดกับตัวที่เลือกแล้ว) มากที่สุด
+  relevance คือ score ที่ normalize ด้วย score สูงสุด (ใช้ได้ทั้ง cosine และคะแนน RRF)
+  hit ที่ไม่มี vector (เช่นผลจาก BM25 อย่างเดียว) ถือว่าไม่ซ้ำกับตัวอื่น
+
+hit ที่คืนไม่มี "vector" แล้ว (ไม่ต้องส่งต่อไปถึง response)
+"""
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "3"))     # ค้น candidate = limit * ค่านี้
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))               # 1 = เรียงตาม relevance อย่างเดียว
+MERGE_GAP_CHARS = int(os.getenv("MERGE_GAP_CHARS", "1"))         # ช่องว่างสูงสุดระหว่าง chunk ที่ยังนับว่าติดกัน
+
+def candidate_limit(limit: int) -> int:
+    return limit * max(1, RERANK_CANDIDATES) if RERANK_ENABLED else limit
+
+def _span(hit: dict) -> Optional[Tuple[str, str, int, int]]:
+    """(ชนิด, ไฟล์, ต้น, ปลาย) ของ chunk หรือ None ถ้ารวมกับตัวอื่นไม่ได้ (เช่น hit จากบทสนทนา)"""
+    pl = hit.get("payload") or {}
+    if pl.get("path") and isinstance(pl.get("start"), int) and isinstance(pl.get("end"), int):
+        return ("code", pl["path"], pl["start"], pl["end"])
+    if pl.get("file_path") and isinstance(pl.get("chunk_index"), int):
+        # chunk ของเอกสารซ้อนกัน (overlap) อยู่แล้ว: index ต่อเนื่อง = ติดกัน
+        ci = pl["chunk_index"]
+        return ("doc", pl["file_path"], ci, ci)
+    return None
+
+def _merge_group(group: List[Tuple[Tuple[str, str, int, int], dict]]) -> dict:
+    """group เรียงตามตำแหน่งในไฟล์แล้ว"""
+    best = max((h for _, h in group), key=lambda h: h.get("score", 0.0))
+    if len(group) == 1:
+        return best
+    kind = group[0][0][0]
+    payloads = [h.get("payload") or {} for _, h in group]
+    pl = dict(best.get("payload") or {})
+    pl["preview"] = "\n...\n".join((p.get("preview") or "").strip() for p in payloads)
+    pl["merged_ids"] = [h.get("id") for _, h in group]
+    if kind == "code":
+        pl["start"] = min(p["start"] for p in payloads)
+        pl["end"] = max(p["end"] for p in payloads)
+        lines = [p for p in payloads if isinstance(p.get("start_line"), int) and isinstance(p.get("end_line"), int)]
+        if lines:
+            pl["start_line"] = min(p["start_line"] for p in lines)
+            pl["end_line"] = max(p["end_line"] for p in lines)
+        pl["symbols"] = list(dict.fromkeys(s for p in payloads for s in (p.get("symbols") or [])))
+    else:
+        pl["chunk_index"] = payloads[0]["chunk_index"]
+        pl["chunk_end"] = payloads[-1]["chunk_index"]
+    merged = dict(best)
+    merged["payload"] = pl
+    return merged
+
+def merge_adjacent(hits: List[dict], gap: int = MERGE_GAP_CHARS) -> List[dict]:
+    """รวม chunk ที่ติดกัน/ซ้อนกันในไฟล์เดียวกัน คืนเรียงตาม score เดิม (มากไปน้อย)"""
+    files: Dict[Tuple[str, str], List[Tuple[Tuple[str, str, int, int], dict]]] = {}
+    out: List[dict] = []
+    for h in hits:
+        span = _span(h)
+        if span is None:
+            out.append(h)
+        else:
+            files.setdefault(span[:2], []).append((span, h))
+    for members in files.values():
+        members.sort(key=lambda m: (m[0][2], m[0][3]))
+        group = [members[0]]
+        end = members[0][0][3]
+        for span, h in members[1:]:
+            near = gap if span[0] == "code" else 1
+            if span[2] <= end + near:
+                group.append((span, h))
+                end = max(end, span[3])
+            else:
+                out.append(_merge_group(group))
+                group, end = [(span, h)], span[3]
+        out.append(_merge_group(group))
+    out.sort(key=lambda h: h.get("score", 0.0), reverse=True)
+    return out
+
+def mmr(hits: List[dict], k: int, lam: float = MMR_LAMBDA) -> List[dict]:
+    if len(hits) <= 1 or k <= 0:
+        return hits[:k]
+    top = max(h.get("score", 0.0) for h in hits) or 1.0
+    rel = np.array([h.get("score", 0.0) / top for h in hits], dtype=np.float32)
+
+    dims = {len(h["vector"]) for h in hits if h.get("vector")}
+    dim = dims.pop() if len(dims) == 1 else 0
+    has_vec = np.array([bool(dim) and len(h.get("vector") or ()) == dim for h in hits])
+    if has_vec.sum() < 2:
+        return hits[:k]
+    vecs = np.zeros((len(hits), dim), dtype=np.float32)
+    vecs[has_vec] = np.asarray([h["vector"] for h, ok in zip(hits, has_vec) if ok], dtype=np.float32)
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    vecs /= np.where(norms == 0, 1.0, norms)
+
+    # max_sim[i] = cosine สูงสุดของ hit i กับตัวที่เลือกไปแล้ว (ไม่มี vector = 0)
+    max_sim = np.zeros(len(hits), dtype=np.float32)
+    picked = np.zeros(len(hits), dtype=bool)
+    order: List[int] = []
+    for _ in range(min(k, len(hits))):
+        gain = lam * rel - (1.0 - lam) * max_sim
+        gain[picked] = -np.inf
+        i = int(np.argmax(gain))
+        order.append(i)
+        picked[i] = True
+        if has_vec[i]:
+            max_sim = np.maximum(max_sim, np.where(has_vec, vecs @ vecs[i], 0.0))
+    return [hits[i] for i in order]
+
+def diversify(hits: List[dict], limit: int) -> List[dict]:
+    """merge_adjacent -> mmr -> ตัด "vector" ออก"""
+    if RERANK_ENABLED:
+        hits = mmr(merge_adjacent(hits), limit)
+    return [{k: v for k, v in h.items() if k != "vector"} for h in hits[:limit]]
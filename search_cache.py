@@ -0,0 +1,153 @@
+# search_cache.py
+"""
+Cache ผลค้น vector (collection, query vector, filter, limit, score_threshold) ด้านหน้า vector store
+
+คำถามเดิมในห้องที่คนใช้เยอะ หรือ chat_api.generate ที่ re-augment ด้วยพารามิเตอร์เดิม
+จะได้ผลจาก cache โดยไม่ต้องค้นซ้ำ ผลว่าง (ไม่มี hit) ก็ถูกเก็บด้วย (negative caching)
+
+ความสดใช้ write epoch ต่อ collection: ไฟล์ที่ทุก upsert/delete/drop ผ่าน vector_store
+ต่อท้าย 1 byte (O_APPEND จึงไม่หายแม้หลาย process เขียนพร้อมกัน) epoch คือขนาดไฟล์
+backend กับสคริปต์ index/ingest ใช้ไฟล์เดียวกัน entry ที่เก็บไว้ก่อน epoch เปลี่ยนจึงไม่ถูกใช้อีก
+SEARCH_CACHE_TTL เป็นตาข่ายสำรองสำหรับการเขียนที่ไม่ผ่าน vector_store (เช่นแก้ Qdrant ตรงๆ)
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CACHE_ENABLED = os.getenv("SEARCH_CACHE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+SEARCH_CACHE_MAX = int(os.getenv("SEARCH_CACHE_MAX", "2048"))   # entry สูงสุดรวมทุก collection
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))    # วินาที, 0 = ไม่หมดอายุตามเวลา
+EPOCH_DIR = os.path.expanduser(os.getenv("SEARCH_CACHE_EPOCH_DIR", "~/private-ai/index/epochs"))
+
+Key = Tuple[str, str, str, int, Optional[float], bool, bool]
+
+class WriteEpochs:
+    """write epoch ต่อ collection ที่ทุก process เห็นตรงกัน (ไฟล์ละ collection ใต้ root)"""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, collection: str) -> str:
+        return os.path.join(self.root, collection)
+
+    def get(self, collection: str) -> int:
+        try:
+            return os.stat(self._path(collection)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, collection: str) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        fd = os.open(self._path(collection), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, b".")
+        finally:
+            os.close(fd)
+
+class _Entry:
+    __slots__ = ("epoch", "hits", "created_at")
+
+    def __init__(self, epoch: int, hits: List[dict]):
+        self.epoch = epoch
+        self.hits = hits
+        self.created_at = time.time()
+
+class _Counters:
+    __slots__ = ("hits", "negative_hits", "misses", "stale", "bumps")
+
+    def __init__(self):
+        self.hits = self.negative_hits = self.misses = self.stale = self.bumps = 0
+
+class SearchCache:
+    def __init__(self, epochs: WriteEpochs, max_entries: int = SEARCH_CACHE_MAX, ttl: int = SEARCH_CACHE_TTL,
+                 enabled: bool = SEARCH_CACHE_ENABLED):
+        self.epochs = epochs
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries: "OrderedDict[Key, _Entry]" = OrderedDict()
+        self._counters: Dict[str, _Counters] = {}
+
+    def _c(self, collection: str) -> _Counters:
+        c = self._counters.get(collection)
+        if c is None:
+            c = self._counters[collection] = _Counters()
+        return c
+
+    @staticmethod
+    def key(collection: str, vector: List[float], limit: int, score_threshold: Optional[float],
+            filter: Optional[dict], with_payload: bool, with_vector: bool = False) -> Key:
+        vec = hashlib.sha1(array("d", vector).tobytes()).hexdigest()
+        flt = json.dumps(filter, sort_keys=True, ensure_ascii=False, default=str) if filter else ""
+        return (collection, vec, flt, limit, score_threshold, with_payload, with_vector)
+
+    def lookup(self, key: Key) -> Tuple[Optional[List[dict]], int]:
+        """คืน (hits หรือ None, epoch ปัจจุบัน) epoch ต้องอ่านก่อนค้นจริงแล้วส่งกลับมาให้ store()
+        ผลที่ค้นระหว่างที่มีการเขียนจึงถูกเก็บด้วย epoch เก่าและไม่ถูกใช้"""
+        collection = key[0]
+        epoch = self.epochs.get(collection)
+        c = self._c(collection)
+        e = self._entries.get(key)
+        if e is not None and (e.epoch != epoch or (self.ttl and time.time() - e.created_at > self.ttl)):
+            del self._entries[key]
+            c.stale += 1
+            e = None
+        if e is None:
+            c.misses += 1
+            return None, epoch
+        self._entries.move_to_end(key)
+        if e.hits:
+            c.hits += 1
+        else:
+            c.negative_hits += 1
+        # hit แต่ละตัวเป็น dict ใหม่ ผู้เรียกแก้ score/id ได้โดยไม่กระทบ cache (payload ใช้ร่วมกัน อ่านอย่างเดียว)
+        return [dict(h) for h in e.hits], epoch
+
+    def store(self, key: Key, epoch: int, hits: List[dict]) -> None:
+        self._entries[key] = _Entry(epoch, [dict(h) for h in hits])
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def bump(self, collection: str) -> None:
+        """เรียกหลังการเขียนทุกครั้ง (รวมที่ล้มเหลวกลางทาง เพราะอาจเขียนไปแล้วบางส่วน)"""
+        try:
+            self.epochs.bump(collection)
+        except OSError as e:
+            # ถ้าบันทึก epoch ไม่ได้ ล้าง cache ของ process นี้แทน (process อื่นพึ่ง TTL)
+            logger.error(f"Cannot bump write epoch of {collection}: {e}")
+            self.purge(collection)
+        self._c(collection).bumps += 1
+
+    def purge(self, collection: Optional[str] = None) -> int:
+        keys = [k for k in self._entries if collection is None or k[0] == collection]
+        for k in keys:
+            del self._entries[k]
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        per: Dict[str, Dict[str, Any]] = {}
+        for name, c in self._counters.items():
+            served = c.hits + c.negative_hits
+            lookups = served + c.misses
+            per[name] = {
+                "hits": c.hits,
+                "negative_hits": c.negative_hits,
+                "misses": c.misses,
+                "stale_evictions": c.stale,
+                "write_epoch_bumps": c.bumps,
+                "hit_rate": round(served / lookups, 3) if lookups else 0.0,
+            }
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "collections": per,
+        }
@@ -0,0 +1,173 @@
+# single_flight.py
+"""
+รวมคำขอที่เหมือนกันซึ่งกำลังทำงานอยู่พร้อมกันให้เหลือการคำนวณเดียว (single-flight) สำหรับ /code/answer
+
+ห้องที่คนเยอะมักมีหลายคนพิมพ์ /ai คำถามเดียวกัน หรือกด retry ระหว่างที่คำตอบแรกยังไม่เสร็จ
+คำขอแรก (leader) เริ่ม embed -> ค้น -> generate ใน task แยก คำขอที่ key ตรงกันซึ่งเข้ามาระหว่างนั้น
+(follower) ไม่เริ่มงานใหม่แต่รอผลเดียวกัน:
+- run(): รอค่าที่ coroutine ของ leader คืน
+- stream(): ได้ event ทุกตัวตั้งแต่ต้น (ที่ leader ส่งไปแล้วถูกส่งซ้ำให้ทันที) แล้วตามต่อแบบ live
+
+ผลที่สำเร็จยังแชร์ต่อได้อีก COALESCE_WINDOW วินาทีหลังเสร็จ (retry ที่กดช้ากว่าคำตอบนิดเดียว)
+ผลที่ล้มเหลวไม่ถูกเก็บ: follower ที่รออยู่ได้ exception เดียวกัน คำขอถัดไปเริ่มใหม่
+งานของ leader ถูกยกเลิกเมื่อไม่เหลือผู้รอแล้วเท่านั้น (leader ตัดการเชื่อมต่อ follower ยังได้คำตอบ)
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1").lower() in ("1", "true", "yes", "on")
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "2"))    # วินาทีหลังเสร็จที่ยังแชร์ผลได้, 0 = เฉพาะที่กำลังทำ
+# field ของคำขอที่ใช้เป็น key (ตัด field ออกเพื่อรวมคำขอที่ต่างกันแค่ field นั้น)
+COALESCE_KEY = tuple(
+    f.strip() for f in os.getenv("COALESCE_KEY", "query,provider,model,limit,score_threshold,mode").split(",") if f.strip()
+)
+
+class _Flight:
+    __slots__ = ("task", "events", "result", "error", "done", "started", "duration", "waiters", "followers", "_changed")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.events: List[Any] = []      # stream(): event ที่ leader ส่งมาแล้วทั้งหมด
+        self.result: Any = None          # run(): ค่าที่คืน
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.waiters = 0                 # ผู้ที่ยังรอผลอยู่ (รวม leader)
+        self.followers = 0               # follower ที่เข้าร่วมก่อนเสร็จ
+        self._changed = asyncio.Event()
+
+    def notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+class SingleFlight:
+    def __init__(self, window: float = COALESCE_WINDOW, enabled: bool = COALESCE_ENABLED):
+        self.window = window
+        self.enabled = enabled
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.leaders = 0
+        self.joined = 0             # follower ที่เข้าร่วมระหว่างที่ leader กำลังทำ
+        self.joined_done = 0        # follower ที่ได้ผลที่เสร็จแล้วภายใน window
+        self.errors = 0
+        self.cancelled = 0
+        self.saved_seconds = 0.0    # เวลาคำนวณของ leader x จำนวน follower = งานที่ไม่ต้องทำซ้ำ
+
+    # ---- bookkeeping ----
+    def _attach(self, key: Hashable, work: Callable[[_Flight], Awaitable[None]]) -> _Flight:
+        f = self._flights.get(key)
+        if f is None:
+            f = self._flights[key] = _Flight()
+            self.leaders += 1
+            f.task = asyncio.get_running_loop().create_task(self._run(key, f, work))
+        elif f.done:
+            self.joined_done += 1
+            self.saved_seconds += f.duration
+        else:
+            f.followers += 1
+            self.joined += 1
+        f.waiters += 1
+        return f
+
+    async def _run(self, key: Hashable, f: _Flight, work: Callable[[_Flight], Awaitable[None]]) -> None:
+        try:
+            await work(f)
+        except asyncio.CancelledError:
+            f.error = asyncio.CancelledError()
+            self.cancelled += 1
+        except Exception as e:
+            f.error = e
+            self.errors += 1
+        f.duration = time.monotonic() - f.started
+        f.done = True
+        f.notify()
+        if f.error is None:
+            self.saved_seconds += f.duration * f.followers
+            if self.window > 0:
+                asyncio.get_running_loop().call_later(self.window, self._forget, key, f)
+                return
+        self._forget(key, f)
+
+    def _forget(self, key: Hashable, f: _Flight) -> None:
+        if self._flights.get(key) is f:
+            del self._flights[key]
+
+    def _detach(self, key: Hashable, f: _Flight) -> None:
+        f.waiters -= 1
+        if f.waiters <= 0 and not f.done:
+            # ไม่มีใครรอผลแล้ว: หยุดงาน (เช่น generate ที่ยังค้างอยู่) และไม่ให้คำขอถัดไปมาเกาะ
+            self._forget(key, f)
+            f.task.cancel()
+
+    # ---- public ----
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """คืนผลของ fn() โดยคำขอที่ key ตรงกันและมาพร้อมกันใช้ผลเดียวกัน"""
+        if not self.enabled:
+            return await fn()
+
+        async def work(f: _Flight) -> None:
+            f.result = await fn()
+
+        f = self._attach(key, work)
+        try:
+            while not f.done:
+                await f._changed.wait()
+        finally:
+            self._detach(key, f)
+        if f.error is not None:
+            raise f.error
+        return f.result
+
+    async def stream(self, key: Hashable, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """event ของ fn() ทุกตัวตั้งแต่ต้น โดยคำขอที่ key ตรงกันและมาพร้อมกันใช้ stream เดียวกัน"""
+        if not self.enabled:
+            async for ev in fn():
+                yield ev
+            return
+
+        async def work(f: _Flight) -> None:
+            events = fn()
+            try:
+                async for ev in events:
+                    f.events.append(ev)
+                    f.notify()
+            finally:
+                await events.aclose()
+
+        f = self._attach(key, work)
+        try:
+            i = 0
+            while True:
+                while i < len(f.events):
+                    yield f.events[i]
+                    i += 1
+                if f.done:
+                    break
+                await f._changed.wait()
+        finally:
+            self._detach(key, f)
+        if f.error is not None:
+            raise f.error
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.leaders + self.joined + self.joined_done
+        return {
+            "enabled": self.enabled,
+            "window_s": self.window,
+            "key": list(COALESCE_KEY),
+            "in_flight": sum(1 for f in self._flights.values() if not f.done),
+            "leaders": self.leaders,
+            "joined_in_flight": self.joined,
+            "joined_after_done": self.joined_done,
+            "errors": self.errors,
+            "cancelled": self.cancelled,
+            "coalesce_rate": round((self.joined + self.joined_done) / requests, 3) if requests else 0.0,
+            "saved_seconds": round(self.saved_seconds, 2),
+        }
+
+answer_flights = SingleFlight()
@@ -0,0 +1,116 @@
+# streaming.py
+"""
+Helpers สำหรับ token streaming
+
+- อ่าน stream จาก Ollama (NDJSON) และ OpenAI (SSE) แล้ว yield ทีละชิ้นข้อความ
+- ตัด <think>...</think> ของ qwen3 ออกแบบ incremental
+- แปลง event (dict) เป็น StreamingResponse แบบ NDJSON หรือ SSE
+"""
+import json
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+# ---- Upstream readers ----
+async def iter_ollama_stream(client: httpx.AsyncClient, url: str, payload: dict) -> AsyncIterator[str]:
+    """POST ไปที่ Ollama /api/generate แบบ stream=True แล้ว yield ข้อความทีละชิ้น"""
+    async with client.stream("POST", url, json={**payload, "stream": True}) as r:
+        if r.status_code != 200:
+            detail = (await r.aread()).decode("utf-8", "ignore")
+            raise HTTPException(500, f"Ollama error: {detail}")
+        async for line in r.aiter_lines():
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            if data.get("error"):
+                raise HTTPException(500, f"Ollama error: {data['error']}")
+            piece = data.get("response") or ""
+            if piece:
+                yield piece
+            if data.get("done"):
+                break
+
+async def iter_openai_stream(client: httpx.AsyncClient, url: str, payload: dict, headers: Dict[str, str]) -> AsyncIterator[str]:
+    """POST ไปที่ OpenAI chat completions แบบ stream=True แล้ว yield delta.content ทีละชิ้น"""
+    async with client.stream("POST", url, json={**payload, "stream": True}, headers=headers) as r:
+        if r.status_code != 200:
+            detail = (await r.aread()).decode("utf-8", "ignore")
+            raise HTTPException(500, f"OpenAI error: {detail}")
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or []
+            if not choices:
+                continue
+            piece = (choices[0].get("delta") or {}).get("content") or ""
+            if piece:
+                yield piece
+
+# ---- <think> filter ----
+class ThinkFilter:
+    """ตัดบล็อก <think>...</think> ที่อยู่ต้นคำตอบออกจาก stream
+
+    ทำงานแบบเดียวกับ clean_ai_response: ถ้าไม่เคยเจอ </think> จะคืนข้อความทั้งหมดตอน flush
+    """
+    OPEN, CLOSE = "<think>", "</think>"
+
+    def __init__(self):
+        self._buf = ""
+        self._mode = "probe"   # probe -> think -> pass
+
+    def feed(self, piece: str) -> str:
+        if self._mode == "pass":
+            return piece
+        self._buf += piece
+        if self._mode == "probe":
+            head = self._buf.lstrip()
+            if not head or self.OPEN.startswith(head):
+                return ""        # ยังตัดสินไม่ได้ รอข้อมูลเพิ่ม
+            if not head.startswith(self.OPEN):
+                self._mode = "pass"
+                out, self._buf = self._buf, ""
+                return out
+            self._mode = "think"
+        end = self._buf.find(self.CLOSE)
+        if end < 0:
+            return ""
+        rest = self._buf[end + len(self.CLOSE):].lstrip()
+        self._mode = "pass"
+        self._buf = ""
+        return rest
+
+    def flush(self) -> str:
+        out, self._buf = self._buf, ""
+        self._mode = "pass"
+        return out
+
+# ---- Response encoding ----
+STREAM_FORMATS = ("ndjson", "sse")
+
+def _encode(event: dict, fmt: str) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    if fmt == "sse":
+        return f"event: {event.get('type', 'message')}\ndata: {data}\n\n"
+    return data + "\n"
+
+def event_stream_response(events: AsyncIterator[dict], fmt: Optional[str] = "ndjson") -> StreamingResponse:
+    """แปลง async iterator ของ event เป็น StreamingResponse (NDJSON หรือ SSE)"""
+    fmt = fmt if fmt in STREAM_FORMATS else "ndjson"
+
+    async def body():
+        try:
+            async for ev in events:
+                yield _encode(ev, fmt)
+        except HTTPException as e:
+            # status 200 ถูกส่งไปแล้ว: ส่ง status จริงใน event (เช่น 429/503 จากคิว LLM ให้ client ลองใหม่)
+            yield _encode({"type": "error", "status": e.status_code, "detail": e.detail}, fmt)
+        except Exception as e:
+            yield _encode({"type": "error", "detail": str(e)}, fmt)
+
+    media_type = "text/event-stream" if fmt == "sse" else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
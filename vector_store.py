@@ -0,0 +1,626 @@
+# vector_store.py
+"""
+VectorStore: interface เดียวสำหรับทุกโมดูลที่ค้น/เขียน vector (แทนการประกอบ JSON ของ Qdrant เอง)
+
+เลือก backend ด้วย VECTOR_BACKEND:
+
+- qdrant   (default) Qdrant REST ที่ QDRANT_URL ผ่าน HTTP pool ของ http_clients.py
+- embedded เก็บ vector ใน process: ไฟล์ float32/float16 แบบ mmap (VECTOR_DTYPE) ต่อ collection
+           ใน VECTOR_DIR กับ SQLite สำหรับ id/payload ค้นด้วย cosine top-k แบบ vectorized (NumPy)
+           ไม่ต้องมี Qdrant เหมาะกับเครื่องเล็กและชุดทดสอบ หลาย process (backend + สคริปต์ index)
+           ใช้ไดเรกทอรีเดียวกันได้ ฝั่งที่อ่านจะเห็นการเขียนของอีกฝั่งในการเรียกครั้งถัดไป
+
+filter ใช้รูปแบบเดียวกับ Qdrant: {"must": [...], "must_not": [...], "should": [...]} โดยแต่ละเงื่อนไขคือ
+{"key": k, "match": {"value"|"text"|"any": ...}} หรือ {"key": k, "range": {"gt"|"gte"|"lt"|"lte": n}}
+(สร้างได้ด้วย field_match / field_text / field_range / make_filter)
+
+ผลลัพธ์เป็น dict แบบเดียวกับ Qdrant: search -> [{"id", "score", "payload"}], retrieve/scroll -> [{"id", "payload"}]
+
+store ที่ได้จาก open_store() ครอบด้วย search_cache.SearchCache: search ที่ซ้ำกันตอบจาก cache
+และทุก upsert/delete/drop เลื่อน write epoch ของ collection เพื่อไม่ให้ผลเก่าถูกใช้
+"""
+import os
+import json
+import time
+import hashlib
+import shutil
+import asyncio
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from http_clients import pools
+from search_cache import EPOCH_DIR, SearchCache, WriteEpochs
+
+logger = logging.getLogger(__name__)
+
+# ---- Config ----
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "qdrant").lower()
+QDRANT_URL = os.getenv("QDRANT_URL", "http://127.0.0.1:6333")
+VECTOR_DIR = os.path.expanduser(os.getenv("VECTOR_DIR", "~/private-ai/vectors"))
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")   # float32 | float16 (ใช้ตอนสร้าง collection)
+
+class VectorStoreError(RuntimeError):
+    pass
+
+def store_location() -> str:
+    """ตัวระบุ store ที่ใช้อยู่ (ใช้เป็นส่วนหนึ่งของ key ของ manifest/checkpoint ของสคริปต์ index)"""
+    return QDRANT_URL if VECTOR_BACKEND != "embedded" else f"embedded:{VECTOR_DIR}"
+
+# ---- Filter helpers ----
+def field_match(key: str, value: Any) -> dict:
+    return {"key": key, "match": {"value": value}}
+
+def field_text(key: str, text: str) -> dict:
+    return {"key": key, "match": {"text": text}}
+
+def field_range(key: str, gt=None, gte=None, lt=None, lte=None) -> dict:
+    rng = {k: v for k, v in (("gt", gt), ("gte", gte), ("lt", lt), ("lte", lte)) if v is not None}
+    return {"key": key, "range": rng}
+
+def make_filter(must: Optional[List[dict]] = None, must_not: Optional[List[dict]] = None) -> Optional[dict]:
+    flt = {}
+    if must:
+        flt["must"] = must
+    if must_not:
+        flt["must_not"] = must_not
+    return flt or None
+
+# ---- Interface ----
+class VectorStore(ABC):
+    backend = ""
+
+    def __init__(self):
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.upserted = 0
+        self.deleted = 0
+        self.errors = 0
+
+    @abstractmethod
+    async def ensure_collection(self, collection: str, dim: int, distance: str = "Cosine") -> bool:
+        """สร้าง collection ถ้ายังไม่มี คืน True ถ้าเพิ่งสร้าง"""
+
+    @abstractmethod
+    async def drop_collection(self, collection: str) -> None:
+        ...
+
+    @abstractmethod
+    async def search(self, collection: str, vector: List[float], limit: int, score_threshold: Optional[float] = None,
+                     filter: Optional[dict] = None, with_payload: bool = True, with_vector: bool = False) -> List[dict]:
+        """with_vector=True ใส่ "vector" ของแต่ละ hit ด้วย (embedded คืน vector ที่ normalize แล้ว)"""
+
+    @abstractmethod
+    async def upsert(self, collection: str, points: List[dict]) -> int:
+        ...
+
+    @abstractmethod
+    async def retrieve(self, collection: str, ids: List[Any], with_payload: bool = True) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def delete(self, collection: str, ids: List[Any]) -> int:
+        ...
+
+    @abstractmethod
+    async def scroll(self, collection: str, filter: Optional[dict] = None, limit: int = 256,
+                     offset: Any = None, with_payload: bool = True) -> Tuple[List[dict], Any]:
+        """คืน (points, offset ของหน้าถัดไป หรือ None ถ้าหมดแล้ว)"""
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": self.backend,
+            "searches": self.searches,
+            "avg_search_ms": round(1000 * self.search_seconds / self.searches, 3) if self.searches else 0.0,
+            "upserted": self.upserted,
+            "deleted": self.deleted,
+            "errors": self.errors,
+        }
+
+# ---- Qdrant REST ----
+class QdrantStore(VectorStore):
+    backend = "qdrant"
+
+    def __init__(self, url: str = QDRANT_URL, client: Optional[httpx.AsyncClient] = None):
+        super().__init__()
+        self.url = url
+        self._client = client   # None = ใช้ HTTP pool ของ process
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self._client if self._client is not None else pools.qdrant
+
+    async def _call(self, what: str, method: str, path: str, ok=(200,), **kw) -> Any:
+        try:
+            r = await self.client.request(method, f"{self.url}{path}", **kw)
+        except httpx.HTTPError as e:
+            self.errors += 1
+            raise VectorStoreError(f"Qdrant {what} error: {e}") from e
+        if r.status_code not in ok:
+            self.errors += 1
+            raise VectorStoreError(f"Qdrant {what} error: {r.text[:400]}")
+        return r.json().get("result") if r.status_code == 200 else None
+
+    async def ensure_collection(self, collection: str, dim: int, distance: str = "Cosine") -> bool:
+        try:
+            r = await self.client.get(f"{self.url}/collections/{collection}", timeout=5)
+            if r.status_code == 200:
+                return False
+        except httpx.HTTPError:
+            pass
+        logger.info(f"Creating Qdrant collection: {collection}")
+        body = {"vectors": {"size": dim, "distance": distance}, "on_disk_payload": True}
+        try:
+            await self._call("create collection", "PUT", f"/collections/{collection}", json=body, timeout=30)
+        except VectorStoreError as e:
+            if "already exists" not in str(e):
+                raise
+            return False
+        return True
+
+    async def drop_collection(self, collection: str) -> None:
+        await self._call("drop collection", "DELETE", f"/collections/{collection}", ok=(200, 404), timeout=60)
+
+    async def search(self, collection, vector, limit, score_threshold=None, filter=None, with_payload=True, with_vector=False):
+        body = {"vector": vector, "limit": limit, "with_payload": with_payload, "with_vector": with_vector}
+        if score_threshold is not None:
+            body["score_threshold"] = score_threshold
+        if filter:
+            body["filter"] = filter
+        t0 = time.perf_counter()
+        result = await self._call("search", "POST", f"/collections/{collection}/points/search", json=body)
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - t0
+        return result or []
+
+    async def upsert(self, collection, points):
+        if not points:
+            return 0
+        await self._call("upsert", "PUT", f"/collections/{collection}/points?wait=true", json={"points": points}, timeout=300)
+        self.upserted += len(points)
+        return len(points)
+
+    async def retrieve(self, collection, ids, with_payload=True):
+        if not ids:
+            return []
+        body = {"ids": ids, "with_payload": with_payload, "with_vector": False}
+        return await self._call("retrieve", "POST", f"/collections/{collection}/points", json=body) or []
+
+    async def delete(self, collection, ids):
+        deleted = 0
+        for i in range(0, len(ids), 1000):
+            part = ids[i:i+1000]
+            await self._call("delete", "POST", f"/collections/{collection}/points/delete?wait=true", json={"points": part}, timeout=300)
+            deleted += len(part)
+        self.deleted += deleted
+        return deleted
+
+    async def scroll(self, collection, filter=None, limit=256, offset=None, with_payload=True):
+        body = {"limit": limit, "with_payload": with_payload, "with_vector": False}
+        if filter:
+            body["filter"] = filter
+        if offset is not None:
+            body["offset"] = offset
+        result = await self._call("scroll", "POST", f"/collections/{collection}/points/scroll", json=body) or {}
+        return result.get("points", []), result.get("next_page_offset")
+
+# ---- Embedded (NumPy + mmap) ----
+def _match_value(value: Any, cond: dict) -> bool:
+    """เงื่อนไขเดียวกับ Qdrant ต่อค่าหนึ่งค่า (payload ที่เป็น list ผ่านถ้ามีสมาชิกใดผ่าน)"""
+    if isinstance(value, list):
+        return any(_match_value(v, cond) for v in value)
+    if value is None:
+        return False
+    m = cond.get("match")
+    if m is not None:
+        if "value" in m:
+            return value == m["value"]
+        if "any" in m:
+            return value in m["any"]
+        if "text" in m:
+            return isinstance(value, str) and m["text"] in value
+        return False
+    rng = cond.get("range")
+    if rng is not None:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            return False
+        return (("gt" not in rng or value > rng["gt"]) and ("gte" not in rng or value >= rng["gte"])
+                and ("lt" not in rng or value < rng["lt"]) and ("lte" not in rng or value <= rng["lte"]))
+    raise VectorStoreError(f"Unsupported filter condition: {cond}")
+
+class _Collection:
+    """หนึ่ง collection: vectors.bin (แถวละ dim ค่า, normalize แล้ว) + points.db (id -> แถว, payload)
+
+    ลบ point = เก็บแถวไว้แต่ payload เป็น NULL (upsert id เดิมจะใช้แถวเดิม)
+    ทุกการเขียนได้ seq ใหม่ ฝั่งอ่านดึงเฉพาะแถวที่ seq มากกว่าที่เคยเห็น
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db_path = os.path.join(path, "points.db")
+        self.vec_path = os.path.join(path, "vectors.bin")
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        meta = dict(self.conn.execute("SELECT key, value FROM meta").fetchall())
+        self.dim = int(meta["dim"])
+        self.dtype = np.dtype(meta["dtype"])
+        self.row_bytes = self.dim * self.dtype.itemsize
+        self.ino = os.stat(self.db_path).st_ino
+        self.fd = os.open(self.vec_path, os.O_RDWR | os.O_CREAT, 0o644)
+        # สถานะในหน่วยความจำ (index = แถว)
+        self.ids: List[Any] = []
+        self.payloads: List[Optional[dict]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.row_of: Dict[str, int] = {}
+        self.seq = 0
+        self.data_version = None
+        self.mat: Optional[np.ndarray] = None
+        self._columns: Dict[str, np.ndarray] = {}
+
+    @staticmethod
+    def create(path: str, dim: int, dtype: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(path, "points.db"), timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS points ("
+                " id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE, payload TEXT, seq INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS points_seq ON points(seq)")
+            conn.executemany("INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)",
+                             [("dim", str(dim)), ("dtype", dtype), ("distance", "Cosine"), ("seq", "0")])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        self.conn.close()
+        os.close(self.fd)
+
+    # ---- sync ----
+    def sync(self) -> None:
+        """ดึงการเขียนที่ยังไม่เห็น (ของ process นี้หรือ process อื่น)"""
+        dv = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if dv == self.data_version:
+            return
+        self.data_version = dv
+        rows = self.conn.execute("SELECT id, row, payload, seq FROM points WHERE seq > ? ORDER BY seq", (self.seq,)).fetchall()
+        if not rows:
+            return
+        top = max(r[1] for r in rows) + 1
+        if top > len(self.ids):
+            grow = top - len(self.ids)
+            self.ids.extend([None] * grow)
+            self.payloads.extend([None] * grow)
+            self.alive = np.concatenate([self.alive, np.zeros(grow, dtype=bool)])
+        for key, row, payload, seq in rows:
+            self.ids[row] = json.loads(key)
+            self.row_of[key] = row
+            self.payloads[row] = json.loads(payload) if payload is not None else None
+            self.alive[row] = payload is not None
+            self.seq = max(self.seq, seq)
+        self._columns.clear()
+        if self.mat is None or self.mat.shape[0] < len(self.ids):
+            self.mat = None   # map ใหม่ตอนค้นครั้งถัดไป
+
+    def matrix(self) -> np.ndarray:
+        n = len(self.ids)
+        if self.mat is None or self.mat.shape[0] < n:
+            rows = os.fstat(self.fd).st_size // self.row_bytes
+            self.mat = np.memmap(self.vec_path, dtype=self.dtype, mode="r", shape=(rows, self.dim)) if rows else np.zeros((0, self.dim), self.dtype)
+        return self.mat[:n]
+
+    # ---- filter ----
+    def _column(self, key: str) -> np.ndarray:
+        col = self._columns.get(key)
+        if col is None:
+            col = np.empty(len(self.payloads), dtype=object)
+            col[:] = [p.get(key) if p else None for p in self.payloads]
+            self._columns[key] = col
+        return col
+
+    def _cond_mask(self, cond: dict) -> np.ndarray:
+        if any(k in cond for k in ("must", "must_not", "should")):
+            return self.filter_mask(cond)
+        col = self._column(cond["key"])
+        rng = cond.get("range")
+        if rng is not None:
+            num = np.array([v if isinstance(v, (int, float)) and not isinstance(v, bool) else np.nan for v in col], dtype=np.float64)
+            mask = ~np.isnan(num)
+            with np.errstate(invalid="ignore"):
+                for op, bound in rng.items():
+                    if op == "gt":
+                        mask &= num > bound
+                    elif op == "gte":
+                        mask &= num >= bound
+                    elif op == "lt":
+                        mask &= num < bound
+                    elif op == "lte":
+                        mask &= num <= bound
+            return mask
+        return np.fromiter((_match_value(v, cond) for v in col), dtype=bool, count=len(col))
+
+    def filter_mask(self, flt: dict) -> np.ndarray:
+        n = len(self.payloads)
+        mask = np.ones(n, dtype=bool)
+        for cond in flt.get("must") or []:
+            mask &= self._cond_mask(cond)
+        for cond in flt.get("must_not") or []:
+            mask &= ~self._cond_mask(cond)
+        should = flt.get("should") or []
+        if should:
+            any_mask = np.zeros(n, dtype=bool)
+            for cond in should:
+                any_mask |= self._cond_mask(cond)
+            mask &= any_mask
+        return mask
+
+    # ---- ops (เรียกภายใต้ self.lock) ----
+    def search(self, vector, limit, score_threshold, flt, with_payload, with_vector=False) -> List[dict]:
+        self.sync()
+        n = len(self.ids)
+        if n == 0 or limit <= 0:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        if q.shape != (self.dim,):
+            raise VectorStoreError(f"Vector size {q.size} does not match collection size {self.dim}")
+        q /= float(np.linalg.norm(q)) or 1.0
+        mat = self.matrix()
+        scores = mat @ q if self.dtype == np.float32 else mat.astype(np.float32) @ q
+        mask = self.alive.copy()
+        if flt:
+            mask &= self.filter_mask(flt)
+        if score_threshold is not None:
+            mask &= scores >= score_threshold
+        cand = np.flatnonzero(mask)
+        if cand.size == 0:
+            return []
+        k = min(limit, cand.size)
+        top = cand[np.argpartition(-scores[cand], k - 1)[:k]] if k < cand.size else cand
+        top = top[np.argsort(-scores[top], kind="stable")]
+        hits = [{"id": self.ids[r], "score": float(scores[r]), **({"payload": self.payloads[r]} if with_payload else {})} for r in top]
+        if with_vector:
+            for h, r in zip(hits, top):
+                h["vector"] = mat[r].astype(np.float32).tolist()
+        return hits
+
+    def upsert(self, points: List[dict]) -> int:
+        vecs = np.asarray([p["vector"] for p in points], dtype=np.float32)
+        if vecs.ndim != 2 or vecs.shape[1] != self.dim:
+            raise VectorStoreError(f"Vector size does not match collection size {self.dim}")
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = (vecs / np.where(norms == 0, 1.0, norms)).astype(self.dtype)
+        # BEGIN IMMEDIATE: กันหลาย process จองแถวเดียวกัน
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = int(self.conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]) + 1
+            next_row = self.conn.execute("SELECT COALESCE(MAX(row) + 1, 0) FROM points").fetchone()[0]
+            rows = []
+            for p, vec in zip(points, vecs):
+                key = json.dumps(p["id"])
+                found = self.conn.execute("SELECT row FROM points WHERE id = ?", (key,)).fetchone()
+                if found:
+                    row = found[0]
+                else:
+                    row, next_row = next_row, next_row + 1
+                # เขียน vector ก่อน commit แถวใน SQLite ฝั่งอ่านจึงไม่เห็นแถวที่ยังไม่มี vector
+                os.pwrite(self.fd, vec.tobytes(), row * self.row_bytes)
+                rows.append((key, row, json.dumps(p.get("payload") or {}, ensure_ascii=False), seq))
+            self.conn.executemany("INSERT OR REPLACE INTO points (id, row, payload, seq) VALUES (?, ?, ?, ?)", rows)
+            self.conn.execute("UPDATE meta SET value = ? WHERE key = 'seq'", (str(seq),))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.data_version = None
+        return len(points)
+
+    def delete(self, ids: List[Any]) -> int:
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            seq = int(self.conn.execute("SELECT value FROM meta WHERE key = 'seq'").fetchone()[0]) + 1
+            cur = self.conn.executemany("UPDATE points SET payload = NULL, seq = ? WHERE id = ? AND payload IS NOT NULL",
+                                        [(seq, json.dumps(i)) for i in ids])
+            deleted = cur.rowcount
+            self.conn.execute("UPDATE meta SET value = ? WHERE key = 'seq'", (str(seq),))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.data_version = None
+        return max(0, deleted)
+
+    def retrieve(self, ids: List[Any], with_payload: bool) -> List[dict]:
+        self.sync()
+        out = []
+        for i in ids:
+            row = self.row_of.get(json.dumps(i))
+            if row is not None and self.alive[row]:
+                out.append({"id": self.ids[row], **({"payload": self.payloads[row]} if with_payload else {})})
+        return out
+
+    def scroll(self, flt, limit, offset, with_payload) -> Tuple[List[dict], Any]:
+        self.sync()
+        mask = self.alive.copy()
+        if flt:
+            mask &= self.filter_mask(flt)
+        rows = np.flatnonzero(mask[int(offset or 0):]) + int(offset or 0)
+        page = rows[:limit]
+        nxt = int(rows[limit]) if rows.size > limit else None
+        return [{"id": self.ids[r], **({"payload": self.payloads[r]} if with_payload else {})} for r in page], nxt
+
+class EmbeddedStore(VectorStore):
+    backend = "embedded"
+
+    def __init__(self, root: str = VECTOR_DIR, dtype: str = VECTOR_DTYPE):
+        super().__init__()
+        self.root = root
+        self.dtype = dtype
+        self._collections: Dict[str, _Collection] = {}
+        self._lock = threading.Lock()
+
+    def _dir(self, collection: str) -> str:
+        if not collection or "/" in collection or collection.startswith("."):
+            raise VectorStoreError(f"Invalid collection name: {collection}")
+        return os.path.join(self.root, collection)
+
+    def _get(self, collection: str) -> _Collection:
+        """collection ที่เปิดไว้ (เปิดใหม่ถ้าถูก drop/สร้างใหม่โดย process อื่น)"""
+        path = self._dir(collection)
+        with self._lock:
+            c = self._collections.get(collection)
+            try:
+                ino = os.stat(os.path.join(path, "points.db")).st_ino
+            except FileNotFoundError:
+                ino = None
+            if c is not None and c.ino != ino:
+                self._collections.pop(collection, None)
+                c.close()
+                c = None
+            if c is None:
+                if ino is None:
+                    raise VectorStoreError(f"Collection not found: {collection}")
+                c = self._collections[collection] = _Collection(path)
+            return c
+
+    async def _run(self, collection: str, fn, *args):
+        def call():
+            c = self._get(collection)
+            with c.lock:
+                return getattr(c, fn)(*args)
+        try:
+            return await asyncio.to_thread(call)
+        except VectorStoreError:
+            self.errors += 1
+            raise
+        except Exception as e:
+            self.errors += 1
+            raise VectorStoreError(f"Embedded vector store {fn} error: {e}") from e
+
+    async def ensure_collection(self, collection: str, dim: int, distance: str = "Cosine") -> bool:
+        if distance != "Cosine":
+            raise VectorStoreError(f"Embedded vector store supports only Cosine distance, got {distance}")
+        path = self._dir(collection)
+        if os.path.exists(os.path.join(path, "points.db")):
+            return False
+        logger.info(f"Creating embedded collection: {path}")
+        await asyncio.to_thread(_Collection.create, path, dim, self.dtype)
+        return True
+
+    async def drop_collection(self, collection: str) -> None:
+        path = self._dir(collection)
+        with self._lock:
+            c = self._collections.pop(collection, None)
+        if c is not None:
+            with c.lock:
+                c.close()
+        await asyncio.to_thread(shutil.rmtree, path, True)
+
+    async def search(self, collection, vector, limit, score_threshold=None, filter=None, with_payload=True, with_vector=False):
+        t0 = time.perf_counter()
+        hits = await self._run(collection, "search", vector, limit, score_threshold, filter, with_payload, with_vector)
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - t0
+        return hits
+
+    async def upsert(self, collection, points):
+        if not points:
+            return 0
+        n = await self._run(collection, "upsert", points)
+        self.upserted += n
+        return n
+
+    async def retrieve(self, collection, ids, with_payload=True):
+        return await self._run(collection, "retrieve", list(ids), with_payload) if ids else []
+
+    async def delete(self, collection, ids):
+        if not ids:
+            return 0
+        n = await self._run(collection, "delete", list(ids))
+        self.deleted += n
+        return n
+
+    async def scroll(self, collection, filter=None, limit=256, offset=None, with_payload=True):
+        return await self._run(collection, "scroll", filter, limit, offset, with_payload)
+
+    def stats(self) -> Dict[str, object]:
+        out = super().stats()
+        out["path"] = self.root
+        out["collections"] = {name: int(c.alive.sum()) for name, c in list(self._collections.items())}
+        return out
+
+# ---- Search result cache ----
+class CachedStore(VectorStore):
+    """ครอบ store จริงด้วย SearchCache: search ที่ซ้ำได้ผลจาก cache, ทุกการเขียนเลื่อน write epoch
+    ของ collection นั้น (ทำเสมอแม้ cache ของ process นี้ปิดอยู่ เพราะ backend อาจเปิดไว้)"""
+
+    def __init__(self, inner: VectorStore, cache: SearchCache):
+        super().__init__()
+        self.inner = inner
+        self.cache = cache
+        self.backend = inner.backend
+
+    async def ensure_collection(self, collection, dim, distance="Cosine"):
+        created = await self.inner.ensure_collection(collection, dim, distance)
+        if created:
+            self.cache.bump(collection)
+        return created
+
+    async def drop_collection(self, collection):
+        try:
+            await self.inner.drop_collection(collection)
+        finally:
+            self.cache.bump(collection)
+
+    async def search(self, collection, vector, limit, score_threshold=None, filter=None, with_payload=True, with_vector=False):
+        if not self.cache.enabled:
+            return await self.inner.search(collection, vector, limit, score_threshold, filter, with_payload, with_vector)
+        key = self.cache.key(collection, vector, limit, score_threshold, filter, with_payload, with_vector)
+        hits, epoch = self.cache.lookup(key)
+        if hits is None:
+            hits = await self.inner.search(collection, vector, limit, score_threshold, filter, with_payload, with_vector)
+            self.cache.store(key, epoch, hits)
+        return hits
+
+    async def upsert(self, collection, points):
+        if not points:
+            return 0
+        try:
+            return await self.inner.upsert(collection, points)
+        finally:
+            self.cache.bump(collection)
+
+    async def retrieve(self, collection, ids, with_payload=True):
+        return await self.inner.retrieve(collection, ids, with_payload)
+
+    async def delete(self, collection, ids):
+        if not ids:
+            return 0
+        try:
+            return await self.inner.delete(collection, ids)
+        finally:
+            self.cache.bump(collection)
+
+    async def scroll(self, collection, filter=None, limit=256, offset=None, with_payload=True):
+        return await self.inner.scroll(collection, filter, limit, offset, with_payload)
+
+    def stats(self) -> Dict[str, object]:
+        return self.inner.stats()
+
+def open_store(client: Optional[httpx.AsyncClient] = None) -> VectorStore:
+    """store ตาม VECTOR_BACKEND (สคริปต์ส่ง httpx client ของตัวเองมาได้) ครอบด้วย search cache
+    write epoch แยกตาม store_location() ทุก process ที่ใช้ store เดียวกันจึงเห็น epoch เดียวกัน"""
+    store = EmbeddedStore() if VECTOR_BACKEND == "embedded" else QdrantStore(client=client)
+    key = hashlib.sha1(store_location().encode()).hexdigest()[:16]
+    return CachedStore(store, SearchCache(WriteEpochs(os.path.join(EPOCH_DIR, key))))
+
+vector_store = open_store()
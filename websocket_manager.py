@@ -50,4 +50,12 @@ class ConnectionManager:
                     failed_connection = self.active_connections[room_id][i]
                     logger.error(f"Failed to send message to a websocket in room '{room_id}': {result}")
                     # อาจจะ disconnect client ที่มีปัญหาออกจากตรงนี้ได้
-                    # self.disconnect(failed_connection, room_id)
\ No newline at end of file
+                    # self.disconnect(failed_connection, room_id)
+
+    async def broadcast_delta(self, room_id: str, stream_id: str, username: str, delta: str):
+        """ส่งชิ้นข้อความที่กำลัง stream อยู่ (frame ชนิด chat_delta) ให้ทุกคนในห้อง
+
+        client รวม delta ที่มี stream_id เดียวกันเข้าด้วยกัน แล้วแทนที่ด้วยข้อความ
+        type=chat ที่มี stream_id เดียวกันเมื่อคำตอบเสร็จ
+        """
+        await self.broadcast(room_id, {"type": "chat_delta", "stream_id": stream_id, "username": username, "delta": delta})